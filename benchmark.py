@@ -0,0 +1,472 @@
+"""Офлайн бенчмарк обработчиков бота на фейковых серверах без подключения к Discord.
+
+Пример: python benchmark.py --guilds 5 --channels 20 --members 500 --events 20000 --json result.json
+Сравнение версий: python benchmark.py ... --compare result.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import tempfile
+import contextlib
+import tracemalloc
+import shutil
+
+MOD_ROLE = 1001
+ADMIN_ROLE = 1002
+CATEGORY = 2001
+OTHER_CATEGORY = 2002
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк бота на фейковых серверах")
+    parser.add_argument('--guilds', type=int, default=2, help="число серверов")
+    parser.add_argument('--shards', type=int, default=1, help="шардов (серверы распределяются по кругу)")
+    parser.add_argument('--channels', type=int, default=10, help="голосовых каналов на сервер")
+    parser.add_argument('--members', type=int, default=200, help="участников на сервер")
+    parser.add_argument('--moderators', type=float, default=0.1, help="доля модераторов среди участников")
+    parser.add_argument('--occupancy', type=float, default=0.3, help="доля участников в каналах на старте")
+    parser.add_argument('--events', type=int, default=5000, help="число голосовых событий")
+    parser.add_argument('--rate', type=float, default=0, help="событий в секунду (0 - без ограничения)")
+    parser.add_argument('--sweeps', type=int, default=5, help="итераций фоновой проверки")
+    parser.add_argument('--reports', type=int, default=200, help="вызовов send_report")
+    parser.add_argument('--months', type=int, default=3, help="месяцев синтетической истории")
+    parser.add_argument('--sessions-per-day', type=int, default=2, help="сессий модератора в день в истории")
+    parser.add_argument('--coefficient-moderators', type=int, default=10000, help="модераторов в сравнении скалярного и пакетного расчета K")
+    parser.add_argument('--state-sessions', type=int, default=10000, help="открытых сессий в замере памяти и прохода аудита (0 - пропустить)")
+    parser.add_argument('--storage', choices=('files', 'sqlite'), default='files', help="бэкенд хранилища")
+    parser.add_argument('--seed', type=int, default=1, help="зерно генератора событий")
+    parser.add_argument('--tracemalloc', action='store_true', help="считать пик памяти Python (замедляет прогон)")
+    parser.add_argument('--json', help="сохранить результаты в файл")
+    parser.add_argument('--compare', help="сравнить с результатами из файла")
+    parser.add_argument('--data-dir', help="каталог данных (по умолчанию временный)")
+    parser.add_argument('--verbose', action='store_true', help="не скрывать журнал бота")
+    return parser.parse_args(argv)
+
+def prepare_env(args, data_dir: str):
+    """Переменные окружения выставляются до импорта main, .env их не перекрывает"""
+    os.environ['DISCORD_TOKEN'] = 'benchmark'
+    os.environ['MOD_ROLE_ID'] = str(MOD_ROLE)
+    os.environ['ADMIN_ROLE_ID'] = str(ADMIN_ROLE)
+    os.environ['ALLOWED_CATEGORIES'] = str(CATEGORY)
+    os.environ['BOT_DATA_DIR'] = data_dir
+    os.environ['STORAGE_BACKEND'] = args.storage
+    os.environ['SQLITE_PATH'] = os.path.join(data_dir, 'bot.db')
+    os.environ['METRICS_PORT'] = '0'
+    # Сжатие логов запускается из бенчмарка явно, чтобы измерить его отдельно
+    os.environ['LOG_COMPACT_INTERVAL'] = '0'
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def latency_stats(values: list) -> dict:
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 0.5) * 1000 if values else None,
+        'p99_ms': percentile(values, 0.99) * 1000 if values else None,
+        'max_ms': max(values) * 1000 if values else None
+    }
+
+def build_world(args, fakes):
+    rng = random.Random(args.seed)
+    guilds = []
+    for g in range(args.guilds):
+        guild = fakes.FakeGuild(10_000 + g, g % args.shards)
+        mod_role = fakes.FakeRole(MOD_ROLE, guild)
+        for c in range(args.channels):
+            # Каждый десятый канал вне разрешенной категории, как служебные каналы на живом сервере
+            category = OTHER_CATEGORY if c % 10 == 9 else CATEGORY
+            guild.add_channel(100_000 + g * 1000 + c, category)
+        for m in range(args.members):
+            roles = [mod_role] if rng.random() < args.moderators else []
+            guild.add_member(1_000_000 + g * 100_000 + m, roles)
+        guilds.append(guild)
+    return guilds
+
+def write_history(base_dir: str, guilds: list, args, storage_module) -> int:
+    """Синтетическая история: голосовые сессии и доклады модераторов за несколько месяцев"""
+    rng = random.Random(args.seed + 1)
+    now = datetime.datetime.now()
+    days = args.months * 30
+    lines = 0
+    for folder in storage_module.DATA_FOLDERS:
+        os.makedirs(os.path.join(base_dir, folder), exist_ok=True)
+    voice_folder, voice_suffix = storage_module.FOLDER_MAP['voice']
+    report_folder, report_suffix = storage_module.FOLDER_MAP['report']
+    for guild in guilds:
+        for member in guild.members.values():
+            if not member.roles:
+                continue
+            voice = []
+            reports = []
+            for day in range(days, 0, -1):
+                date = now - datetime.timedelta(days=day)
+                for _ in range(args.sessions_per_day):
+                    start = date.replace(hour=rng.randrange(24), minute=rng.randrange(60))
+                    channel = rng.choice(guild.voice_channels)
+                    voice.append(storage_module.format_voice_line(member.id, channel.id, start, rng.randrange(60, 4 * 3600)))
+                if day % 7 == 0:
+                    text = f"Еженедельный доклад: проверено {rng.randrange(5, 50)} жалоб, выдано {rng.randrange(10)} предупреждений"
+                    reports.append(storage_module.format_report(member.id, date.strftime(storage_module.DATE_FORMAT), text))
+            with open(os.path.join(base_dir, voice_folder, f"{member.id}{voice_suffix}"), 'w', encoding='utf-8') as f:
+                f.write(''.join(voice))
+            with open(os.path.join(base_dir, report_folder, f"{member.id}{report_suffix}"), 'w', encoding='utf-8') as f:
+                f.write(''.join(reports))
+            lines += len(voice) + len(reports)
+    return lines
+
+class VoiceSimulation:
+    """Случайные входы, выходы и перемещения; состав каналов меняется до события, как в Discord"""
+
+    def __init__(self, guilds: list, fakes, seed: int):
+        self.fakes = fakes
+        self.rng = random.Random(seed)
+        self.members = [member for guild in guilds for member in guild.members.values()]
+        self.location = {}
+
+    def move(self, member, channel):
+        previous = self.location.pop(member.id, None)
+        if previous is not None:
+            previous.members.remove(member)
+        if channel is not None:
+            channel.members.append(member)
+            self.location[member.id] = channel
+        return previous
+
+    def populate(self, share: float):
+        for member in self.members:
+            if self.rng.random() < share:
+                self.move(member, self.rng.choice(member.guild.voice_channels))
+
+    def next_event(self):
+        member = self.rng.choice(self.members)
+        current = self.location.get(member.id)
+        if current is None:
+            target = self.rng.choice(member.guild.voice_channels)
+        elif self.rng.random() < 0.5:
+            target = None
+        else:
+            target = self.rng.choice(member.guild.voice_channels)
+        before = self.move(member, target)
+        return member, self.fakes.FakeVoiceState(before), self.fakes.FakeVoiceState(target)
+
+def coefficient_benchmark(count: int, seed: int) -> dict:
+    """Скалярный calculate_coefficient в цикле против пакетного расчета по столбцам"""
+    import coefficients
+    rng = random.Random(seed)
+    params = {
+        str(i): {
+            'B': rng.randrange(0, 120), 'S': rng.randrange(0, 36), 'D': rng.choice((0.8, 1.0, 1.1)),
+            'P': rng.choice((0.9, 1.0)), 'A': rng.choice((1.0, 1.1, 1.2)), 'F': rng.choice((1.0, 1.1, 1.2)),
+            'Q': rng.choice((0.8, 0.9, 1.0))
+        }
+        for i in range(count)
+    }
+    started = time.perf_counter()
+    scalar = [coefficients.calculate_coefficient(**values) for values in params.values()]
+    scalar_s = time.perf_counter() - started
+    started = time.perf_counter()
+    _, columns = coefficients.columns_from_params(params)
+    columns_s = time.perf_counter() - started
+    started = time.perf_counter()
+    batch = coefficients.batch_coefficients(columns)
+    batch_s = time.perf_counter() - started
+    mismatches = sum(
+        1 for a, b in zip(scalar, batch)
+        if (a is None) != (b is None) or (a is not None and abs(a - b) > 1e-9)
+    )
+    return {
+        'numpy': coefficients.np is not None,
+        'moderators': count,
+        'scalar_ms': scalar_s * 1000,
+        'columns_ms': columns_s * 1000,
+        'batch_ms': batch_s * 1000,
+        'mismatches': mismatches
+    }
+
+async def log_query_benchmark(storage, guilds, args) -> dict:
+    """Страница логов за неделю в середине истории и последние записи по нескольким модераторам"""
+    moderators = [member for guild in guilds for member in guild.members.values() if member.roles][:50]
+    start = (datetime.datetime.now() - datetime.timedelta(days=args.months * 15)).timestamp()
+    ranged, tails = [], []
+    for member in moderators:
+        started = time.perf_counter()
+        await storage.voice_log_entries(member.id, start, start + 7 * 86400, 0, 20)
+        ranged.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        await storage.voice_log_tail(member.id, 20)
+        tails.append(time.perf_counter() - started)
+    return {'range': latency_stats(ranged), 'tail': latency_stats(tails)}
+
+async def report_search_benchmark(storage, guilds, args) -> dict:
+    """Построение поискового индекса докладов и запросы: общие, по началу слова и по одному модератору"""
+    started = time.perf_counter()
+    documents = await storage.rebuild_report_index()
+    build_s = time.perf_counter() - started
+    moderators = [member for guild in guilds for member in guild.members.values() if member.roles][:20]
+    queries = [('жалоб', None), ('предупрежд*', None), ('проверка доклад*', None)]
+    queries += [('жалоб', member.id) for member in moderators]
+    latencies = []
+    for _ in range(5):
+        for text, user_id in queries:
+            started = time.perf_counter()
+            await storage.search_reports(text, user_id, None, None, 0, 10)
+            latencies.append(time.perf_counter() - started)
+    return {'documents': documents, 'build_s': build_s, 'query': latency_stats(latencies)}
+
+async def export_benchmark(storage, data_dir: str) -> dict:
+    """Полная выгрузка голосовых сессий и докладов в CSV и в сжатый JSONL"""
+    from export import export
+    results = {}
+    for kind in ('voice', 'reports'):
+        for fmt, compress in (('csv', False), ('jsonl', True)):
+            started = time.perf_counter()
+            paths, count = await export(storage, kind, fmt, os.path.join(data_dir, 'exports'), compress=compress)
+            results[f"{kind}_{fmt}"] = {
+                'rows': count, 'seconds': time.perf_counter() - started,
+                'bytes': sum(os.path.getsize(path) for path in paths)
+            }
+    shutil.rmtree(os.path.join(data_dir, 'exports'), ignore_errors=True)
+    return results
+
+def session_state_benchmark(count: int, seed: int) -> dict:
+    """Память на сессию и проход аудита по count открытым сессиям: прежние словари против Session"""
+    from operator import attrgetter, itemgetter
+    from contacts import ContactLog
+    from sessions import Session
+    rng = random.Random(seed)
+    channels = {user_id: rng.randrange(count // 10 + 1) for user_id in range(count)}
+    variants = {
+        'dict': (lambda user_id: {
+            'guild_id': user_id % 10, 'channel': channels[user_id],
+            'start_time': datetime.datetime.now(), 'contacts': ContactLog()
+        }, itemgetter('channel')),
+        'slots': (lambda user_id: Session(user_id % 10, channels[user_id], ContactLog()), attrgetter('channel'))
+    }
+    tracing = tracemalloc.is_tracing()
+    results = {}
+    for name, (build, channel_of) in variants.items():
+        if not tracing:
+            tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        guilds = {}
+        for user_id in range(count):
+            guilds.setdefault(user_id % 10, {})[user_id] = build(user_id)
+        size = tracemalloc.get_traced_memory()[0] - before
+        if not tracing:
+            tracemalloc.stop()
+        # Проход как в audit_guild: канал каждой сессии сверяется с индексом занятости
+        latencies = []
+        for _ in range(5):
+            started = time.perf_counter()
+            moved = 0
+            for sessions in guilds.values():
+                for user_id, session in sessions.items():
+                    if channels.get(user_id) != channel_of(session):
+                        moved += 1
+            latencies.append(time.perf_counter() - started)
+        results[name] = {'bytes_per_session': size / count, 'sweep_ms': min(latencies) * 1000}
+        del guilds
+    return results
+
+def memory_stats() -> dict:
+    from memstats import peak_rss
+    stats = {'maxrss_mb': peak_rss() / 1024 / 1024}
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        stats['python_current_mb'] = current / 1024 / 1024
+        stats['python_peak_mb'] = peak / 1024 / 1024
+    return stats
+
+async def run(args, data_dir: str) -> dict:
+    import main
+    import fakes
+    from logger import shutdown_logging
+    import storage as storage_module
+    import pipeline
+
+    guilds = build_world(args, fakes)
+    guild_map = {guild.id: guild for guild in guilds}
+    channel_map = {channel.id: channel for guild in guilds for channel in guild.voice_channels}
+    main.ModeratorBot.guilds = property(lambda self: guilds)
+    main.bot.get_guild = guild_map.get
+    main.bot.get_channel = channel_map.get
+    results = {'params': {key: value for key, value in vars(args).items() if key not in ('json', 'compare', 'data_dir', 'verbose')}}
+
+    started = time.perf_counter()
+    results['history_lines'] = write_history(main.BASE_DIR, guilds, args, storage_module)
+    main.init_folders()
+    main.writer.start()
+    await main.storage.start()
+    if isinstance(main.storage, storage_module.SQLiteStorage):
+        await main.storage.import_files(main.BASE_DIR, force=True)
+    else:
+        await main.storage.rebuild()
+    results['history_load_s'] = time.perf_counter() - started
+
+    if not isinstance(main.storage, storage_module.SQLiteStorage):
+        started = time.perf_counter()
+        compacted = await main.storage.compact()
+        results['log_compaction'] = {'entries': compacted, 's': time.perf_counter() - started}
+        started = time.perf_counter()
+        await main.storage.rebuild()
+        results['log_compaction']['rebuild_s'] = time.perf_counter() - started
+    results['log_queries'] = await log_query_benchmark(main.storage, guilds, args)
+
+    simulation = VoiceSimulation(guilds, fakes, args.seed)
+    simulation.populate(args.occupancy)
+    started = time.perf_counter()
+    for channel_id in main.occupancy.rebuild(main.iter_voice_members()):
+        await main.reconcile_channel(channel_map[channel_id])
+    results['startup_index_s'] = time.perf_counter() - started
+
+    # Дальше сессии меняет очередь событий, как в боте после setup_hook
+    main.session_events.start()
+    latencies = []
+    interval = 1 / args.rate if args.rate > 0 else 0
+    started = time.perf_counter()
+    for i in range(args.events):
+        if interval:
+            delay = started + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        member, before, after = simulation.next_event()
+        event_started = time.perf_counter()
+        await main.on_voice_state_update(member, before, after)
+        latencies.append(time.perf_counter() - event_started)
+        # Как в event loop бота: между событиями шлюза очередь сессий успевает их разобрать
+        await asyncio.sleep(0)
+    await main.session_events.join()
+    elapsed = time.perf_counter() - started
+    results['voice_state_update'] = latency_stats(latencies)
+    results['voice_state_update']['events_per_s'] = args.events / elapsed if elapsed else None
+    results['session_events'] = {
+        'processed': main.session_events.processed,
+        'batches': main.session_events.batches,
+        'coalesced': sum(main.voice_events_coalesced.values.values()),
+        'queue_waits': main.session_events.waits,
+        'wait_p99_ms': (pipeline.event_wait_seconds.quantile(0.99) or 0) * 1000
+    }
+    results['active_sessions'] = len(main.active_sessions)
+
+    sweeps = []
+    for _ in range(args.sweeps):
+        sweep_started = time.perf_counter()
+        await main.run_voice_audit()
+        await main.session_events.join()
+        sweeps.append(time.perf_counter() - sweep_started)
+    results['voice_audit'] = latency_stats(sweeps)
+
+    moderators = [member for guild in guilds for member in guild.members.values() if member.roles]
+    rng = random.Random(args.seed + 2)
+    report_latencies = []
+    for i in range(args.reports if moderators else 0):
+        ctx = fakes.FakeContext(rng.choice(moderators))
+        report_started = time.perf_counter()
+        await main.send_report.callback(ctx, report_text=f"Доклад бенчмарка №{i}: " + "проверка " * rng.randrange(2, 40))
+        report_latencies.append(time.perf_counter() - report_started)
+    results['send_report'] = latency_stats(report_latencies)
+    results['report_search'] = await report_search_benchmark(main.storage, guilds, args)
+
+    await main.session_events.stop()
+    main.closing_sessions.settle_all()
+    results['sessions_coalesced'] = main.closing_sessions.coalesced
+    results['sessions_recorded'] = sum(main.sessions_stopped.values.values())
+
+    started = time.perf_counter()
+    await main.writer.flush()
+    await main.storage.flush()
+    results['flush_s'] = time.perf_counter() - started
+    results['export'] = await export_benchmark(main.storage, data_dir)
+
+    if moderators:
+        started = time.perf_counter()
+        await main.generate_report.callback(fakes.FakeContext(moderators[0]))
+        job = main.report_jobs.last
+        results['generate_report'] = {
+            'wall_s': time.perf_counter() - started,
+            'job_s': job.elapsed if job else None,
+            'state': job.state if job else None,
+            'moderators': job.total if job else 0
+        }
+        # Повторная генерация после докладов нескольких модераторов пересчитывает только их
+        for member in moderators[:5]:
+            await main.send_report.callback(fakes.FakeContext(member), report_text="Доклад между генерациями отчетов")
+        started = time.perf_counter()
+        await main.generate_report.callback(fakes.FakeContext(moderators[0]))
+        job = main.report_jobs.last
+        results['generate_report_incremental'] = {
+            'wall_s': time.perf_counter() - started,
+            'job_s': job.elapsed if job else None,
+            'rendered': job.rendered if job else 0,
+            'reused': job.reused if job else 0
+        }
+
+    if args.coefficient_moderators:
+        results['coefficients'] = coefficient_benchmark(args.coefficient_moderators, args.seed)
+    if args.state_sessions:
+        results['session_state'] = session_state_benchmark(args.state_sessions, args.seed)
+    results['memory'] = memory_stats()
+    main.report_jobs.shutdown()
+    await main.journal.stop()
+    await main.storage.close()
+    await main.writer.stop()
+    shutdown_logging()
+    return results
+
+def flatten(data: dict, prefix: str = '') -> dict:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def print_results(results: dict, baseline: dict = None):
+    current = flatten({key: value for key, value in results.items() if key != 'params'})
+    previous = flatten({key: value for key, value in baseline.items() if key != 'params'}) if baseline else {}
+    width = max(len(name) for name in current)
+    for name, value in current.items():
+        line = f"{name:<{width}}  {value:>12.3f}" if isinstance(value, float) else f"{name:<{width}}  {value:>12}"
+        old = previous.get(name)
+        if old:
+            line += f"  ({(value - old) / old * 100:+.1f}% к {old:.3f})"
+        print(line)
+
+def main_cli(argv=None):
+    args = parse_args(argv)
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='bot-benchmark-')
+    os.makedirs(data_dir, exist_ok=True)
+    prepare_env(args, data_dir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if args.tracemalloc:
+        tracemalloc.start()
+    try:
+        with contextlib.ExitStack() as stack:
+            if not args.verbose:
+                devnull = stack.enter_context(open(os.devnull, 'w', encoding='utf-8'))
+                stack.enter_context(contextlib.redirect_stdout(devnull))
+            results = asyncio.run(run(args, data_dir))
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,139 @@
+from operator import itemgetter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PARAMETERS = ('B', 'S', 'D', 'P', 'A', 'F', 'Q')
+DEFAULT_FORMULA = {
+    'threshold': 40,
+    'threshold_low': 25,
+    'low_position': 0.8,
+    'b_scale': 200,
+    's_factor': 0.05
+}
+OPERATIONS = {
+    '=': lambda column, value: value,
+    '+=': lambda column, value: column + value,
+    '-=': lambda column, value: column - value,
+    '*=': lambda column, value: column * value
+}
+
+def engine_name() -> str:
+    return 'numpy' if np is not None else 'python'
+
+def calculate_coefficient(B, S, D, P, A, F, Q, formula: dict = None):
+    f = formula or DEFAULT_FORMULA
+    try:
+        # Проверка на "плохого" модератора
+        is_bad_moderator = B < f['threshold_low'] if D == f['low_position'] else B < f['threshold']
+
+        if is_bad_moderator:
+            # Формула для плохих модераторов
+            K = 1 / ((1 - B / f['b_scale']) * (1 - f['s_factor'] * S) * (1 / D) * (1 / P) * (1 / A) * (1 / F) * (1 / Q))
+        else:
+            # Формула для хороших модераторов
+            K = 1 / ((1 + B / f['b_scale']) * (1 + f['s_factor'] * S) * D * P * A * F * Q)
+
+        return K
+    except ZeroDivisionError:
+        return None
+
+def columns_from_params(params: dict):
+    """{user_id: {'B': ..}} -> (user_ids, {параметр: столбец}); неполные наборы пропускаются"""
+    getter = itemgetter(*PARAMETERS)
+    user_ids = []
+    rows = []
+    for user_id, values in params.items():
+        try:
+            row = getter(values)
+        except KeyError:
+            continue
+        if None not in row:
+            user_ids.append(user_id)
+            rows.append(row)
+    if np is not None:
+        matrix = np.array(rows, dtype=np.float64).reshape(len(rows), len(PARAMETERS))
+        return user_ids, {name: matrix[:, i] for i, name in enumerate(PARAMETERS)}
+    columns = zip(*rows) if rows else ([] for _ in PARAMETERS)
+    return user_ids, {name: [float(value) for value in column] for name, column in zip(PARAMETERS, columns)}
+
+def _batch_numpy(c: dict, f: dict) -> list:
+    B, S, D, P, A, F, Q = (c[name] for name in PARAMETERS)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        is_bad = np.where(D == f['low_position'], B < f['threshold_low'], B < f['threshold'])
+        bad = (1 - B / f['b_scale']) * (1 - f['s_factor'] * S) * (1 / D) * (1 / P) * (1 / A) * (1 / F) * (1 / Q)
+        good = (1 + B / f['b_scale']) * (1 + f['s_factor'] * S) * D * P * A * F * Q
+        denominator = np.where(is_bad, bad, good)
+        K = 1 / denominator
+    # Деление на ноль в скалярной версии дает None: здесь это бесконечности и NaN
+    valid = np.isfinite(denominator) & (denominator != 0) & np.isfinite(K)
+    return [float(value) if ok else None for value, ok in zip(K.tolist(), valid.tolist())]
+
+def _batch_python(c: dict, f: dict) -> list:
+    return [calculate_coefficient(*values, formula=f) for values in zip(*(c[name] for name in PARAMETERS))]
+
+def batch_coefficients(columns: dict, formula: dict = None) -> list:
+    """Коэффициенты для столбцов параметров за один проход (NumPy, если установлен)"""
+    f = dict(DEFAULT_FORMULA, **(formula or {}))
+    if np is not None and isinstance(columns['B'], np.ndarray):
+        return _batch_numpy(columns, f)
+    return _batch_python(columns, f)
+
+def adjust_columns(columns: dict, adjustments: list) -> dict:
+    """Применяет [(параметр, операция, значение)] ко всем модераторам сразу"""
+    adjusted = dict(columns)
+    for name, operation, value in adjustments:
+        column = adjusted[name]
+        if np is not None and isinstance(column, np.ndarray):
+            result = OPERATIONS[operation](column, value)
+            adjusted[name] = np.broadcast_to(result, column.shape).astype(np.float64)
+        else:
+            adjusted[name] = [OPERATIONS[operation](item, value) for item in column]
+    return adjusted
+
+def parse_scenario(args) -> dict:
+    """B+=5 S*=1.1 Q=1 threshold=45 threshold_low=20..40:5 -> изменения параметров, формулы и перебор"""
+    scenario = {'adjustments': [], 'formula': {}, 'sweep': None}
+    for arg in args:
+        for operation in ('+=', '-=', '*=', '='):
+            name, found, raw = arg.partition(operation)
+            if found:
+                break
+        else:
+            raise ValueError(f"Непонятный аргумент: {arg}")
+        if name in PARAMETERS:
+            scenario['adjustments'].append((name, operation, float(raw)))
+        elif name in DEFAULT_FORMULA and operation == '=':
+            if '..' in raw:
+                if scenario['sweep'] is not None:
+                    raise ValueError("Перебирать можно только одну настройку формулы")
+                bounds, _, step = raw.partition(':')
+                start, _, end = bounds.partition('..')
+                start, end, step = float(start), float(end), float(step or 1)
+                if step <= 0 or end < start or (end - start) / step > 100:
+                    raise ValueError(f"Некорректный диапазон: {raw}")
+                count = int(round((end - start) / step)) + 1
+                scenario['sweep'] = (name, [round(start + i * step, 10) for i in range(count)])
+            else:
+                scenario['formula'][name] = float(raw)
+        else:
+            raise ValueError(f"Неизвестный параметр: {name}")
+    return scenario
+
+def ranking(user_ids: list, values: list) -> dict:
+    """user_id -> место по убыванию K; модераторы без коэффициента не ранжируются"""
+    ordered = sorted((-K, user_id) for user_id, K in zip(user_ids, values) if K is not None)
+    return {user_id: place for place, (_, user_id) in enumerate(ordered, 1)}
+
+def compare_rankings(user_ids: list, base: list, changed: list) -> list:
+    """[(user_id, место было, место стало, K было, K стало)] в порядке нового рейтинга"""
+    base_ranks = ranking(user_ids, base)
+    new_ranks = ranking(user_ids, changed)
+    rows = [
+        (user_id, base_ranks.get(user_id), new_ranks.get(user_id), old, new)
+        for user_id, old, new in zip(user_ids, base, changed)
+    ]
+    rows.sort(key=lambda row: (row[2] is None, row[2] or 0))
+    return rows
@@ -0,0 +1,62 @@
+class ContactLog:
+    """Время, проведенное модератором с каждым пользователем за сессию.
+
+    Пользователь находится только в одном канале, поэтому его интервалы с модератором
+    не пересекаются: при выходе интервал сразу сворачивается в сумму, а открытым остается
+    только время входа. Вход и выход - O(1), сколько бы пользователей ни сменилось.
+    """
+
+    __slots__ = ('open', 'closed')
+
+    def __init__(self, totals: dict = None):
+        self.open = {}
+        self.closed = {int(user_id): seconds for user_id, seconds in (totals or {}).items()}
+
+    def join(self, user_id: int, ts: float):
+        if user_id not in self.open:
+            self.open[user_id] = ts
+            self.closed.setdefault(user_id, 0.0)
+
+    def leave(self, user_id: int, ts: float):
+        started = self.open.pop(user_id, None)
+        if started is not None:
+            self.closed[user_id] += max(ts - started, 0.0)
+
+    def sync(self, users, ts: float):
+        """Сверяет открытые интервалы с составом канала (после переподключения или аудита)"""
+        for user_id in [user_id for user_id in self.open if user_id not in users]:
+            self.leave(user_id, ts)
+        for user_id in users:
+            self.join(user_id, ts)
+
+    def pause(self, ts: float):
+        for user_id in list(self.open):
+            self.leave(user_id, ts)
+
+    def totals(self, ts: float = None) -> dict:
+        """user_id -> секунды; открытые интервалы считаются до ts"""
+        totals = dict(self.closed)
+        if ts is not None:
+            for user_id, started in self.open.items():
+                totals[user_id] += max(ts - started, 0.0)
+        return totals
+
+def format_contacts(totals: dict) -> str:
+    """{user_id: секунды} -> '123:450,456:30' для строки голосового лога"""
+    return ','.join(f"{user_id}:{int(seconds)}" for user_id, seconds in sorted(totals.items(), key=lambda item: -item[1]))
+
+def parse_contacts(value: str) -> dict:
+    contacts = {}
+    for pair in value.split(','):
+        user_id, _, seconds = pair.partition(':')
+        if user_id and seconds:
+            contacts[user_id.strip()] = int(seconds)
+    return contacts
+
+def merge_contacts(target: dict, contacts: dict):
+    for user_id, seconds in contacts.items():
+        key = str(user_id)
+        target[key] = target.get(key, 0) + int(seconds)
+
+def top_contacts(contacts: dict, count: int = 5) -> list:
+    return sorted(contacts.items(), key=lambda item: (-item[1], item[0]))[:count]
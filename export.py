@@ -0,0 +1,236 @@
+"""Потоковая выгрузка сессий, докладов, коэффициентов и итогов в CSV или JSON Lines.
+
+Записи читаются из хранилища по одной и сразу пишутся в файл, поэтому память не растет
+с объемом истории. Большие выгрузки делятся на части не больше заданного размера.
+
+Пример: python export.py voice --format csv --from 01.01.2026 --to 31.01.2026 --gzip -o exports
+"""
+import io
+import os
+import csv
+import gzip
+import json
+import time
+import asyncio
+import argparse
+import datetime
+from logger import log
+from metrics import registry
+from contacts import format_contacts
+from coefficients import PARAMETERS
+from reports import snapshot_summaries
+
+FORMATS = ('csv', 'jsonl')
+# Вид выгрузки -> вид записей хранилища
+SOURCES = {
+    'voice': 'voice',
+    'reports': 'report',
+    'coefficients': 'info'
+}
+FIELDS = {
+    'voice': ('moderator_id', 'channel_id', 'start', 'seconds', 'contacts'),
+    'reports': ('moderator_id', 'date', 'text'),
+    'coefficients': ('moderator_id', 'coefficient') + PARAMETERS,
+    'summary': ('moderator_id', 'sessions', 'total_seconds', 'first_start', 'last_end',
+                'report_count', 'coefficient', 'contacts')
+}
+KINDS = tuple(FIELDS)
+# Запас на данные, которые gzip еще держит в буфере и не отдал в файл
+GZIP_MARGIN = 256 * 1024
+
+export_rows = registry.counter('bot_export_rows_total', 'Выгружено записей по видам выгрузки')
+export_seconds = registry.histogram('bot_export_seconds', 'Время выгрузки')
+
+def iso(ts):
+    return datetime.datetime.fromtimestamp(ts).isoformat(timespec='seconds') if ts is not None else None
+
+def voice_rows(records):
+    for user_id, channel_id, start, seconds, contacts in records:
+        yield {'moderator_id': user_id, 'channel_id': channel_id, 'start': iso(start), 'seconds': seconds,
+               'contacts': {str(contact): total for contact, total in contacts.items()}}
+
+def report_rows(records):
+    for user_id, ts, text in records:
+        yield {'moderator_id': user_id, 'date': iso(ts), 'text': text}
+
+def coefficient_rows(records):
+    for user_id, K, params in records:
+        row = {'moderator_id': user_id, 'coefficient': K}
+        for name in PARAMETERS:
+            row[name] = params.get(name)
+        yield row
+
+def summary_rows(moderators: dict, user_id: int = None):
+    for key in sorted(moderators, key=int):
+        if user_id is not None and int(key) != user_id:
+            continue
+        data = moderators[key]
+        yield {
+            'moderator_id': int(key), 'sessions': data['sessions'], 'total_seconds': data['total_seconds'],
+            'first_start': iso(data['first_start']), 'last_end': iso(data['last_end']),
+            'report_count': data['report_count'], 'coefficient': data['coefficient'],
+            'contacts': {str(contact): total for contact, total in (data.get('contacts') or {}).items()}
+        }
+
+ROWS = {
+    'voice': voice_rows,
+    'reports': report_rows,
+    'coefficients': coefficient_rows
+}
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, dict):
+        return format_contacts(value)
+    return value
+
+class ChunkedOutput:
+    """Файлы <имя>-1.csv, <имя>-2.csv ... не больше limit байт каждый (для gzip - после сжатия)"""
+
+    def __init__(self, directory: str, name: str, extension: str, limit: int, compress: bool = False, header: bytes = b''):
+        self.directory = directory
+        self.name = name
+        self.extension = extension + ('.gz' if compress else '')
+        self.limit = limit
+        self.compress = compress
+        self.margin = min(GZIP_MARGIN, limit // 4) if compress else 0
+        self.header = header
+        self.paths = []
+        self._raw = None
+        self._file = None
+        self._written = 0
+
+    def _open(self):
+        path = os.path.join(self.directory, f"{self.name}-{len(self.paths) + 1}.{self.extension}")
+        self.paths.append(path)
+        self._raw = open(path, 'wb')
+        self._file = gzip.GzipFile(fileobj=self._raw, mode='wb') if self.compress else self._raw
+        self._written = 0
+        self._file.write(self.header)
+
+    def _size(self) -> int:
+        return self._raw.tell() + self.margin if self.compress else self._written + len(self.header)
+
+    def write(self, data: bytes):
+        if self._file is not None and self._written and self._size() + len(data) > self.limit:
+            self._close_part()
+        if self._file is None:
+            self._open()
+        self._file.write(data)
+        self._written += len(data)
+
+    def _close_part(self):
+        if self._file is not self._raw:
+            self._file.close()
+        self._raw.close()
+        self._file = self._raw = None
+
+    def close(self) -> list:
+        if self._file is None and not self.paths:
+            self._open()
+        if self._file is not None:
+            self._close_part()
+        if len(self.paths) == 1:
+            # Единственная часть не нумеруется
+            path = os.path.join(self.directory, f"{self.name}.{self.extension}")
+            os.replace(self.paths[0], path)
+            self.paths = [path]
+        return self.paths
+
+def write_export(kind: str, rows, fmt: str, directory: str, name: str = None, compress: bool = False,
+                 chunk_bytes: int = 8 * 1024 * 1024):
+    """Пишет строки выгрузки в файлы; выполняется вне event loop. Возвращает (пути частей, число строк)"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    fields = FIELDS[kind]
+    os.makedirs(directory, exist_ok=True)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    header = b''
+    if fmt == 'csv':
+        writer.writerow(fields)
+        header = buffer.getvalue().encode('utf-8')
+    output = ChunkedOutput(directory, name or kind, fmt, chunk_bytes, compress, header)
+    count = 0
+    try:
+        for row in rows:
+            if fmt == 'csv':
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerow([csv_value(row[field]) for field in fields])
+                line = buffer.getvalue()
+            else:
+                line = json.dumps(row, ensure_ascii=False) + '\n'
+            output.write(line.encode('utf-8'))
+            count += 1
+    finally:
+        paths = output.close()
+    export_rows.inc(count, kind=kind)
+    return paths, count
+
+async def export(storage, kind: str, fmt: str, directory: str, user_id: int = None, start: float = None,
+                 end: float = None, compress: bool = False, chunk_bytes: int = 8 * 1024 * 1024):
+    """Выгрузка из хранилища; итоги (summary) накопительные, период к ним не применяется"""
+    started = time.perf_counter()
+    await storage.flush()
+    if kind == 'summary':
+        rows = summary_rows(snapshot_summaries(await storage.summaries()), user_id)
+    elif kind in SOURCES:
+        rows = ROWS[kind](storage.iter_records(SOURCES[kind], user_id, start, end))
+    else:
+        raise ValueError(f"Неизвестный вид выгрузки: {kind}")
+    name = f"{kind}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    paths, count = await asyncio.get_running_loop().run_in_executor(
+        None, write_export, kind, rows, fmt, directory, name, compress, chunk_bytes
+    )
+    elapsed = time.perf_counter() - started
+    export_seconds.observe(elapsed)
+    log(f"Выгрузка {kind} ({fmt}{', gzip' if compress else ''}): {count} записей в {len(paths)} файлах за {elapsed:.2f}с")
+    return paths, count
+
+def parse_day(value: str) -> datetime.datetime:
+    try:
+        return datetime.datetime.strptime(value, '%d.%m.%Y')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ожидается дата дд.мм.гггг: {value}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Выгрузка данных бота в CSV или JSON Lines без запуска бота")
+    parser.add_argument('kind', choices=KINDS, help="что выгружать")
+    parser.add_argument('--format', choices=FORMATS, default='csv', help="формат файлов")
+    parser.add_argument('--from', dest='start', type=parse_day, help="с даты дд.мм.гггг")
+    parser.add_argument('--to', dest='end', type=parse_day, help="по дату дд.мм.гггг включительно")
+    parser.add_argument('--moderator', type=int, help="только этот модератор")
+    parser.add_argument('--gzip', action='store_true', help="сжимать файлы")
+    parser.add_argument('--chunk-bytes', type=int, default=0, help="размер части в байтах (0 - одним файлом)")
+    parser.add_argument('-o', '--output', default='exports', help="каталог для файлов")
+    parser.add_argument('--data-dir', default=os.getenv('BOT_DATA_DIR') or os.path.dirname(os.path.abspath(__file__)),
+                        help="каталог данных бота")
+    parser.add_argument('--storage', choices=('files', 'sqlite'), default=os.getenv('STORAGE_BACKEND', 'files'),
+                        help="бэкенд хранилища")
+    parser.add_argument('--sqlite-path', default=os.getenv('SQLITE_PATH'), help="путь к базе SQLite")
+    return parser.parse_args(argv)
+
+async def run_cli(args):
+    from writer import FileWriter
+    from storage import create_storage
+
+    # Фоновая запись не запускается: бот в это время может работать, выгрузка только читает
+    storage = create_storage(args.storage, args.data_dir, FileWriter(), sqlite_path=args.sqlite_path)
+    start = args.start.timestamp() if args.start else None
+    end = (args.end + datetime.timedelta(days=1)).timestamp() - 1 if args.end else None
+    await storage.start()
+    try:
+        paths, count = await export(
+            storage, args.kind, args.format, args.output, args.moderator, start, end, args.gzip,
+            args.chunk_bytes or float('inf')
+        )
+    finally:
+        await storage.close()
+    print(f"Выгружено записей: {count}")
+    for path in paths:
+        print(f"  {path} ({os.path.getsize(path)} байт)")
+
+if __name__ == '__main__':
+    asyncio.run(run_cli(parse_args()))
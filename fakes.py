@@ -0,0 +1,99 @@
+import discord
+
+class FakeRole:
+    def __init__(self, role_id: int, guild=None):
+        self.id = role_id
+        self.guild = guild
+        self.name = f"role-{role_id}"
+
+class FakeMember(discord.Member):
+    """Участник без подключения к Discord; проходит проверку isinstance(member, discord.Member)"""
+
+    def __init__(self, user_id: int, guild, roles=(), bot: bool = False):
+        self.__dict__['_fake'] = {
+            'id': user_id,
+            'guild': guild,
+            'roles': list(roles),
+            'bot': bot,
+            'name': f"member-{user_id}"
+        }
+
+    id = property(lambda self: self._fake['id'])
+    guild = property(lambda self: self._fake['guild'])
+    roles = property(lambda self: self._fake['roles'])
+    bot = property(lambda self: self._fake['bot'])
+    name = property(lambda self: self._fake['name'])
+    display_name = property(lambda self: self._fake['name'])
+    mention = property(lambda self: f"<@{self._fake['id']}>")
+
+    def __eq__(self, other):
+        return isinstance(other, FakeMember) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"<FakeMember id={self.id}>"
+
+class FakeVoiceChannel:
+    def __init__(self, channel_id: int, guild, category_id: int):
+        self.id = channel_id
+        self.guild = guild
+        self.category_id = category_id
+        self.name = f"voice-{channel_id}"
+        self.members = []
+
+class FakeVoiceState:
+    def __init__(self, channel=None):
+        self.channel = channel
+
+class FakeGuild:
+    def __init__(self, guild_id: int, shard_id: int = 0):
+        self.id = guild_id
+        self.shard_id = shard_id
+        self.name = f"guild-{guild_id}"
+        self.voice_channels = []
+        self.stage_channels = []
+        self.members = {}
+        self.channels = {}
+        self.owner = None
+
+    def add_channel(self, channel_id: int, category_id: int) -> FakeVoiceChannel:
+        channel = FakeVoiceChannel(channel_id, self, category_id)
+        self.voice_channels.append(channel)
+        self.channels[channel_id] = channel
+        return channel
+
+    def add_member(self, user_id: int, roles=(), bot: bool = False) -> FakeMember:
+        member = self.members[user_id] = FakeMember(user_id, self, roles, bot)
+        if self.owner is None:
+            self.owner = member
+        return member
+
+    def get_member(self, user_id: int):
+        return self.members.get(user_id)
+
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+
+class FakeMessage:
+    def __init__(self, content: str = None):
+        self.content = content
+        self.edits = 0
+
+    async def edit(self, content: str = None, **kwargs):
+        self.content = content
+        self.edits += 1
+
+class FakeContext:
+    """Контекст команды: сообщения копятся в sent вместо отправки в Discord"""
+
+    def __init__(self, author: FakeMember):
+        self.author = author
+        self.guild = author.guild
+        self.sent = []
+
+    async def send(self, content: str = None, **kwargs):
+        message = FakeMessage(content)
+        self.sent.append(message)
+        return message
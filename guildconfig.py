@@ -0,0 +1,73 @@
+import os
+import json
+from logger import log
+
+class GuildConfig:
+    """Настройки серверов: роли модераторов и разрешенные категории.
+
+    Сервер без своих настроек использует значения по умолчанию (MOD_ROLE_ID и ALLOWED_CATEGORIES).
+    """
+
+    def __init__(self, path: str, default_roles: set, default_categories: set):
+        self.path = path
+        self.default_roles = default_roles
+        self.default_categories = default_categories
+        self.guilds = {}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log(f"\033[31mОшибка чтения настроек серверов: {str(e)}\033[0m", level='error')
+            return
+        self.guilds = {
+            int(guild_id): {
+                'mod_roles': set(settings['mod_roles']) if settings.get('mod_roles') is not None else None,
+                'categories': set(settings['categories']) if settings.get('categories') is not None else None
+            }
+            for guild_id, settings in data.items()
+        }
+        log(f"Загружены настройки серверов: {len(self.guilds)}")
+
+    def _setting(self, guild_id: int, key: str, default: set) -> set:
+        settings = self.guilds.get(guild_id)
+        if settings is None or settings[key] is None:
+            return default
+        return settings[key]
+
+    def mod_roles(self, guild_id: int) -> set:
+        return self._setting(guild_id, 'mod_roles', self.default_roles)
+
+    def allowed_categories(self, guild_id: int) -> set:
+        return self._setting(guild_id, 'categories', self.default_categories)
+
+    def _update(self, guild_id: int, key: str, values):
+        settings = self.guilds.setdefault(guild_id, {'mod_roles': None, 'categories': None})
+        settings[key] = set(values) if values is not None else None
+        if settings['mod_roles'] is None and settings['categories'] is None:
+            del self.guilds[guild_id]
+
+    def set_mod_roles(self, guild_id: int, role_ids):
+        self._update(guild_id, 'mod_roles', role_ids)
+
+    def set_categories(self, guild_id: int, category_ids):
+        self._update(guild_id, 'categories', category_ids)
+
+    def reset(self, guild_id: int):
+        self.guilds.pop(guild_id, None)
+
+    def dump(self) -> str:
+        return json.dumps({
+            str(guild_id): {
+                key: sorted(values) if values is not None else None
+                for key, values in settings.items()
+            }
+            for guild_id, settings in self.guilds.items()
+        }, indent=2)
+
+    def persist(self, writer):
+        """Атомарная замена файла через фоновую запись"""
+        writer.replace(self.path, self.dump)
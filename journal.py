@@ -0,0 +1,103 @@
+import os
+import json
+import time
+
+class SessionJournal:
+    """Журнал открытых сессий: записи start/stop дописываются в файл, compact() заменяет его снимком"""
+
+    def __init__(self, path: str, writer, sessions: dict, closing=None):
+        self.path = path
+        self.writer = writer
+        self.sessions = sessions
+        self.closing = closing
+
+    def _append(self, record: dict):
+        self.writer.append(self.path, json.dumps(record) + '\n')
+
+    @staticmethod
+    def _start_record(user_id: int, session, ended: float = None) -> dict:
+        record = {
+            'op': 'start',
+            'user': user_id,
+            'guild': session.guild_id,
+            'channel': session.channel,
+            'ts': session.start
+        }
+        if session.idle:
+            record['idle'] = session.idle
+        if session.contacts is not None:
+            record['contacts'] = {
+                str(contact_id): int(seconds) for contact_id, seconds in session.contacts.totals(time.time()).items()
+            }
+        if ended is not None:
+            record['ended'] = ended
+        return record
+
+    def started(self, user_id: int, session):
+        self._append(self._start_record(user_id, session))
+
+    def paused(self, user_id: int, ended: float):
+        """Сессия закрывается, но ждет окна ожидания и еще может продолжиться"""
+        self._append({'op': 'pause', 'user': user_id, 'ts': ended})
+
+    def resumed(self, user_id: int, session):
+        self._append({
+            'op': 'resume',
+            'user': user_id,
+            'channel': session.channel,
+            'idle': session.idle,
+            'ts': time.time()
+        })
+
+    def stopped(self, user_id: int):
+        self._append({'op': 'stop', 'user': user_id, 'ts': time.time()})
+
+    def _snapshot(self) -> str:
+        lines = [
+            json.dumps(self._start_record(user_id, session))
+            for user_id, session in self.sessions.items()
+        ]
+        if self.closing is not None:
+            lines.extend(
+                json.dumps(self._start_record(user_id, session, session.wall(end_time)))
+                for user_id, session, end_time in self.closing.items()
+            )
+        lines.append(json.dumps({'op': 'alive', 'ts': time.time()}))
+        return '\n'.join(lines) + '\n'
+
+    def compact(self):
+        """Заменяет журнал снимком открытых сессий; снимок снимается в момент записи"""
+        self.writer.replace(self.path, self._snapshot)
+
+    def load(self):
+        """Читает журнал (вне event loop): возвращает открытые сессии и время последней записи.
+
+        У сессий, закрывшихся в окне ожидания, есть поле ended - время закрытия.
+        """
+        open_sessions = {}
+        last_seen = None
+        if not os.path.exists(self.path):
+            return open_sessions, last_seen
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                last_seen = max(last_seen or record['ts'], record['ts'])
+                entry = open_sessions.get(record.get('user'))
+                if record['op'] == 'start':
+                    open_sessions[record['user']] = record
+                elif record['op'] == 'stop':
+                    open_sessions.pop(record['user'], None)
+                elif record['op'] == 'pause' and entry is not None:
+                    entry['ended'] = record['ts']
+                elif record['op'] == 'resume' and entry is not None:
+                    entry.pop('ended', None)
+                    entry['channel'] = record['channel']
+                    entry['idle'] = record['idle']
+        return open_sessions, last_seen
+
+    async def stop(self):
+        """Последний снимок перед остановкой; периодическое сжатие запускает планировщик"""
+        self.compact()
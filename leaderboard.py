@@ -0,0 +1,89 @@
+import os
+import threading
+from bisect import bisect_left, insort
+from rollups import read_coefficient
+
+INFO_SUFFIX = '_info.txt'
+
+class CoefficientIndex:
+    """Коэффициенты модераторов, упорядоченные по убыванию K.
+
+    Для файлового хранилища refresh_files() перечитывает только файлы, у которых
+    изменилось время модификации, так что правки вручную тоже подхватываются.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.ranking = []
+        self.mtimes = {}
+        self.lock = threading.Lock()
+
+    def set(self, user_id: str, K: float):
+        with self.lock:
+            self._set(str(user_id), K)
+
+    def _set(self, user_id: str, K):
+        old = self.values.pop(user_id, None)
+        if old is not None:
+            del self.ranking[bisect_left(self.ranking, (-old, user_id))]
+        if K is not None:
+            self.values[user_id] = K
+            insort(self.ranking, (-K, user_id))
+
+    def replace_all(self, values: dict):
+        with self.lock:
+            self.values = {str(user_id): K for user_id, K in values.items() if K is not None}
+            self.ranking = sorted((-K, user_id) for user_id, K in self.values.items())
+
+    def refresh_files(self, info_dir: str) -> int:
+        """Сверяет индекс с moderator_info/ по mtime; возвращает число перечитанных файлов"""
+        if not os.path.isdir(info_dir):
+            return 0
+        reread = 0
+        with self.lock:
+            seen = set()
+            for entry in os.scandir(info_dir):
+                if not entry.name.endswith(INFO_SUFFIX):
+                    continue
+                user_id = entry.name[:-len(INFO_SUFFIX)]
+                seen.add(user_id)
+                mtime = entry.stat().st_mtime_ns
+                if self.mtimes.get(user_id) == mtime:
+                    continue
+                try:
+                    K = read_coefficient(entry.path)
+                except (OSError, ValueError, IndexError):
+                    K = None
+                self.mtimes[user_id] = mtime
+                self._set(user_id, K)
+                reread += 1
+            for user_id in self.mtimes.keys() - seen:
+                del self.mtimes[user_id]
+                self._set(user_id, None)
+        return reread
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+            self.ranking.clear()
+            self.mtimes.clear()
+
+    def __len__(self) -> int:
+        return len(self.ranking)
+
+    def top(self, offset: int = 0, limit: int = None) -> list:
+        """[(место, user_id, K)] начиная с offset"""
+        with self.lock:
+            end = len(self.ranking) if limit is None else offset + limit
+            return [
+                (offset + i + 1, user_id, -negative)
+                for i, (negative, user_id) in enumerate(self.ranking[offset:end])
+            ]
+
+    def rank_of(self, user_id):
+        """(место, K) модератора или None"""
+        with self.lock:
+            K = self.values.get(str(user_id))
+            if K is None:
+                return None
+            return bisect_left(self.ranking, (-K, str(user_id))) + 1, K
@@ -0,0 +1,186 @@
+import re
+import sys
+import json
+import queue
+import atexit
+import logging
+import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR
+}
+LEVEL_TAGS = {
+    logging.DEBUG: '\033[90m[DEBUG]\033[0m ',
+    logging.WARNING: '\033[33m[WARN]\033[0m ',
+    logging.ERROR: '\033[31m[ERROR]\033[0m '
+}
+ANSI = re.compile(r'\033\[[0-9;]*m')
+
+root = logging.getLogger('bot')
+root.setLevel(logging.INFO)
+root.propagate = False
+
+class ConsoleHandler(logging.StreamHandler):
+    """Пишет в текущий sys.stdout, чтобы перенаправление вывода работало как с print"""
+
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record):
+        timestamp = datetime.datetime.fromtimestamp(record.created).strftime('%d.%m.%Y %H:%M:%S')
+        message = f'\033[36m[{timestamp}]\033[0m {LEVEL_TAGS.get(record.levelno, "")}{record.getMessage()}'
+        fields = getattr(record, 'fields', None)
+        if fields:
+            message += ' \033[90m' + ' '.join(f'{key}={value}' for key, value in fields.items()) + '\033[0m'
+        return message
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна JSON строка; цвета из сообщений вырезаются"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'module': record.name[len('bot.'):],
+            'message': ANSI.sub('', record.getMessage())
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DroppingQueueHandler(QueueHandler):
+    """Не блокирует event loop: при переполненной очереди запись отбрасывается и считается"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Форматирование откладывается до фонового потока, в очередь уходит сама запись
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class BotLogger:
+    """Журнал модуля; debug_enabled - дешевая проверка перед формированием отладочных строк"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.logger = logging.getLogger(f'bot.{name}')
+        self.refresh()
+
+    def refresh(self):
+        self.debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
+
+    def log(self, message: str, level: str = 'info', **fields):
+        levelno = LEVELS[level]
+        if self.logger.isEnabledFor(levelno):
+            self.logger.log(levelno, message, extra={'fields': fields})
+
+    __call__ = log
+
+    def debug(self, message: str, **fields):
+        if self.debug_enabled:
+            self.logger.debug(message, extra={'fields': fields})
+
+    def info(self, message: str, **fields):
+        self.log(message, 'info', **fields)
+
+    def warning(self, message: str, **fields):
+        self.log(message, 'warning', **fields)
+
+    def error(self, message: str, **fields):
+        self.log(message, 'error', **fields)
+
+_loggers = {}
+_listener = None
+_queue_handler = None
+
+def get_logger(name: str) -> BotLogger:
+    if name == '__main__':
+        name = 'main'
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = _loggers[name] = BotLogger(name)
+    return logger
+
+def log(message: str, level: str = 'info', **fields):
+    """Запись от имени модуля, из которого вызвана функция"""
+    get_logger(sys._getframe(1).f_globals.get('__name__', 'main')).log(message, level, **fields)
+
+def parse_module_levels(spec: str) -> dict:
+    """'main.voice=debug,storage=warning' -> {'main.voice': 'debug', 'storage': 'warning'}"""
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, level = item.partition('=')
+        if level.strip().lower() not in LEVELS:
+            raise ValueError(f"Неизвестный уровень журнала: {item}")
+        levels[name.strip()] = level.strip().lower()
+    return levels
+
+def configure_logging(level: str = 'info', module_levels: str = '', file: str = None,
+                      max_bytes: int = 10 * 1024 * 1024, backups: int = 5, queue_size: int = 10000):
+    """Консоль и файл с ротацией обслуживаются фоновым потоком; вызывающий код только кладет запись в очередь"""
+    global _listener, _queue_handler
+    shutdown_logging()
+    root.setLevel(LEVELS[level.lower()])
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith('bot.'):
+            logging.getLogger(name).setLevel(logging.NOTSET)
+    for name, module_level in parse_module_levels(module_levels).items():
+        logging.getLogger(f'bot.{name}').setLevel(LEVELS[module_level])
+
+    console = ConsoleHandler()
+    console.setFormatter(ConsoleFormatter())
+    handlers = [console]
+    if file:
+        file_handler = RotatingFileHandler(file, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    _queue_handler = DroppingQueueHandler(log_queue)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=False)
+    _listener.start()
+    for logger in _loggers.values():
+        logger.refresh()
+
+def dropped_records() -> int:
+    return _queue_handler.dropped if _queue_handler else 0
+
+def shutdown_logging():
+    """Дописывает очередь и останавливает фоновый поток; дальше журнал снова пишет синхронно"""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    root.removeHandler(_queue_handler)
+    _listener = None
+    _queue_handler = None
+    root.addHandler(_default_handler)
+
+_default_handler = ConsoleHandler()
+_default_handler.setFormatter(ConsoleFormatter())
+root.addHandler(_default_handler)
+atexit.register(shutdown_logging)
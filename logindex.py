@@ -0,0 +1,156 @@
+import os
+import struct
+import datetime
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from rollups import DATE_FORMAT, REPORT_SEPARATOR
+
+HEADER = struct.Struct('<Q')
+RECORD = struct.Struct('<dQ')
+
+def _parse_ts(date_str: str):
+    try:
+        return datetime.datetime.strptime(date_str.strip(), DATE_FORMAT).timestamp()
+    except ValueError:
+        return None
+
+def scan_voice_entries(f, position: int):
+    """Строки голосового лога -> ([(метка времени, смещение)], конец разобранной части)"""
+    entries = []
+    for line in f:
+        if not line.endswith(b'\n'):
+            break
+        ts = None
+        for part in line.decode('utf-8', errors='replace').split(' | '):
+            if part.startswith('Date: '):
+                ts = _parse_ts(part[len('Date: '):])
+        entries.append((ts, position))
+        position += len(line)
+    return entries, position
+
+def scan_report_entries(f, position: int):
+    """Блоки докладов от строки 'Moderator ID:' до разделителя; метка времени из строки 'Date:'"""
+    entries = []
+    entry_start = None
+    ts = None
+    separator = REPORT_SEPARATOR.encode()
+    for line in f:
+        if not line.endswith(b'\n'):
+            break
+        if line.startswith(b'Moderator ID:'):
+            entry_start, ts = position, None
+        elif line.startswith(b'Date:') and entry_start is not None and ts is None:
+            ts = _parse_ts(line[len(b'Date:'):].decode('utf-8', errors='replace'))
+        elif line.rstrip(b'\r\n') == separator and entry_start is not None:
+            entries.append((ts, entry_start))
+            entry_start = None
+        position += len(line)
+    # Незаконченный блок будет разобран заново при следующем обновлении
+    return entries, entry_start if entry_start is not None else position
+
+SCANNERS = {
+    'voice': scan_voice_entries,
+    'report': scan_report_entries
+}
+
+class OffsetIndex:
+    """Индекс 'время -> смещение в байтах' для одного файла лога, хранится рядом в файле .idx"""
+
+    def __init__(self, path: str, kind: str):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self.scan = SCANNERS[kind]
+        self.timestamps = array('d')
+        self.offsets = array('Q')
+        self.indexed_size = 0
+        self.lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        self._loaded = True
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'rb') as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            return
+        self.indexed_size = HEADER.unpack_from(data, 0)[0]
+        for ts, offset in RECORD.iter_unpack(data[HEADER.size:HEADER.size + (len(data) - HEADER.size) // RECORD.size * RECORD.size]):
+            self.timestamps.append(ts)
+            self.offsets.append(offset)
+
+    def _reset(self):
+        self.timestamps = array('d')
+        self.offsets = array('Q')
+        self.indexed_size = 0
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+
+    def refresh(self) -> int:
+        """Дописывает в индекс записи, появившиеся в файле после прошлого обновления"""
+        if not self._loaded:
+            self._load()
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size < self.indexed_size:
+            self._reset()
+        if size == self.indexed_size:
+            return size
+        first_new = len(self.offsets)
+        last_ts = self.timestamps[-1] if self.timestamps else 0.0
+        with open(self.path, 'rb') as f:
+            f.seek(self.indexed_size)
+            entries, self.indexed_size = self.scan(f, self.indexed_size)
+        for ts, offset in entries:
+            # Ключи должны возрастать для бинарного поиска; записи без даты наследуют предыдущую
+            last_ts = max(last_ts, ts or last_ts)
+            self.timestamps.append(last_ts)
+            self.offsets.append(offset)
+        self._persist(first_new)
+        return size
+
+    def _persist(self, first_new: int):
+        mode = 'r+b' if os.path.exists(self.index_path) and first_new > 0 else 'wb'
+        with open(self.index_path, mode) as f:
+            f.write(HEADER.pack(self.indexed_size))
+            f.seek(HEADER.size + first_new * RECORD.size)
+            f.truncate()
+            f.write(b''.join(
+                RECORD.pack(self.timestamps[i], self.offsets[i])
+                for i in range(first_new, len(self.offsets))
+            ))
+
+    def _bounds(self, i: int) -> int:
+        return self.offsets[i] if i < len(self.offsets) else self.indexed_size
+
+    def _read_range(self, lo: int, hi: int) -> list:
+        if lo >= hi:
+            return []
+        entries = []
+        with open(self.path, 'rb') as f:
+            f.seek(self.offsets[lo])
+            data = f.read(self._bounds(hi) - self.offsets[lo])
+        base = self.offsets[lo]
+        for i in range(lo, hi):
+            start = self.offsets[i] - base
+            end = self._bounds(i + 1) - base
+            entries.append(data[start:end].decode('utf-8', errors='replace'))
+        return entries
+
+    def query(self, start: float = None, end: float = None, offset: int = 0, limit: int = None):
+        """Записи в диапазоне [start, end] с пропуском offset и не более limit; возвращает (записи, всего)"""
+        with self.lock:
+            self.refresh()
+            lo = bisect_left(self.timestamps, start) if start is not None else 0
+            hi = bisect_right(self.timestamps, end) if end is not None else len(self.timestamps)
+            total = max(hi - lo, 0)
+            first = lo + offset
+            last = hi if limit is None else min(hi, first + limit)
+            return self._read_range(first, last), total
+
+    def tail(self, count: int) -> list:
+        """Последние count записей: одно чтение от смещения count-й записи с конца"""
+        with self.lock:
+            self.refresh()
+            hi = len(self.offsets)
+            return self._read_range(max(hi - count, 0), hi)
@@ -1,9 +1,34 @@
 import os
+import re
+import shutil
+import time
 import asyncio
 import datetime
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
+from logger import configure_logging, dropped_records, get_logger, log
+from writer import FileWriter
+from rollups import DATE_FORMAT, format_duration
+from storage import SQLiteStorage, create_storage
+from occupancy import VoiceOccupancy
+from modcache import ModeratorCache
+from journal import SessionJournal
+from sessions import ClosingSessions, Session, SessionRegistry
+from guildconfig import GuildConfig
+from reports import ReportJobManager
+from scheduler import Scheduler, parse_daily
+from pipeline import EventPipeline
+from metrics import MetricsServer, registry, timed
+from coefficients import (
+    adjust_columns, batch_coefficients, calculate_coefficient, columns_from_params,
+    compare_rankings, engine_name, parse_scenario
+)
+from memstats import member_cache_stats, memory_report, process_rss
+from contacts import ContactLog
+from search import parse_terms, snippet
+from export import FORMATS, KINDS, export
+from output import OutputQueue, chunk_lines, paginate_lines, send_pages, text_file
 
 load_dotenv()
 
@@ -12,23 +37,184 @@ MOD_ROLE_IDS = os.getenv('MOD_ROLE_ID', '').strip()
 MOD_ROLE_ID = set(map(int, MOD_ROLE_IDS.split(','))) if MOD_ROLE_IDS else set()
 ADMIN_ROLE_ID = int(os.getenv('ADMIN_ROLE_ID'))
 ALLOWED_CATEGORIES = set(map(int, os.getenv('ALLOWED_CATEGORIES').split(','))) if os.getenv('ALLOWED_CATEGORIES') else set()
+WRITE_FLUSH_INTERVAL = float(os.getenv('WRITE_FLUSH_INTERVAL', '1.0'))
+WRITE_FLUSH_SIZE = int(os.getenv('WRITE_FLUSH_SIZE', '65536'))
+WRITE_FSYNC = os.getenv('WRITE_FSYNC', 'none')
+WRITE_FSYNC_INTERVAL = float(os.getenv('WRITE_FSYNC_INTERVAL', '30'))
+ROLLUP_RECENT_REPORTS = int(os.getenv('ROLLUP_RECENT_REPORTS', '100'))
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'files')
+SQLITE_PATH = os.getenv('SQLITE_PATH')
+JOURNAL_COMPACT_INTERVAL = float(os.getenv('JOURNAL_COMPACT_INTERVAL', '60'))
+LOG_COMPACT_INTERVAL = float(os.getenv('LOG_COMPACT_INTERVAL', '3600'))
+REPORT_SCHEDULE = os.getenv('REPORT_SCHEDULE', '03:00')
+JOB_JITTER = float(os.getenv('JOB_JITTER', '0.1'))
+JOB_BACKOFF = float(os.getenv('JOB_BACKOFF', '30'))
+JOB_BACKOFF_MAX = float(os.getenv('JOB_BACKOFF_MAX', '1800'))
+LOG_PAGE_SIZE = int(os.getenv('LOG_PAGE_SIZE', '20'))
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '10'))
+# Размер одного вложения выгрузки; лимит Discord для ботов - 8-10 МБ в зависимости от сервера
+EXPORT_CHUNK_BYTES = int(os.getenv('EXPORT_CHUNK_BYTES', str(8 * 1000 * 1000)))
+COEFFICIENT_PAGE_SIZE = int(os.getenv('COEFFICIENT_PAGE_SIZE', '25'))
+PAGER_TIMEOUT = float(os.getenv('PAGER_TIMEOUT', '300'))
+# Лимиты Discord: 5 сообщений за 5 секунд в канал и 50 запросов в секунду на бота
+OUTPUT_CHANNEL_RATE = int(os.getenv('OUTPUT_CHANNEL_RATE', '5'))
+OUTPUT_CHANNEL_PERIOD = float(os.getenv('OUTPUT_CHANNEL_PERIOD', '5'))
+OUTPUT_GLOBAL_RATE = int(os.getenv('OUTPUT_GLOBAL_RATE', '50'))
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', '1'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+VOICE_AUDIT_INTERVAL = float(os.getenv('VOICE_AUDIT_INTERVAL', '300'))
+SESSION_QUEUE_SIZE = int(os.getenv('SESSION_QUEUE_SIZE', '10000'))
+SESSION_BATCH_SIZE = int(os.getenv('SESSION_BATCH_SIZE', '64'))
+BOT_DATA_DIR = os.getenv('BOT_DATA_DIR')
+FLAP_GRACE_SECONDS = float(os.getenv('FLAP_GRACE_SECONDS', '30'))
+LEAN_GATEWAY = os.getenv('LEAN_GATEWAY', 'false').lower() in ('1', 'true', 'yes')
+SHARDED = os.getenv('SHARDED', 'false').lower() in ('1', 'true', 'yes')
+SHARD_COUNT = int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'info')
+LOG_MODULES = os.getenv('LOG_MODULES', '')
+LOG_FILE = os.getenv('LOG_FILE')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv('LOG_BACKUPS', '5'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+configure_logging(
+    level=LOG_LEVEL,
+    module_levels=LOG_MODULES,
+    file=LOG_FILE,
+    max_bytes=LOG_MAX_BYTES,
+    backups=LOG_BACKUPS,
+    queue_size=LOG_QUEUE_SIZE
+)
+voice_log = get_logger('main.voice')
 
 intents = discord.Intents.default()
 intents.voice_states = True
 intents.members = True
 intents.message_content = True
-intents.presences = True
+intents.presences = not LEAN_GATEWAY
+
+if LEAN_GATEWAY:
+    # Кэшируются только участники голосовых каналов; остальные подгружаются конвертерами команд по запросу
+    member_cache_flags = discord.MemberCacheFlags.none()
+    member_cache_flags.voice = True
+    gateway_options = {'member_cache_flags': member_cache_flags, 'chunk_guilds_at_startup': False}
+else:
+    gateway_options = {}
+
+writer = FileWriter(
+    flush_interval=WRITE_FLUSH_INTERVAL,
+    flush_size=WRITE_FLUSH_SIZE,
+    fsync=WRITE_FSYNC,
+    fsync_interval=WRITE_FSYNC_INTERVAL
+)
+
+class QueuedContext(commands.Context):
+    """Ответы команд уходят через общую очередь отправки; coalesce=True разрешает склейку с соседними"""
+
+    async def send(self, content=None, *, coalesce=False, **kwargs):
+        return await outbox.send(self.channel.id, super().send, content, coalesce=coalesce, **kwargs)
+
+class ModeratorBot(commands.AutoShardedBot if SHARDED else commands.Bot):
+    async def get_context(self, origin, *, cls=QueuedContext):
+        return await super().get_context(origin, cls=cls)
+
+    async def setup_hook(self):
+        # Выполняется один раз при запуске, в отличие от on_ready, который повторяется после переподключений
+        init_folders()
+        guild_config.load()
+        writer.start()
+        await storage.start()
+        session_events.start()
+        outbox.start()
+        if metrics_server:
+            try:
+                await metrics_server.start()
+            except OSError as e:
+                log(f"\033[31mНе удалось запустить сервер метрик: {str(e)}\033[0m", level='error')
+
+    async def close(self):
+        await scheduler.stop()
+        if metrics_server:
+            await metrics_server.stop()
+        report_jobs.shutdown()
+        await session_events.stop()
+        await outbox.stop()
+        closing_sessions.settle_all()
+        await journal.stop()
+        await storage.close()
+        await writer.stop()
+        await super().close()
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+bot = ModeratorBot(
+    command_prefix='!', intents=intents,
+    **({'shard_count': SHARD_COUNT} if SHARDED and SHARD_COUNT else {}),
+    **gateway_options
+)
 
-active_sessions = {}
-pending_moderators = set()
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = BOT_DATA_DIR or os.path.dirname(os.path.abspath(__file__))
+active_sessions = SessionRegistry()
+occupancy = VoiceOccupancy()
+guild_config = GuildConfig(os.path.join(BASE_DIR, 'guild_config.json'), MOD_ROLE_ID, ALLOWED_CATEGORIES)
+mod_cache = ModeratorCache(guild_config.mod_roles)
+storage = create_storage(
+    STORAGE_BACKEND, BASE_DIR, writer,
+    recent_limit=ROLLUP_RECENT_REPORTS,
+    sqlite_path=SQLITE_PATH,
+    flush_interval=WRITE_FLUSH_INTERVAL
+)
+closing_sessions = ClosingSessions(FLAP_GRACE_SECONDS, lambda user_id, session, end_time: record_session(user_id, session, end_time))
+journal = SessionJournal(
+    os.path.join(BASE_DIR, 'sessions.journal'), writer, active_sessions,
+    closing=closing_sessions
+)
+sessions_restored = False
+report_jobs = ReportJobManager(BASE_DIR, workers=REPORT_WORKERS)
+scheduler = Scheduler()
+session_events = EventPipeline(
+    lambda key, events: handle_session_events(key, events),
+    max_pending=SESSION_QUEUE_SIZE, batch_size=SESSION_BATCH_SIZE
+)
+outbox = OutputQueue(OUTPUT_CHANNEL_RATE, OUTPUT_CHANNEL_PERIOD, OUTPUT_GLOBAL_RATE)
+metrics_server = MetricsServer(registry, METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
 
-def log(message: str):
-    timestamp = datetime.datetime.now().strftime('%d.%m.%Y %H:%M:%S')
-    log_message = f'\033[36m[{timestamp}]\033[0m {message}'
-    print(log_message)
+event_seconds = registry.histogram('bot_event_seconds', 'Время обработки событий Discord')
+command_seconds = registry.histogram('bot_command_seconds', 'Время выполнения команд')
+validate_seconds = registry.histogram('bot_validate_session_seconds', 'Время проверки условий сессии')
+sweep_seconds = registry.histogram('bot_sweep_seconds', 'Время одного прохода фоновой проверки')
+shard_sweep_seconds = registry.histogram('bot_shard_sweep_seconds', 'Время прохода фоновой проверки по серверам одного шарда')
+sessions_started = registry.counter('bot_sessions_started_total', 'Начато сессий модераторов')
+sessions_stopped = registry.counter('bot_sessions_stopped_total', 'Завершено сессий модераторов')
+voice_events_coalesced = registry.counter('bot_session_events_coalesced_total', 'Голосовых событий модераторов схлопнуто в пачке')
+registry.gauge('bot_active_sessions', 'Открытые сессии модераторов', lambda: len(active_sessions))
+registry.gauge('bot_closing_sessions', 'Сессии в окне ожидания перед записью', lambda: len(closing_sessions))
+registry.counter_func('bot_sessions_coalesced_total', 'Сессий продолжено в окне ожидания вместо новой записи', lambda: closing_sessions.coalesced)
+registry.gauge('bot_session_queue', 'События сессий в очереди', lambda: len(session_events))
+registry.counter_func('bot_session_events_total', 'Обработано событий сессий', lambda: session_events.processed)
+registry.counter_func('bot_session_batches_total', 'Обработано пачек событий сессий', lambda: session_events.batches)
+registry.counter_func('bot_session_queue_waits_total', 'Ожиданий из-за переполнения очереди событий', lambda: session_events.waits)
+registry.gauge('bot_voice_members', 'Участники голосовых каналов в индексе', lambda: len(occupancy.locations))
+registry.gauge('bot_process_rss_bytes', 'Текущая память процесса', process_rss)
+registry.gauge('bot_cached_members', 'Участников в кэше discord.py', lambda: member_cache_stats(bot.guilds)['cached'])
+registry.gauge('bot_write_queue', 'Записей в очереди фоновой записи', lambda: writer.pending())
+registry.counter_func('bot_file_writes_total', 'Выполнено операций записи в файлы', lambda: writer.writes)
+registry.counter_func('bot_file_written_bytes_total', 'Записано в файлы (символов)', lambda: writer.bytes_written)
+registry.counter_func('bot_mod_cache_hits_total', 'Попадания кэша ролей модераторов', lambda: mod_cache.hits)
+registry.counter_func('bot_mod_cache_misses_total', 'Промахи кэша ролей модераторов', lambda: mod_cache.misses)
+registry.counter_func('bot_log_dropped_total', 'Записей журнала отброшено из-за переполнения очереди', dropped_records)
+
+class NotModerator(commands.CheckFailure):
+    pass
+
+def is_moderator(member) -> bool:
+    return mod_cache.is_moderator(member)
+
+def moderator_only():
+    async def predicate(ctx):
+        if not is_moderator(ctx.author):
+            raise NotModerator("Эта команда доступна только модераторам!")
+        return True
+    return commands.check(predicate)
 
 def init_folders():
     required_folders = ['voice_logs', 'reports', 'general_reports', 'moderator_info']
@@ -39,178 +225,453 @@ def init_folders():
             os.makedirs(path, exist_ok=True)
             log(f"Создана папка: {folder}")
         except Exception as e:
-            log(f"\033[31mОшибка при создании папки {folder}: {str(e)}\033[0m")
-
-def save_to_file(user_id: int, content: str, folder_type: str):
-    try:
-        folder_map = {
-            'voice': ('voice_logs', '_voice_logs.txt'),
-            'report': ('reports', '_report.txt'),
-            'general': ('general_reports', '_general_report.txt')
-        }
-        folder, suffix = folder_map[folder_type]
-        path = os.path.join(BASE_DIR, folder, f"{user_id}{suffix}")
-        
-        with open(path, 'a', encoding='utf-8') as f:
-            f.write(content)
-        log(f"\033[32mУспешно сохранено: {user_id} ({folder_type})\033[0m")
-    except Exception as e:
-        log(f"\033[31mОшибка сохранения: {user_id} ({folder_type}) - {str(e)}\033[0m")
+            log(f"\033[31mОшибка при создании папки {folder}: {str(e)}\033[0m", level='error')
 
+@timed(validate_seconds)
 async def validate_session(member: discord.Member, channel: discord.VoiceChannel) -> bool:
     try:
-        log(f"Проверка ролей для {member.display_name}: {[role.id for role in member.roles]}")
-        log(f"Требуемые роли MOD_ROLE_ID: {MOD_ROLE_ID}")
-        log(f"Проверка условий для {member.display_name} в {channel.name}")
-        
-        if not any(role.id in MOD_ROLE_ID for role in member.roles):
-            log(f"Отказ: у пользователя нет ни одной из ролей {MOD_ROLE_ID}")
+        if not isinstance(member, discord.Member):
+            voice_log.warning("Ошибка: объект не является участником сервера", channel=channel.id)
             return False
 
-        if not isinstance(member, discord.Member):
-            log("Ошибка: объект не является участником сервера")
+        if not is_moderator(member):
+            if voice_log.debug_enabled:
+                voice_log.debug(f"Отказ: у пользователя нет ни одной из ролей {guild_config.mod_roles(channel.guild.id)}", moderator=member.id, channel=channel.id)
             return False
 
         if member.bot:
-            log("Отказ: пользователь является ботом")
+            if voice_log.debug_enabled:
+                voice_log.debug("Отказ: пользователь является ботом", moderator=member.id, channel=channel.id)
             return False
             
-        if not any(role.id in MOD_ROLE_ID for role in member.roles):
-            log("Отказ: отсутствует роль модератора")
+        if channel.category_id not in guild_config.allowed_categories(channel.guild.id):
+            if voice_log.debug_enabled:
+                voice_log.debug(f"Отказ: категория канала {channel.category_id} не в разрешенном списке", moderator=member.id, channel=channel.id)
             return False
             
-        if channel.category_id not in ALLOWED_CATEGORIES:   
-            log(f"Отказ: категория канала {channel.category_id} не в разрешенном списке")
-            return False
-            
-        non_mod_users = [
-            user for user in channel.members
-            if not any(role.id in MOD_ROLE_ID for role in user.roles)
-        ]
-        
-        log(f"Найдено обычных пользователей: {len(non_mod_users)}")
-        return len(non_mod_users) >= 1
+        user_count = occupancy.user_count(channel.id)
+        if voice_log.debug_enabled:
+            voice_log.debug(
+                f"Проверка условий для {member.display_name} в {channel.name}: обычных пользователей {user_count}",
+                guild=channel.guild.id, channel=channel.id, moderator=member.id
+            )
+        return user_count >= 1
         
     except Exception as e:
-        log(f"Критическая ошибка валидации: {str(e)}")
+        voice_log.error(f"Критическая ошибка валидации: {str(e)}", moderator=member.id, channel=channel.id)
         return False
 
+def resume_session(member: discord.Member, channel: discord.VoiceChannel) -> bool:
+    """Продолжает сессию, закрытую в пределах окна ожидания (обрыв связи или переход)"""
+    held = closing_sessions.resume(member.id, channel.guild.id)
+    if held is None:
+        return False
+    session, end_time = held
+    session.idle += time.monotonic() - end_time
+    session.channel = channel.id
+    session.contacts.sync(occupancy.users_in(channel.id), time.time())
+    active_sessions[member.id] = session
+    journal.resumed(member.id, session)
+    voice_log.info(
+        f"\033[32mСессия продолжена: {member.display_name} в {channel.name}\033[0m",
+        guild=channel.guild.id, channel=channel.id, moderator=member.id, event='session_resume'
+    )
+    return True
+
 async def start_session(member: discord.Member, channel: discord.VoiceChannel):
     try:
         if member.id not in active_sessions:
-            active_sessions[member.id] = {
-                'guild_id': channel.guild.id,
-                'channel': channel.id,
-                'start_time': datetime.datetime.now(),
-                'participants': [
-                    u.id for u in channel.members 
-                    if not any(r.id in MOD_ROLE_ID for r in u.roles)
-                ]
-            }
-            log(f"\033[32mСессия начата: {member.display_name} в {channel.name}\033[0m")
-            pending_moderators.discard(member.id)
+            if resume_session(member, channel):
+                return
+            session = Session(channel.guild.id, channel.id, ContactLog())
+            session.contacts.sync(occupancy.users_in(channel.id), session.start)
+            active_sessions[member.id] = session
+            journal.started(member.id, session)
+            sessions_started.inc()
+            voice_log.info(
+                f"\033[32mСессия начата: {member.display_name} в {channel.name}\033[0m",
+                guild=channel.guild.id, channel=channel.id, moderator=member.id, event='session_start'
+            )
     except Exception as e:
-        log(f"\033[31mОшибка старта сессии: {str(e)}\033[0m")
+        log(f"\033[31mОшибка старта сессии: {str(e)}\033[0m", level='error')
 
-async def stop_session(member: discord.Member, reason: str):
+def record_session(user_id: int, session: Session, end_time: float = None):
+    """end_time - момент закрытия по time.monotonic(), по умолчанию текущий"""
+    end_time = time.monotonic() if end_time is None else end_time
+    duration = session.duration(end_time)
+    # За окно ожидания модератор мог начать новую сессию на другом сервере - ее запись в журнале не трогаем
+    if user_id not in active_sessions:
+        journal.stopped(user_id)
+    sessions_stopped.inc()
     try:
-        if member.id in active_sessions:
-            session = active_sessions.pop(member.id)
-            duration = datetime.datetime.now() - session['start_time']
-            
-            log_entry = (
-                f"Moderator: {member.id} | "
-                f"Channel: {session['channel']} | "
-                f"Date: {session['start_time'].strftime('%d.%m.%Y %H:%M:%S')} | "
-                f"Duration: {format_duration(duration.total_seconds())}\n"
-            )
-            
-            save_to_file(member.id, log_entry, 'voice')
-            log(f"\033[33mСессия остановлена: {member.display_name} - {reason}\033[0m")
-            pending_moderators.add(member.id)
+        storage.add_voice_session(
+            user_id, session.channel, datetime.datetime.fromtimestamp(session.start), int(duration),
+            session.contacts.totals(session.wall(end_time))
+        )
+        report_jobs.mark_dirty(user_id)
+        voice_log.info(
+            f"\033[32mСессия записана: {user_id} ({format_duration(duration)})\033[0m",
+            channel=session.channel, moderator=user_id, event='session_record'
+        )
     except Exception as e:
-        log(f"\033[31mОшибка остановки сессии: {str(e)}\033[0m")
+        log(f"\033[31mОшибка сохранения сессии: {user_id} - {str(e)}\033[0m", level='error')
 
-async def stop_session_by_id(user_id: int):
+def close_session(user_id: int, session: Session):
+    """Сессия записывается после окна ожидания, если модератор не вернется раньше"""
+    end_time = time.monotonic()
+    # Пока сессия в окне ожидания, время с пользователями не идет
+    session.contacts.pause(session.wall(end_time))
+    if closing_sessions.grace > 0:
+        journal.paused(user_id, session.wall(end_time))
+    closing_sessions.hold(user_id, session, end_time)
+
+async def stop_session(user_id: int, reason: str, member: discord.Member = None):
+    """member нужен только для журнала: модератора, покинувшего сервер, в кэше уже нет"""
     try:
-        if user_id in active_sessions:
-            session = active_sessions.pop(user_id)
-            duration = datetime.datetime.now() - session['start_time']
-            log_entry = f"Moderator: {user_id} | Duration: {format_duration(duration.total_seconds())}\n"
-            save_to_file(user_id, log_entry, 'voice')
-            pending_moderators.add(user_id)
-            log(f"Сессия {user_id} принудительно остановлена")
+        session = active_sessions.pop(user_id, None)
+        if session is None:
+            return
+        close_session(user_id, session)
+        voice_log.info(
+            f"\033[33mСессия остановлена: {member.display_name if member else user_id} - {reason}\033[0m",
+            guild=session.guild_id, channel=session.channel, moderator=user_id, event='session_stop'
+        )
     except Exception as e:
-        log(f"Ошибка при остановке сессии: {str(e)}")
+        log(f"\033[31mОшибка остановки сессии: {str(e)}\033[0m", level='error')
+
+async def restore_sessions():
+    """Сверяет журнал сессий с живым голосовым состоянием за один проход"""
+    started = time.perf_counter()
+    open_sessions, last_seen = await asyncio.get_running_loop().run_in_executor(None, journal.load)
+    resumed = closed = 0
+    for user_id, entry in open_sessions.items():
+        if user_id in active_sessions:
+            continue
+        guild = bot.get_guild(entry['guild'])
+        member = guild.get_member(user_id) if guild else None
+        channel = guild.get_channel(entry['channel']) if guild else None
+        ended = entry.get('ended')
+        contacts = ContactLog(entry.get('contacts'))
+        if member and channel and occupancy.channel_of(user_id) == channel.id and await validate_session(member, channel):
+            contacts.sync(occupancy.users_in(channel.id), time.time())
+            active_sessions[user_id] = Session(
+                guild.id, channel.id, contacts, entry['ts'], entry.get('idle', 0) + (time.time() - ended if ended else 0)
+            )
+            resumed += 1
+        else:
+            # Сессия закончилась, пока бот был недоступен: закрываем по времени закрытия или последней отметке
+            session = Session(entry['guild'], entry['channel'], contacts, entry['ts'], entry.get('idle', 0))
+            record_session(user_id, session, session.at(ended or max(last_seen or entry['ts'], entry['ts'])))
+            closed += 1
+    journal.compact()
+    log(f"Восстановление сессий из журнала: возобновлено {resumed}, закрыто {closed} за {time.perf_counter() - started:.3f}с")
+
+def voice_channels_of(guild):
+    return (*guild.voice_channels, *guild.stage_channels)
+
+def iter_voice_members(guilds=None):
+    for guild in bot.guilds if guilds is None else guilds:
+        for channel in voice_channels_of(guild):
+            for member in channel.members:
+                yield member.id, channel.id, is_moderator(member)
+
+def track_contact(channel_id: int, user_id: int, joined: bool, now: float):
+    """Открывает или закрывает интервал пользователя у модераторов, ведущих сессию в канале"""
+    for moderator_id in occupancy.moderators_in(channel_id):
+        session = active_sessions.get(moderator_id)
+        if session is not None and session.channel == channel_id:
+            if joined:
+                session.contacts.join(user_id, now)
+            else:
+                session.contacts.leave(user_id, now)
+
+async def reconcile_channel(channel: discord.VoiceChannel, sync_contacts: bool = False):
+    """Приводит сессии модераторов канала в соответствие с индексом занятости"""
+    has_users = occupancy.user_count(channel.id) >= 1
+    now = time.time()
+    for user_id in list(occupancy.moderators_in(channel.id)):
+        session = active_sessions.get(user_id)
+        if has_users:
+            if session is None:
+                member = channel.guild.get_member(user_id)
+                if member and await validate_session(member, channel):
+                    await start_session(member, channel)
+            elif sync_contacts and session.channel == channel.id:
+                # Пропущенные события: интервалы сверяются с фактическим составом канала
+                session.contacts.sync(occupancy.users_in(channel.id), now)
+        elif session and session.channel == channel.id:
+            await stop_session(user_id, "в канале не осталось пользователей", channel.guild.get_member(user_id))
+
+def coalesce_voice_events(events: list) -> list:
+    """Подряд идущие перемещения модератора сводятся к одному: из первого канала в последний"""
+    merged = []
+    for event in events:
+        if event[0] == 'voice' and merged and merged[-1][0] == 'voice':
+            merged[-1] = ('voice', event[1], merged[-1][2], event[3])
+            voice_events_coalesced.inc()
+        else:
+            merged.append(event)
+    return merged
+
+async def apply_voice_event(member: discord.Member, before, after):
+    if before == after:
+        return
+    if before:
+        await stop_session(member.id, "перемещение между каналами" if after else "покинул канал", member)
+    # Индекс уже опережает событие: если модератор успел уйти, его выход стоит в очереди следом
+    if after and occupancy.channel_of(member.id) == after.id and await validate_session(member, after):
+        await start_session(member, after)
+
+async def handle_moderator_events(user_id: int, events: list):
+    for kind, *args in coalesce_voice_events(events):
+        session = active_sessions.get(user_id)
+        if kind == 'voice':
+            await apply_voice_event(*args)
+        elif kind == 'stop':
+            reason, member = args
+            await stop_session(user_id, reason, member)
+        elif kind == 'audit' and session and occupancy.channel_of(user_id) != session.channel:
+            # Условие перепроверяется здесь: пока решение аудита ждало в очереди, сессию могли перезапустить
+            await stop_session(user_id, "нарушение правил", args[0].get_member(user_id))
+        elif kind == 'revalidate' and session:
+            guild = args[0]
+            member = guild.get_member(user_id)
+            channel = guild.get_channel(session.channel)
+            if member and channel and not await validate_session(member, channel):
+                await stop_session(user_id, "изменены настройки сервера", member)
+
+async def handle_channel_events(channel_id: int, events: list):
+    """Интервалы пользователей применяются по порядку, а сверка канала одна на всю пачку"""
+    sync_contacts = False
+    for kind, *args in events:
+        if kind == 'contact':
+            track_contact(channel_id, *args)
+        else:
+            sync_contacts = sync_contacts or args[0]
+    channel = bot.get_channel(channel_id)
+    if channel:
+        await reconcile_channel(channel, sync_contacts)
+
+async def handle_session_events(key, events: list):
+    """Единственное место, где меняются сессии: ключ - id модератора или ('channel', id канала)"""
+    if isinstance(key, tuple):
+        await handle_channel_events(key[1], events)
+    else:
+        await handle_moderator_events(key, events)
 
 @bot.event
 async def on_ready():
-    init_folders()
     log(f"\033[32mБот {bot.user.name} успешно запущен!\033[0m")
     log(f"Серверов: {len(bot.guilds)}")
     log(f"Пользователей: {len(bot.users)}")
-    log(f"MOD_ROLE_ID: {MOD_ROLE_ID}")
+    log(f"Шардов: {bot.shard_count or 1}")
+    log(f"Режим шлюза: {'облегченный' if LEAN_GATEWAY else 'полный'}, участников в кэше: {member_cache_stats(bot.guilds)['cached']}")
+    log(f"MOD_ROLE_ID (по умолчанию): {MOD_ROLE_ID}")
     log(f"ADMIN_ROLE_ID: {ADMIN_ROLE_ID}")
-    log(f"ALLOWED_CATEGORIES: {ALLOWED_CATEGORIES}")
-    bot.loop.create_task(background_check())
+    log(f"ALLOWED_CATEGORIES (по умолчанию): {ALLOWED_CATEGORIES}")
+    log(f"Серверов со своими настройками: {len(guild_config.guilds)}")
+    log(f"Хранилище: {storage.name}")
+    changed = occupancy.rebuild(iter_voice_members())
+    global sessions_restored
+    if not sessions_restored:
+        sessions_restored = True
+        try:
+            await session_events.call('restore', restore_sessions)
+        except Exception as e:
+            log(f"\033[31mОшибка восстановления сессий: {str(e)}\033[0m", level='error')
+    for channel_id in changed:
+        await session_events.put(('channel', channel_id), ('reconcile', True))
+    log(f"Индекс голосовых каналов построен: {len(occupancy.locations)} участников в {len(occupancy.channels)} каналах")
+    scheduler.start()
 
 @bot.event
+@timed(event_seconds, event='voice_state_update')
 async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
     try:
-        log(f"Событие голосового статуса: {member.display_name}")
-        
-        if not before.channel and after.channel:
-            if await validate_session(member, after.channel):
-                await start_session(member, after.channel)
-                
-        elif before.channel and not after.channel:
-            await stop_session(member, "покинул канал")
-            
-        elif before.channel and after.channel and before.channel != after.channel:
-            await stop_session(member, "перемещение между каналами")
-            if await validate_session(member, after.channel):
-                await start_session(member, after.channel)
-                
+        if before.channel == after.channel:
+            return
+        if voice_log.debug_enabled:
+            voice_log.debug(
+                f"Событие голосового статуса: {member.display_name}",
+                guild=member.guild.id, moderator=member.id, event='voice_state_update',
+                before=before.channel.id if before.channel else None,
+                after=after.channel.id if after.channel else None
+            )
+
+        # Индекс занятости обновляется сразу, а сессии меняет очередь событий
+        member_is_moderator = is_moderator(member)
+        if before.channel:
+            occupancy.leave(member.id)
+        if after.channel:
+            occupancy.join(member.id, after.channel.id, member_is_moderator)
+
+        if not member_is_moderator:
+            # Обычный пользователь влияет только на сессии модераторов в затронутых каналах
+            now = time.time()
+            for channel, joined in ((before.channel, False), (after.channel, True)):
+                if channel:
+                    await session_events.put(('channel', channel.id), ('contact', member.id, joined, now))
+        else:
+            await session_events.put(member.id, ('voice', member, before.channel, after.channel))
+
     except Exception as e:
-        log(f"Фатальная ошибка обработки голосового статуса: {str(e)}")
+        voice_log.error(f"Фатальная ошибка обработки голосового статуса: {str(e)}", moderator=member.id, event='voice_state_update')
 
-async def background_check():
-    log("Запуск фоновой проверки...")
-    while True:
-        try:
-            await asyncio.sleep(30)
-            log(f"Активные сессии: {len(active_sessions)}")
-            
-            for user_id in list(active_sessions.keys()):
-                session = active_sessions[user_id]
-                guild = bot.get_guild(session['guild_id'])
-                
-                if not guild:
-                    await stop_session_by_id(user_id)
-                    continue
-                    
-                member = guild.get_member(user_id)
-                channel = guild.get_channel(session['channel'])
-                
-                if not member or not channel or not await validate_session(member, channel):
-                    await stop_session(member, "нарушение правил")
-            
-            log("Попытка возобновления сессий...")
-            for guild in bot.guilds:
-                for channel in guild.voice_channels:
-                    for member in channel.members:
-                        if member.id in pending_moderators and await validate_session(member, channel):
-                            await start_session(member, channel)
-            
-        except Exception as e:
-            log(f"КРИТИЧЕСКАЯ ОШИБКА В ФОНОВОЙ ПРОВЕРКЕ: {str(e)}")
-            await asyncio.sleep(60)
+@bot.event
+@timed(event_seconds, event='member_update')
+async def on_member_update(before: discord.Member, after: discord.Member):
+    try:
+        if before.roles == after.roles:
+            return
+        mod_cache.invalidate(after.guild.id, after.id)
+        member_is_moderator = is_moderator(after)
+        channel_id = occupancy.update_role(after.id, member_is_moderator)
+        if channel_id is None:
+            return
+        log(f"Изменилась роль модератора у {after.display_name} в голосовом канале")
+        if not member_is_moderator:
+            await session_events.put(after.id, ('stop', "снята роль модератора", after))
+        await session_events.put(('channel', channel_id), ('contact', after.id, not member_is_moderator, time.time()))
+    except Exception as e:
+        log(f"Ошибка обработки обновления участника: {str(e)}", level='error')
+
+@bot.event
+async def on_member_remove(member: discord.Member):
+    mod_cache.invalidate(member.guild.id, member.id)
+
+@bot.event
+async def on_guild_role_create(role: discord.Role):
+    if role.id in guild_config.mod_roles(role.guild.id):
+        mod_cache.invalidate_guild(role.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    if role.id in guild_config.mod_roles(role.guild.id):
+        mod_cache.invalidate_guild(role.guild.id)
+        log(f"Удалена роль модератора {role.id}, кэш ролей сервера {role.guild.name} сброшен")
+
+async def audit_guild(guild) -> int:
+    """Сверка одного сервера: индекс его каналов и его сессии"""
+    # Индекс обновляется событиями; здесь только сверка с живым состоянием
+    changed = occupancy.rebuild(
+        iter_voice_members([guild]),
+        scope=[channel.id for channel in voice_channels_of(guild)]
+    )
+
+    # Аудит только ставит решения в очередь; обработчик перепроверит их на момент выполнения
+    for user_id, session in list(active_sessions.in_guild(guild.id).items()):
+        if occupancy.channel_of(user_id) != session.channel:
+            await session_events.put(user_id, ('audit', guild))
+
+    for channel_id in changed:
+        await session_events.put(('channel', channel_id), ('reconcile', True))
+    return len(changed)
+
+async def audit_shard(shard_id, guilds: list) -> int:
+    started = time.perf_counter()
+    changed = 0
+    for guild in guilds:
+        changed += await audit_guild(guild)
+        # Отдаем управление между серверами, чтобы большой сервер не задерживал события остальных
+        await asyncio.sleep(0)
+    shard_sweep_seconds.observe(time.perf_counter() - started, shard=shard_id)
+    return changed
+
+def guilds_by_shard() -> dict:
+    shards = {}
+    for guild in bot.guilds:
+        shards.setdefault(guild.shard_id or 0, []).append(guild)
+    return shards
+
+async def run_voice_audit():
+    started = time.perf_counter()
+    log(f"Активные сессии: {len(active_sessions)}")
+    log(f"Кэш ролей модераторов: {mod_cache.stats()}")
+
+    for guild_id in list(active_sessions.guilds):
+        if not bot.get_guild(guild_id):
+            for user_id in list(active_sessions.in_guild(guild_id)):
+                await session_events.put(user_id, ('stop', "сервер недоступен", None))
+
+    # Шарды проверяются параллельно, сервера внутри шарда по очереди
+    changed = sum(await asyncio.gather(*(
+        audit_shard(shard_id, guilds) for shard_id, guilds in guilds_by_shard().items()
+    )))
+    if changed:
+        log(f"Аудит: индекс расходился с голосовыми каналами в {changed} каналах", level='warning')
+    sweep_seconds.observe(time.perf_counter() - started)
+
+@bot.event
+async def on_shard_ready(shard_id: int):
+    """После переподключения шард сверяет только свои сервера"""
+    if not sessions_restored:
+        return
+    changed = await audit_shard(shard_id, guilds_by_shard().get(shard_id, []))
+    log(f"Шард {shard_id} готов, сверка каналов: расхождений {changed}")
+
+async def compact_journal():
+    journal.compact()
+
+async def scheduled_report():
+    job, _ = report_jobs.start(storage.summaries)
+    await asyncio.wait([job.task])
+    if job.state == 'failed':
+        raise RuntimeError(job.error)
+
+def job_options(interval: float) -> dict:
+    return {'interval': interval, 'jitter': interval * JOB_JITTER, 'backoff': JOB_BACKOFF, 'backoff_max': JOB_BACKOFF_MAX}
+
+scheduler.add('voice_audit', run_voice_audit, description="сверка голосовых каналов и сессий", **job_options(VOICE_AUDIT_INTERVAL))
+scheduler.add('journal_compact', compact_journal, description="снимок журнала сессий", **job_options(JOURNAL_COMPACT_INTERVAL))
+if LOG_COMPACT_INTERVAL > 0:
+    scheduler.add('log_compaction', storage.compact, description="сжатие логов прошлых месяцев", **job_options(LOG_COMPACT_INTERVAL))
+if parse_daily(REPORT_SCHEDULE):
+    scheduler.add(
+        'nightly_report', scheduled_report, description="генерация отчетов",
+        daily_at=parse_daily(REPORT_SCHEDULE), jitter=60, backoff=JOB_BACKOFF, backoff_max=JOB_BACKOFF_MAX
+    )
+
+@bot.command(name='jobs')
+@commands.has_role(ADMIN_ROLE_ID)
+async def jobs_command(ctx, action: str = None, name: str = None):
+    """Периодические задачи: !jobs [pause|resume|run <задача>]"""
+    try:
+        if action is None:
+            await send_lines(ctx, ["Периодические задачи:"] + [f"- {line}" for line in scheduler.describe()])
+            return
+        if name is None or action not in ('pause', 'resume', 'run'):
+            await ctx.send("Использование: `!jobs [pause|resume|run <задача>]`")
+            return
+        if action == 'pause':
+            scheduler.pause(name)
+            await ctx.send(f"⏸️ Задача {name} поставлена на паузу")
+        elif action == 'resume':
+            scheduler.resume(name)
+            await ctx.send(f"▶️ Задача {name} снова выполняется по расписанию")
+        elif scheduler.trigger(name):
+            await ctx.send(f"✅ Задача {name} запущена")
+        else:
+            await ctx.send(f"Задача {name} уже выполняется")
+        log(f"Задача {name}: {action} ({ctx.author.display_name})")
+    except KeyError as e:
+        await ctx.send(f"❌ {e.args[0]}")
+    except Exception as e:
+        await ctx.send(f"❌ Ошибка управления задачами: {str(e)}")
 
 @bot.command(name='reset')
 @commands.has_role(ADMIN_ROLE_ID)
-async def reset(ctx):
-    """Удаляет все данные бота"""
-    confirmation_message = await ctx.send("Вы уверены, что хотите сбросить все данные? Это действие нельзя отменить. Введите 'да' для подтверждения.")
+async def reset(ctx, mode: str = None):
+    """Удаляет все данные бота: !reset [archive] - с archive данные переносятся в archive/<дата>/"""
+    archive_dir = None
+    if mode is not None:
+        if mode.lower() not in ('archive', 'архив'):
+            await ctx.send("Использование: `!reset [archive]`")
+            return
+        archive_dir = os.path.join(BASE_DIR, 'archive', datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))
+    if archive_dir:
+        confirmation_message = await ctx.send("Вы уверены, что хотите сбросить все данные? Они будут перенесены в архив. Введите 'да' для подтверждения.")
+    else:
+        confirmation_message = await ctx.send("Вы уверены, что хотите сбросить все данные? Это действие нельзя отменить. Введите 'да' для подтверждения.")
     
     def check(m):
         return m.author == ctx.author and m.content.lower() == 'да'
@@ -219,18 +680,30 @@ async def reset(ctx):
         response = await bot.wait_for('message', check=check, timeout=30.0)
         
         if response.content.lower() == 'да':
-            folders = ['voice_logs', 'reports', 'general_reports', 'moderator_info']
-            for folder in folders:
-                path = os.path.join(BASE_DIR, folder)
+            await storage.reset(archive_dir)
+            report_jobs.mark_all()
+            path = os.path.join(BASE_DIR, 'general_reports')
+            if archive_dir:
+                os.makedirs(archive_dir, exist_ok=True)
+                os.replace(path, os.path.join(archive_dir, 'general_reports'))
+                os.makedirs(path)
+                log(f"Данные перенесены в архив: {archive_dir}")
+            else:
                 for file in os.listdir(path):
                     os.remove(os.path.join(path, file))
-                log(f"Очищена папка: {folder}")
+                log("Очищена папка: general_reports")
             
-            global active_sessions, pending_moderators
-            active_sessions.clear()
-            pending_moderators.clear()
+            async def clear_sessions():
+                # Через очередь событий, чтобы сброс не пришелся на середину обработки события
+                active_sessions.clear()
+                closing_sessions.clear()
+                journal.compact()
+            await session_events.call('reset', clear_sessions)
             
-            await ctx.send("✅ Все данные успешно сброшены!")
+            if archive_dir:
+                await ctx.send(f"✅ Все данные сброшены, архив: `{os.path.relpath(archive_dir, BASE_DIR)}`")
+            else:
+                await ctx.send("✅ Все данные успешно сброшены!")
         else:
             await ctx.send("Сброс данных отменен.")
     except asyncio.TimeoutError:
@@ -248,17 +721,34 @@ async def info(ctx):
     )
     
     # Основные команды
+    # Значение поля embed ограничено 1024 символами, поэтому команды разбиты на два поля
     embed.add_field(
         name="Основные команды:",
         value=(
             "`!send_report [текст]` - отправить доклад (Модераторы)\n"
-            "`!generate_report` - сформировать отчет (Главный модератор)\n"
-            "`!get_voice_logs @юзер` - показать логи голосовых каналов (Модераторы)\n"
-            "`!get_reports @юзер` - показать доклады пользователя (Модераторы)\n"
-            "`!reset` - сбросить все данные (Главный модератор)\n"
-            "`!info` - показать это сообщение (все)\n"
-            "`!set_cf_params @модератор B S D P A F Q` - установить параметры для расчета коэффициента модератора (Главный модератор)\n"
-            "`!coefficient` - рассчитать коэффициент модератора (Модераторы)"
+            "`!generate_report [full]` - обновить отчеты по изменившимся модераторам; `full` - пересобрать все (Модераторы)\n"
+            "`!report_status` / `!report_cancel` - состояние и отмена генерации отчета (Модераторы)\n"
+            "`!get_voice_logs @юзер [с] [по] [страница]` - логи голосовых каналов; `last N` - последние записи, `all` - весь файл (Модераторы)\n"
+            "`!get_reports @юзер [с] [по] [страница]` - доклады пользователя; `last N` и `all` как выше (Модераторы)\n"
+            "`!search_reports слова [@юзер] [с] [по] [стр=N]` - поиск по докладам, `слово*` - по началу слова (Модераторы)\n"
+            "`!coefficient [top N] [страница] | @модератор` - рейтинг коэффициентов модераторов (Модераторы)\n"
+            "`!set_cf_params @модератор B S D P A F Q` - установить параметры для расчета коэффициента модератора (Модераторы)\n"
+            "`!info` - показать это сообщение (все)"
+        ),
+        inline=False
+    )
+    embed.add_field(
+        name="Команды главного модератора:",
+        value=(
+            "`!reset [archive]` - сбросить все данные; с `archive` - перенести их в архив\n"
+            "`!rebuild_rollups` - пересчитать итоги по файлам логов\n"
+            "`!import_legacy` - перенести текстовые файлы в SQLite\n"
+            "`!export voice|reports|coefficients|summary [csv|jsonl] [gzip] [@юзер] [с] [по]` - выгрузка данных файлами\n"
+            "`!metrics` - выгрузить метрики бота\n"
+            "`!coefficient_sweep [B+=5] [threshold=45] [threshold_low=20..40:5] [apply]` - пересчет и примерка формулы для всех\n"
+            "`!memory` - отчет о памяти и кэше участников\n"
+            "`!jobs [pause|resume|run <задача>]` - периодические задачи бота\n"
+            "`!guild_config [roles|categories|reset]` - роли модераторов и категории сервера"
         ),
         inline=False
     )
@@ -274,31 +764,14 @@ async def info(ctx):
     )
 
     # Версия и разработчик
-    embed.set_footer(text=f"Версия: 1.0 | Разработчик: {ctx.guild.owner.display_name}")
+    owner = ctx.guild.owner or await ctx.guild.fetch_member(ctx.guild.owner_id)
+    embed.set_footer(text=f"Версия: 1.0 | Разработчик: {owner.display_name}")
 
     await ctx.send(embed=embed)
 
-def calculate_coefficient(B, S, D, P, A, F, Q):
-    try:
-        # Проверка на "плохого" модератора
-        is_bad_moderator = B < 25 if D == 0.8 else B < 40
-        
-        if is_bad_moderator:
-            # Формула для плохих модераторов
-            K = 1 / ((1 - B / 200) * (1 - 0.05 * S) * (1 / D) * (1 / P) * (1 / A) * (1 / F) * (1 / Q))
-        else:
-            # Формула для хороших модераторов
-            K = 1 / ((1 + B / 200) * (1 + 0.05 * S) * D * P * A * F * Q)
-        
-        return K
-    except ZeroDivisionError:
-        return None
-
 @bot.command(name='set_cf_params')
+@moderator_only()
 async def set_cf_params(ctx, member: discord.Member, B: float = None, S: float = None, D: float = None, P: float = None, A: float = None, F: float = None, Q: float = None):
-    if not any(role.id in MOD_ROLE_ID for role in ctx.author.roles):
-        await ctx.send("Эта команда доступна только модераторам!")
-        return
     # Если ни один из параметров не указан, отправляем справочное сообщение
     if all(param is None for param in [B, S, D, P, A, F, Q]):
         embed = discord.Embed(
@@ -343,294 +816,564 @@ async def set_cf_params(ctx, member: discord.Member, B: float = None, S: float =
             await ctx.send("Ошибка расчета коэффициента: деление на ноль.")
             return
 
-        # Сохраняем параметры и коэффициент в файл
-        info_path = os.path.join(BASE_DIR, 'moderator_info', f"{member.id}_info.txt")
-        with open(info_path, 'w', encoding='utf-8') as f:
-            f.write(f"Parameters: {params}\n")
-            f.write(f"Coefficient: {K:.4f}\n")
+        # Сохраняем параметры и коэффициент
+        await storage.set_moderator_info(member.id, params, K)
+        report_jobs.mark_dirty(member.id)
 
         await ctx.send("Параметры успешно установлены!")
     except Exception as e:
         await ctx.send(f"Ошибка при установке параметров: {str(e)}")
 
+def parse_coefficient_query(args) -> dict:
+    """[top N] [страница] | @модератор"""
+    query = {'top': None, 'page': 1, 'user_id': None}
+    expect_top = False
+    for arg in args:
+        mention = re.fullmatch(r'<@!?(\d+)>', arg)
+        if arg.lower() in ('top', 'топ'):
+            expect_top = True
+            continue
+        if mention:
+            query['user_id'] = int(mention.group(1))
+        elif arg.isdigit() and expect_top:
+            query['top'] = max(1, int(arg))
+        elif arg.isdigit():
+            query['page'] = max(1, int(arg))
+        else:
+            raise commands.BadArgument(f"Непонятный аргумент: {arg}")
+        expect_top = False
+    return query
+
 @bot.command(name='coefficient')
-async def coefficient(ctx):
-    if not any(role.id in MOD_ROLE_ID for role in ctx.author.roles):
-        await ctx.send("Эта команда доступна только модераторам!")
-        return
+@moderator_only()
+async def coefficient(ctx, *args):
+    """Рейтинг коэффициентов: !coefficient [top N] [страница] | @модератор"""
     try:
-        coefficients = []
-        moderator_info_dir = os.path.join(BASE_DIR, 'moderator_info')
-        for filename in os.listdir(moderator_info_dir):
-            if filename.endswith('_info.txt'):
-                user_id = filename.split('_')[0]
-                info_path = os.path.join(moderator_info_dir, filename)
-                with open(info_path, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                    for line in lines:
-                        if line.startswith('Coefficient:'):
-                            K = float(line.split(': ')[1])
-                            coefficients.append((user_id, K))
-                            break
-
-        if not coefficients:
+        query = parse_coefficient_query(args)
+        index = await storage.leaderboard()
+
+        if not len(index):
             await ctx.send("Нет данных о коэффициентах модераторов.")
             return
 
-        content = ["Модераторы и их коэффициенты:"]
-        for user_id, K in coefficients:
-            content.append(f"- Модератор <@{user_id}>: Коэффициент {K:.4f}")
+        if query['user_id'] is not None:
+            found = index.rank_of(query['user_id'])
+            if found is None:
+                await ctx.send(f"У модератора <@{query['user_id']}> нет коэффициента.")
+            else:
+                await ctx.send(f"Модератор <@{query['user_id']}>: место {found[0]} из {len(index)}, коэффициент {found[1]:.4f}")
+            return
+
+        # Рейтинг снимается один раз: листание показывает тот же список, даже если коэффициенты изменились
+        total = min(query['top'] or len(index), len(index))
+        lines = [f"{rank}. Модератор <@{user_id}>: Коэффициент {K:.4f}" for rank, user_id, K in index.top(0, total)]
+        chunks = paginate_lines(lines, COEFFICIENT_PAGE_SIZE)
+
+        async def load(page):
+            return f"Модераторы и их коэффициенты (страница {page}/{len(chunks)}, всего {total}):\n{chunks[page - 1]}", None
 
-        await ctx.send("\n".join(content))
+        await send_pages(ctx, load, len(chunks), query['page'], timeout=PAGER_TIMEOUT)
+    except commands.BadArgument as e:
+        await ctx.send(f"❌ {str(e)}")
     except Exception as e:
         await ctx.send(f"Ошибка при расчете коэффициентов: {str(e)}")
 
-@bot.command(name='get_voice_logs')
-async def get_voice_logs(ctx, member: discord.Member):
-    if not any(role.id in MOD_ROLE_ID for role in ctx.author.roles):
-        await ctx.send("Эта команда доступна только модераторам!")
-        return
-    """Показывает логи голосовых каналов для указанного модератора"""
+def format_coefficient(K) -> str:
+    return f"{K:.4f}" if K is not None else "—"
+
+def describe_rank_change(row) -> str:
+    user_id, old_rank, new_rank, old_K, new_K = row
+    if old_rank is not None and new_rank is not None:
+        move = f"{old_rank} → {new_rank} ({old_rank - new_rank:+d})" if old_rank != new_rank else f"{new_rank} (=)"
+    else:
+        move = f"{old_rank or '—'} → {new_rank or '—'}"
+    return f"<@{user_id}>: K {format_coefficient(old_K)} → {format_coefficient(new_K)}, место {move}"
+
+@bot.command(name='coefficient_sweep')
+@commands.has_role(ADMIN_ROLE_ID)
+async def coefficient_sweep(ctx, *args):
+    """Пересчет всех коэффициентов: !coefficient_sweep [B+=5 S*=1.1 Q=1] [threshold=45] [threshold_low=20..40:5] [apply]"""
     try:
-        user_id = member.id
-        path = os.path.join(BASE_DIR, 'voice_logs', f"{user_id}_voice_logs.txt")
-        
-        if not os.path.exists(path):
-            await ctx.send("🚫 Логов не найдено")
+        apply = 'apply' in args
+        scenario = parse_scenario([arg for arg in args if arg != 'apply'])
+        if apply and (scenario['formula'] or scenario['sweep']):
+            await ctx.send("❌ `apply` сохраняет только изменения параметров; пороги формулы можно лишь примерить")
             return
-            
-        with open(path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-        if len(content) > 1900:
-            await ctx.send(file=discord.File(path))
+        user_ids, columns = columns_from_params(await storage.moderator_params())
+        if not user_ids:
+            await ctx.send("Нет сохраненных параметров модераторов.")
+            return
+
+        started = time.perf_counter()
+        base = batch_coefficients(columns)
+        adjusted = adjust_columns(columns, scenario['adjustments'])
+        if scenario['sweep']:
+            name, values = scenario['sweep']
+            lines = [f"Перебор {name} для {len(user_ids)} модераторов:"]
+            for value in values:
+                rows = compare_rankings(user_ids, base, batch_coefficients(adjusted, dict(scenario['formula'], **{name: value})))
+                moved = sum(1 for row in rows if row[1] != row[2])
+                leader = f"<@{rows[0][0]}>" if rows and rows[0][2] is not None else "—"
+                lines.append(f"- {name}={value:g}: место изменилось у {moved}, первое место {leader}")
         else:
-            await ctx.send(f"📅 Логи голосовой активности для {member.mention}:\n```{content}```")
-            
+            changed = batch_coefficients(adjusted, scenario['formula'])
+            rows = compare_rankings(user_ids, base, changed)
+            lines = ["Рейтинг после изменений:"] + [describe_rank_change(row) for row in rows]
+            if apply:
+                for i, user_id in enumerate(user_ids):
+                    if changed[i] is not None:
+                        params = {name: float(adjusted[name][i]) for name in adjusted}
+                        await storage.set_moderator_info(int(user_id), params, changed[i])
+                        report_jobs.mark_dirty(user_id)
+                lines.append(f"✅ Новые параметры и коэффициенты сохранены для {sum(K is not None for K in changed)} модераторов")
+        lines.append(f"Движок: {engine_name()}, расчет {(time.perf_counter() - started) * 1000:.1f} мс")
+        await send_lines(ctx, lines)
+    except ValueError as e:
+        await ctx.send(f"❌ {str(e)}")
+    except Exception as e:
+        await ctx.send(f"❌ Ошибка пересчета коэффициентов: {str(e)}")
+        log(f"Ошибка пересчета коэффициентов: {str(e)}", level='error')
+
+LOG_QUERIES = {
+    'voice': {
+        'entries': 'voice_log_entries',
+        'tail': 'voice_log_tail',
+        'full': 'voice_log_text',
+        'title': "📅 Логи голосовой активности для {mention}",
+        'empty': "🚫 Логов не найдено",
+        'filename': "{user_id}_voice_logs.txt"
+    },
+    'report': {
+        'entries': 'report_entries',
+        'tail': 'report_tail',
+        'full': 'reports_text',
+        'title': "📄 Доклады {mention}",
+        'empty': "🚫 Докладов не найдено",
+        'filename': "{user_id}_report.txt"
+    }
+}
+
+def parse_log_query(args) -> dict:
+    """[дд.мм.гггг] [дд.мм.гггг] [страница] | last [N] | all"""
+    query = {'mode': 'tail', 'start': None, 'end': None, 'page': 1, 'count': LOG_PAGE_SIZE}
+    dates = []
+    expect_count = False
+    for arg in args:
+        lowered = arg.lower()
+        if lowered in ('last', 'последние'):
+            query['mode'] = 'tail'
+            expect_count = True
+            continue
+        if lowered in ('all', 'все'):
+            query['mode'] = 'all'
+        elif arg.isdigit() and expect_count:
+            query['count'] = max(1, int(arg))
+        elif arg.isdigit():
+            query['mode'] = 'page'
+            query['page'] = max(1, int(arg))
+        else:
+            try:
+                dates.append(datetime.datetime.strptime(arg, '%d.%m.%Y'))
+            except ValueError:
+                raise commands.BadArgument(f"Непонятный аргумент: {arg}")
+            query['mode'] = 'page'
+        expect_count = False
+    if dates:
+        query['start'], query['end'] = date_range(dates)
+    return query
+
+def date_range(dates: list):
+    """[с] [по] -> метки времени от начала первого дня до конца последнего"""
+    end = dates[1] if len(dates) > 1 else dates[0]
+    return dates[0].timestamp(), (end + datetime.timedelta(days=1)).timestamp() - 1
+
+MENTION_RE = re.compile(r'<@!?(\d+)>')
+PAGE_RE = re.compile(r'(?:стр|page)=(\d+)', re.IGNORECASE)
+
+def parse_search_query(args) -> dict:
+    """слова [@модератор] [дд.мм.гггг] [дд.мм.гггг] [стр=N]; числа без 'стр=' ищутся как слова"""
+    query = {'words': [], 'user_id': None, 'start': None, 'end': None, 'page': 1}
+    dates = []
+    for arg in args:
+        mention = MENTION_RE.fullmatch(arg)
+        if mention:
+            query['user_id'] = int(mention.group(1))
+            continue
+        page = PAGE_RE.fullmatch(arg)
+        if page:
+            query['page'] = max(1, int(page.group(1)))
+            continue
+        try:
+            dates.append(datetime.datetime.strptime(arg, '%d.%m.%Y'))
+            continue
+        except ValueError:
+            pass
+        query['words'].append(arg)
+    if dates:
+        query['start'], query['end'] = date_range(dates)
+    return query
+
+async def send_log_query(ctx, member: discord.Member, args, kind: str):
+    spec = LOG_QUERIES[kind]
+    query = parse_log_query(args)
+    filename = spec['filename'].format(user_id=member.id)
+    title = spec['title'].format(mention=member.mention)
+
+    if query['mode'] == 'all':
+        content = await getattr(storage, spec['full'])(member.id)
+        if not content:
+            await ctx.send(spec['empty'])
+        elif len(content) > 1900:
+            await ctx.send(file=text_file(content, filename))
+        else:
+            await ctx.send(f"{title}:\n```{content}```")
+        return
+
+    def render(header: str, entries: list):
+        content = ''.join(entries)
+        if len(content) > 1900:
+            return header, content
+        return f"{header}\n```{content}```", None
+
+    if query['mode'] == 'tail':
+        entries = await getattr(storage, spec['tail'])(member.id, query['count'])
+        if not entries:
+            await ctx.send(spec['empty'])
+            return
+        content, attached = render(f"{title} (последние {len(entries)}):", entries)
+        await ctx.send(content, file=text_file(attached, filename) if attached else None)
+        return
+
+    async def fetch(page):
+        return await getattr(storage, spec['entries'])(
+            member.id, query['start'], query['end'], (page - 1) * LOG_PAGE_SIZE, LOG_PAGE_SIZE
+        )
+
+    # Первая запрошенная страница заодно дает число записей; остальные читаются только при листании
+    entries, total = await fetch(query['page'])
+    if not total:
+        await ctx.send(spec['empty'])
+        return
+    pages = -(-total // LOG_PAGE_SIZE)
+    if not entries:
+        await ctx.send(f"🚫 Страницы {query['page']} нет, всего страниц: {pages}")
+        return
+
+    async def load(page):
+        page_entries = entries if page == query['page'] else (await fetch(page))[0]
+        return render(f"{title} (страница {page}/{pages}, записей: {total}):", page_entries)
+
+    await send_pages(ctx, load, pages, query['page'], filename, PAGER_TIMEOUT)
+
+@bot.command(name='get_voice_logs')
+@moderator_only()
+async def get_voice_logs(ctx, member: discord.Member, *args):
+    """Показывает логи голосовых каналов: !get_voice_logs @юзер [с] [по] [страница] | last [N] | all"""
+    try:
+        await send_log_query(ctx, member, args, 'voice')
+    except commands.BadArgument as e:
+        await ctx.send(f"❌ {str(e)}")
     except Exception as e:
         await ctx.send(f"❌ Ошибка: {str(e)}")
 
 @bot.command(name='get_reports')
-async def get_reports(ctx, member: discord.Member):
-    if not any(role.id in MOD_ROLE_ID for role in ctx.author.roles):
-        await ctx.send("Эта команда доступна только модераторам!")
+@moderator_only()
+async def get_reports(ctx, member: discord.Member, *args):
+    """Показывает доклады модератора: !get_reports @юзер [с] [по] [страница] | last [N] | all"""
+    try:
+        await send_log_query(ctx, member, args, 'report')
+    except commands.BadArgument as e:
+        await ctx.send(f"❌ {str(e)}")
+    except Exception as e:
+        await ctx.send(f"❌ Ошибка: {str(e)}")
+
+@bot.command(name='search_reports')
+@moderator_only()
+async def search_reports(ctx, *args):
+    """Поиск по тексту докладов: !search_reports слова [@модератор] [с] [по] [стр=N]"""
+    query = parse_search_query(args)
+    if not query['words']:
+        await ctx.send("Использование: `!search_reports слова [@модератор] [дд.мм.гггг] [дд.мм.гггг] [стр=N]`")
         return
-    """Показывает все доклады указанного модератора"""
+    text = ' '.join(query['words'])
     try:
-        user_id = member.id
-        path = os.path.join(BASE_DIR, 'reports', f"{user_id}_report.txt")
-        
-        if not os.path.exists(path):
-            await ctx.send("🚫 Докладов не найдено")
+        started = time.perf_counter()
+        offset = (query['page'] - 1) * SEARCH_PAGE_SIZE
+        hits, total = await storage.search_reports(
+            text, query['user_id'], query['start'], query['end'], offset, SEARCH_PAGE_SIZE
+        )
+        elapsed = (time.perf_counter() - started) * 1000
+        if not total:
+            await ctx.send(f"🚫 По запросу «{text}» докладов не найдено")
             return
-            
-        with open(path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
-        if len(content) > 1900:
-            await ctx.send(file=discord.File(path))
-        else:
-            await ctx.send(f"📄 Доклады {member.mention}:\n```{content}```")
-            
+        pages = max(1, -(-total // SEARCH_PAGE_SIZE))
+        if not hits:
+            await ctx.send(f"🚫 Страницы {query['page']} нет, всего страниц: {pages}")
+            return
+        terms = parse_terms(text)
+        lines = [f"🔎 Доклады по запросу «{text}»: найдено {total}, страница {query['page']}/{pages} ({elapsed:.1f} мс)"]
+        if query['page'] < pages:
+            lines[0] += f", следующая: `стр={query['page'] + 1}`"
+        for number, (_, user_id, ts, report) in enumerate(hits, offset + 1):
+            date = datetime.datetime.fromtimestamp(ts).strftime('%d.%m.%Y %H:%M') if ts else '—'
+            lines.append(f"**{number}.** <@{user_id}> {date}: {snippet(report, terms)}")
+        await send_lines(ctx, lines)
     except Exception as e:
-        await ctx.send(f"❌ Ошибка: {str(e)}")
+        await ctx.send(f"❌ Ошибка поиска по докладам: {str(e)}")
+        log(f"Ошибка поиска по докладам: {str(e)}", level='error')
 
 @bot.command(name='send_report')
+@moderator_only()
 async def send_report(ctx, *, report_text: str):
-    if not any(role.id in MOD_ROLE_ID for role in ctx.author.roles):
-        await ctx.send("Эта команда доступна только модераторам!")
-        return
     try:
         if len(report_text) < 10:
             await ctx.send("Доклад должен содержать минимум 10 символов")
             return
 
-        report_data = (
-            f"Moderator ID: {ctx.author.id}\n"
-            f"Date: {datetime.datetime.now().strftime('%d.%m.%Y %H:%M:%S')}\n"
-            f"Report:\n{report_text}\n"
-            f"----------------------------\n"
-        )
-
-        save_to_file(ctx.author.id, report_data, 'report')
+        report_date = datetime.datetime.now().strftime(DATE_FORMAT)
+        storage.add_report(ctx.author.id, report_date, report_text)
+        report_jobs.mark_dirty(ctx.author.id)
         await ctx.send("Доклад успешно сохранён!")
     except Exception as e:
         await ctx.send("Ошибка при сохранении доклада")
 
 @bot.command(name='generate_report')
-async def generate_report(ctx):
-    if not any(role.id in MOD_ROLE_ID for role in ctx.author.roles):
-        await ctx.send("Эта команда доступна только модераторам!")
+@moderator_only()
+async def generate_report(ctx, mode: str = None):
+    """Запускает генерацию отчетов в фоне или подключается к уже идущей: !generate_report [full]"""
+    if mode is not None and mode.lower() not in ('full', 'полный'):
+        await ctx.send("Использование: `!generate_report [full]`")
         return
     try:
-        general_reports_dir = os.path.join(BASE_DIR, 'general_reports')
-        os.makedirs(general_reports_dir, exist_ok=True)
-        all_voice_data = {}
-        all_reports = {}
-        moderator_info = {}
-
-        # Считываем информацию о коэффициентах модераторов
-        moderator_info_dir = os.path.join(BASE_DIR, 'moderator_info')
-        for filename in os.listdir(moderator_info_dir):
-            if filename.endswith('_info.txt'):
-                user_id = filename.split('_')[0]
-                info_path = os.path.join(moderator_info_dir, filename)
-                with open(info_path, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                    for line in lines:
-                        if line.startswith('Coefficient:'):
-                            K = float(line.split(': ')[1])
-                            moderator_info[user_id] = K
-                            break
-
-        # Обработка голосовых логов
-        voice_logs_dir = os.path.join(BASE_DIR, 'voice_logs')
-        for filename in os.listdir(voice_logs_dir):
-            if filename.endswith('_voice_logs.txt'):
-                user_id = filename.split('_')[0]
-                try:
-                    with open(os.path.join(voice_logs_dir, filename), 'r', encoding='utf-8') as f:
-                        lines = f.readlines()
-                        total_seconds = 0
-                        start_dates = []
-                        end_dates = []
-                        for line in lines:
-                            parts = line.strip().split(' | ')
-                            date_str = parts[2].split(': ')[1]
-                            duration_str = parts[3].split(': ')[1]
-                            h, m, s = map(int, duration_str.split(':'))
-                            total_seconds += h * 3600 + m * 60 + s
-                            start_date = datetime.datetime.strptime(date_str, '%d.%m.%Y %H:%M:%S')
-                            end_date = start_date + datetime.timedelta(seconds=h*3600 + m*60 + s)
-                            start_dates.append(start_date)
-                            end_dates.append(end_date)
-
-                        all_voice_data[user_id] = {
-                            'total_time': total_seconds,
-                            'start_date': min(start_dates) if start_dates else None,
-                            'end_date': max(end_dates) if end_dates else None
-                        }
-                except Exception as e:
-                    log(f"Ошибка чтения голосовых логов {filename}: {str(e)}")
-                    continue
-
-        # Обработка докладов
-        reports_dir = os.path.join(BASE_DIR, 'reports')
-        for filename in os.listdir(reports_dir):
-            if filename.endswith('_report.txt'):
-                user_id = filename.split('_')[0]
-                try:
-                    with open(os.path.join(reports_dir, filename), 'r', encoding='utf-8') as f:
-                        reports = []
-                        current_report = {}
-                        report_lines = f.readlines()
-
-                        for line in report_lines:
-                            line = line.strip()
-                            if line.startswith('Moderator ID:'):
-                                if current_report:
-                                    reports.append(current_report)
-                                current_report = {'id': line.split(': ')[1]}
-                            elif line.startswith('Date:'):
-                                current_report['date'] = line.split(': ')[1]
-                            elif line.startswith('Report:'):
-                                current_report['text'] = []
-                            elif line == '----------------------------':
-                                if current_report.get('text') is not None:
-                                    current_report['text'] = '\n'.join(current_report['text'])
-                                    reports.append(current_report)
-                                    current_report = {}
-                            elif 'text' in current_report:
-                                current_report['text'].append(line.replace('\\n', '\n'))
-
-                        if current_report:
-                            reports.append(current_report)
-                        all_reports[user_id] = reports
-                except Exception as e:
-                    log(f"Ошибка при чтении файла {filename}: {str(e)}")
-                    continue
-
-        # Генерация индивидуальных отчетов
-        for user_id in set(all_voice_data.keys()) | set(all_reports.keys()):
-            voice_info = all_voice_data.get(user_id, {'total_time': 0, 'start_date': None, 'end_date': None})
-            reports = all_reports.get(user_id, [])
-            total_time = voice_info['total_time']
-            hours = total_time // 3600
-            minutes = (total_time % 3600) // 60
-            time_str = f"{hours:02}:{minutes:02}"
-            K = moderator_info.get(user_id)
-            content = [
-                f"Модератор: {user_id}",
-                f"Период: {voice_info['start_date'].strftime('%d.%m.%Y') if voice_info['start_date'] else 'N/A'} - {voice_info['end_date'].strftime('%d.%m.%Y') if voice_info['end_date'] else 'N/A'}",
-                "────────────────────",
-                f"Общее время в голосовых каналах: {time_str}",
-                f"Количество докладов: {len(reports)}"
-            ]
-            if K is not None:
-                content.append(f"Коэффициент: {K:.4f}")
-            if reports:
-                content.append("Список докладов:")
-                for report in reports:
-                    content.append(f"- {report['date']}: {report['text'].strip()[:50]}{'...' if len(report['text']) > 50 else ''}")
-            report_path = os.path.join(general_reports_dir, f"{user_id}_general_report.txt")
-            with open(report_path, 'w', encoding='utf-8') as f:
-                f.write('\n'.join(content))
-
-        # Генерация общего отчета
-        general_content = [
-            f"ОБЩИЙ ОТЧЕТ",
-            f"Дата генерации: {datetime.datetime.now().strftime('%d.%m.%Y %H:%M:%S')}",
-            "════════════════════════════",
-            f"Всего модераторов: {len(set(all_voice_data.keys()) | set(all_reports.keys()))}",
-            f"Суммарное время: {sum(data['total_time'] for data in all_voice_data.values()) // 3600} часов",
-            f"Всего докладов: {sum(len(reps) for reps in all_reports.values())}",
-            "\n════════════════════════════\n"
-        ]
-        for user_id in set(all_voice_data.keys()) | set(all_reports.keys()):
-            voice_info = all_voice_data.get(user_id, {})
-            reports = all_reports.get(user_id, [])
-            K = moderator_info.get(user_id, None)
-            general_content.append(
-                f"🔹 Модератор {user_id}:\n"
-                f"   - Общее время: {voice_info.get('total_time', 0)//3600} часов\n"
-                f"   - Докладов: {len(reports)}\n"
-            )
-            if K is not None:
-                general_content.append(f"   - Коэффициент: {K:.4f}\n")
-            if reports:
-                general_content.append("   📝 Последние доклады:")
-                for report in reports[-100:]:
-                    truncated_text = report['text'].strip()[:50] + "..." if len(report['text']) > 1000 else report['text'].strip()
-                    general_content.append(f"     ▪ {report['date']}: {truncated_text}")
-                general_content.append("")
-            general_content.append("────────────────────")
-        with open(os.path.join(BASE_DIR, 'general_report.txt'), 'w', encoding='utf-8') as f:
-            f.write('\n'.join(general_content))
-        
-        await ctx.send("Отчеты успешно сгенерированы!")
-        log("Генерация отчетов завершена")
+        job, created = report_jobs.start(storage.summaries, ctx.author.display_name, full=mode is not None)
+        if not created:
+            await ctx.send(f"Генерация #{job.id} уже выполняется (запустил {job.requested_by}), слежу за ней")
+        message = await ctx.send(job.describe())
+        await report_jobs.follow(job, message)
+
+        if job.state == 'done':
+            await ctx.send("Отчеты успешно сгенерированы!")
+        elif job.state == 'failed':
+            await ctx.send("Ошибка при генерации отчетов")
     except Exception as e:
         await ctx.send("Ошибка при генерации отчетов")
-        log(f"Ошибка генерации отчетов: {str(e)}")
+        log(f"Ошибка генерации отчетов: {str(e)}", level='error')
+
+@bot.command(name='report_status')
+@moderator_only()
+async def report_status(ctx):
+    """Показывает состояние текущей или последней генерации отчетов"""
+    job = report_jobs.status()
+    if job is None:
+        await ctx.send("Генерация отчетов еще не запускалась")
+        return
+    await ctx.send(job.describe())
+
+@bot.command(name='report_cancel')
+@moderator_only()
+async def report_cancel(ctx):
+    """Отменяет текущую генерацию отчетов"""
+    if report_jobs.cancel():
+        await ctx.send(f"Отмена генерации #{report_jobs.current.id} запрошена")
+    else:
+        await ctx.send("Сейчас нет идущей генерации отчетов")
+
+async def apply_guild_config(guild):
+    """Сессии сервера пересматриваются по новым ролям и категориям"""
+    mod_cache.invalidate_guild(guild.id)
+    for user_id in list(active_sessions.in_guild(guild.id)):
+        await session_events.put(user_id, ('revalidate', guild))
+    await audit_guild(guild)
+
+def describe_guild_config(guild) -> str:
+    custom = guild_config.guilds.get(guild.id, {})
+    roles = guild_config.mod_roles(guild.id)
+    categories = guild_config.allowed_categories(guild.id)
+    return (
+        f"Настройки сервера {guild.name}:\n"
+        f"- Роли модераторов: {', '.join(f'<@&{role_id}>' for role_id in sorted(roles)) or 'нет'}"
+        f"{'' if custom.get('mod_roles') is not None else ' (по умолчанию)'}\n"
+        f"- Разрешенные категории: {', '.join(map(str, sorted(categories))) or 'нет'}"
+        f"{'' if custom.get('categories') is not None else ' (по умолчанию)'}"
+    )
+
+@bot.command(name='guild_config')
+@commands.has_role(ADMIN_ROLE_ID)
+async def guild_config_command(ctx, setting: str = None, *values):
+    """Настройки сервера: !guild_config [roles @роль... | categories id... | reset]; без значений - вернуть по умолчанию"""
+    try:
+        if setting is None:
+            await ctx.send(describe_guild_config(ctx.guild))
+            return
+        ids = set(map(int, re.findall(r'\d+', ' '.join(values)))) or None
+        if setting == 'roles':
+            guild_config.set_mod_roles(ctx.guild.id, ids)
+        elif setting == 'categories':
+            guild_config.set_categories(ctx.guild.id, ids)
+        elif setting == 'reset':
+            guild_config.reset(ctx.guild.id)
+        else:
+            await ctx.send("Использование: `!guild_config [roles @роль... | categories id... | reset]`")
+            return
+        guild_config.persist(writer)
+        await apply_guild_config(ctx.guild)
+        log(f"Изменены настройки сервера {ctx.guild.name}: {setting} {sorted(ids) if ids else 'по умолчанию'}")
+        await ctx.send(f"✅ {describe_guild_config(ctx.guild)}")
+    except Exception as e:
+        await ctx.send(f"❌ Ошибка при изменении настроек: {str(e)}")
+        log(f"Ошибка изменения настроек сервера: {str(e)}", level='error')
+
+@bot.command(name='rebuild_rollups')
+@commands.has_role(ADMIN_ROLE_ID)
+async def rebuild_rollups_command(ctx):
+    """Пересчитывает накопительные итоги модераторов по исходным файлам"""
+    try:
+        if storage.name != 'files':
+            await ctx.send(f"Хранилище {storage.name} считает итоги запросами, пересчет не требуется")
+            return
+        await ctx.send("Пересчет итогов по исходным файлам...")
+        count = await storage.rebuild()
+        report_jobs.mark_all()
+        await ctx.send(f"✅ Итоги пересчитаны: {count} модераторов")
+    except Exception as e:
+        await ctx.send(f"❌ Ошибка при пересчете итогов: {str(e)}")
+        log(f"Ошибка пересчета итогов: {str(e)}", level='error')
+
+@bot.command(name='import_legacy')
+@commands.has_role(ADMIN_ROLE_ID)
+async def import_legacy(ctx, force: str = None):
+    """Переносит старые текстовые файлы в SQLite хранилище"""
+    if not isinstance(storage, SQLiteStorage):
+        await ctx.send("Импорт доступен только при STORAGE_BACKEND=sqlite")
+        return
+    try:
+        await ctx.send("Импорт текстовых файлов...")
+        result = await storage.import_files(BASE_DIR, force=force == 'force')
+        report_jobs.mark_all()
+        if result.get('skipped'):
+            await ctx.send("Импорт уже выполнялся. Для повторного используйте `!import_legacy force`")
+            return
+        await ctx.send(
+            f"✅ Импортировано: сессий {result['voice_sessions']}, "
+            f"докладов {result['reports']}, модераторов {result['moderators']}"
+        )
+    except Exception as e:
+        await ctx.send(f"❌ Ошибка импорта: {str(e)}")
+        log(f"Ошибка импорта текстовых файлов: {str(e)}", level='error')
+
+def parse_export_args(args) -> dict:
+    """вид [csv|jsonl] [gzip] [@модератор] [дд.мм.гггг] [дд.мм.гггг]"""
+    if not args or args[0].lower() not in KINDS:
+        raise commands.BadArgument(f"Укажите, что выгружать: {', '.join(KINDS)}")
+    query = {'kind': args[0].lower(), 'format': 'csv', 'compress': False, 'user_id': None, 'start': None, 'end': None}
+    dates = []
+    for arg in args[1:]:
+        lowered = arg.lower()
+        mention = MENTION_RE.fullmatch(arg)
+        if lowered in FORMATS:
+            query['format'] = lowered
+        elif lowered in ('gzip', 'gz'):
+            query['compress'] = True
+        elif mention:
+            query['user_id'] = int(mention.group(1))
+        else:
+            try:
+                dates.append(datetime.datetime.strptime(arg, '%d.%m.%Y'))
+            except ValueError:
+                raise commands.BadArgument(f"Непонятный аргумент: {arg}")
+    if dates:
+        query['start'], query['end'] = date_range(dates)
+    return query
+
+@bot.command(name='export')
+@commands.has_role(ADMIN_ROLE_ID)
+async def export_command(ctx, *args):
+    """Выгружает сессии, доклады, коэффициенты или итоги в CSV/JSONL файлами"""
+    try:
+        query = parse_export_args(args)
+    except commands.BadArgument as e:
+        await ctx.send(f"❌ {str(e)}\nИспользование: `!export voice|reports|coefficients|summary [csv|jsonl] [gzip] [@юзер] [с] [по]`")
+        return
+    directory = os.path.join(BASE_DIR, 'exports', datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f'))
+    try:
+        await ctx.send(f"Выгрузка {query['kind']}...")
+        paths, count = await export(
+            storage, query['kind'], query['format'], directory, query['user_id'], query['start'], query['end'],
+            query['compress'], EXPORT_CHUNK_BYTES
+        )
+        if not count:
+            await ctx.send("🚫 За выбранный период записей нет")
+            return
+        await ctx.send(f"✅ Выгружено записей: {count}, файлов: {len(paths)}")
+        # Каждая часть - отдельное сообщение, чтобы не превысить лимит размера вложений
+        for path in paths:
+            await ctx.send(file=discord.File(path, filename=os.path.basename(path)))
+    except Exception as e:
+        await ctx.send(f"❌ Ошибка выгрузки: {str(e)}")
+        log(f"Ошибка выгрузки {query['kind']}: {str(e)}", level='error')
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+@bot.command(name='metrics')
+@commands.has_role(ADMIN_ROLE_ID)
+async def metrics_command(ctx):
+    """Выгружает метрики бота в текстовом формате Prometheus"""
+    content = registry.render()
+    if len(content) > 1900:
+        await ctx.send(file=text_file(content, "metrics.txt"))
+    else:
+        await ctx.send(f"```{content}```")
+
+@bot.command(name='memory')
+@commands.has_role(ADMIN_ROLE_ID)
+async def memory_command(ctx):
+    """Показывает память процесса и заполнение кэша участников"""
+    report = memory_report(
+        bot.guilds, len(bot.users), 'облегченный' if LEAN_GATEWAY else 'полный',
+        {
+            'Открытых сессий': len(active_sessions),
+            'Участников в индексе каналов': len(occupancy.locations),
+            'Записей кэша ролей': len(mod_cache)
+        }
+    )
+    await ctx.send(f"```{report}```")
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.command_started = time.perf_counter()
+
+@bot.after_invoke
+async def stop_command_timer(ctx):
+    started = getattr(ctx, 'command_started', None)
+    if started is not None:
+        command_seconds.observe(time.perf_counter() - started, command=ctx.command.qualified_name)
 
 @send_report.error
 async def report_error(ctx, error):
-    if isinstance(error, commands.MissingRole):
+    if isinstance(error, (commands.MissingRole, NotModerator)):
         await ctx.send("Эта команда доступна только модераторам!")
     elif isinstance(error, commands.MissingRequiredArgument):
         await ctx.send("Пожалуйста, укажите текст доклада!")
     else:
         await ctx.send("Произошла неизвестная ошибка")
 
-def format_duration(seconds: float) -> str:
-    hours, rem = divmod(seconds, 3600)
-    minutes, seconds = divmod(rem, 60)
-    return f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}"
+@bot.event
+async def on_command_error(ctx, error):
+    if ctx.command and ctx.command.has_error_handler():
+        return
+    if isinstance(error, NotModerator):
+        await ctx.send(str(error))
+        return
+    log(f"\033[31mОшибка команды {ctx.command}: {str(error)}\033[0m", level='error')
+
+async def send_lines(ctx, lines: list):
+    for chunk in chunk_lines(lines):
+        await ctx.send(chunk, coalesce=True)
 
 if __name__ == '__main__':
     try:
         bot.run(TOKEN)
     except discord.errors.LoginFailure:
-        log("Неверный токен бота!")
+        log("Неверный токен бота!", level='error')
     except Exception as e:
-        log(f"Критическая ошибка: {str(e)}")
\ No newline at end of file
+        log(f"Критическая ошибка: {str(e)}", level='error')
\ No newline at end of file
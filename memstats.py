@@ -0,0 +1,52 @@
+import os
+import sys
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss() -> int:
+    """Пиковый RSS процесса в байтах (0, если платформа не сообщает)"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def process_rss() -> int:
+    """Текущий RSS процесса в байтах; где /proc недоступен - пиковый"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return peak_rss()
+
+def format_bytes(size: float) -> str:
+    for unit in ('Б', 'КБ', 'МБ'):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+def member_cache_stats(guilds) -> dict:
+    cached = total = in_voice = 0
+    for guild in guilds:
+        cached += len(guild.members)
+        total += guild.member_count or len(guild.members)
+        in_voice += sum(len(channel.members) for channel in (*guild.voice_channels, *guild.stage_channels))
+    return {'cached': cached, 'total': total, 'in_voice': in_voice}
+
+def memory_report(guilds, users: int, mode: str, extra: dict = None) -> str:
+    stats = member_cache_stats(guilds)
+    share = stats['cached'] / stats['total'] * 100 if stats['total'] else 0.0
+    lines = [
+        f"Режим шлюза: {mode}",
+        f"Память процесса: {format_bytes(process_rss())} (пик {format_bytes(peak_rss())})",
+        f"Участников в кэше: {stats['cached']} из {stats['total']} ({share:.1f}%), в голосовых каналах: {stats['in_voice']}",
+        f"Пользователей в кэше: {users}",
+        f"Не загружено участников: {stats['total'] - stats['cached']}"
+    ]
+    for name, value in (extra or {}).items():
+        lines.append(f"{name}: {value}")
+    return '\n'.join(lines)
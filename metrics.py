@@ -0,0 +1,198 @@
+import time
+import asyncio
+import functools
+from logger import log
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(labels: tuple, extra: str = None) -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return lines
+
+    def samples(self) -> list:
+        return []
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in self.values.items()]
+
+class Gauge(Metric):
+    """Значение читается функцией в момент выгрузки, поэтому на горячем пути ничего не стоит"""
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, func):
+        super().__init__(name, help)
+        self.func = func
+
+    def samples(self):
+        try:
+            return [f"{self.name} {_format_value(self.func())}"]
+        except Exception as e:
+            log(f"Ошибка чтения метрики {self.name}: {str(e)}", level='error')
+            return []
+
+class CounterFunc(Gauge):
+    type = 'counter'
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.series = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        lines = []
+        for key, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+    def quantile(self, q: float, **labels):
+        """Оценка квантиля по границам корзин (верхняя граница корзины, где накопилось q)"""
+        series = self.series.get(tuple(sorted(labels.items())))
+        if not series or not series[2]:
+            return None
+        target = q * series[2]
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, series[0]):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return bound
+        return self.buckets[-1]
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            return self.metrics[metric.name]
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter(name, help))
+
+    def gauge(self, name: str, help: str, func) -> Gauge:
+        return self._register(Gauge(name, help, func))
+
+    def counter_func(self, name: str, help: str, func) -> CounterFunc:
+        return self._register(CounterFunc(name, help, func))
+
+    def histogram(self, name: str, help: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+def timed(histogram: Histogram, **labels):
+    """Декоратор корутины: время выполнения попадает в гистограмму"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+class MetricsServer:
+    """Минимальный HTTP сервер: GET /metrics отдает реестр в текстовом формате Prometheus"""
+
+    def __init__(self, registry: MetricsRegistry, host: str = '127.0.0.1', port: int = 9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        if self._server is not None:
+            return
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        log(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                body = self.registry.render().encode('utf-8')
+                status = '200 OK'
+            else:
+                body = b'Not Found\n'
+                status = '404 Not Found'
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except Exception as e:
+            log(f"Ошибка обработки запроса метрик: {str(e)}", level='error')
+        finally:
+            writer.close()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
@@ -0,0 +1,47 @@
+class ModeratorCache:
+    """Кэш принадлежности к модераторам: (сервер, пользователь) -> есть ли роль модератора.
+
+    role_ids_for(guild_id) возвращает роли модераторов конкретного сервера.
+    """
+
+    def __init__(self, role_ids_for):
+        self.role_ids_for = role_ids_for
+        self._guilds = {}
+        self.hits = 0
+        self.misses = 0
+
+    def is_moderator(self, member) -> bool:
+        guild = getattr(member, 'guild', None)
+        if guild is None:
+            return False
+        members = self._guilds.get(guild.id)
+        if members is None:
+            members = self._guilds[guild.id] = {}
+        cached = members.get(member.id)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        role_ids = self.role_ids_for(guild.id)
+        result = any(role.id in role_ids for role in member.roles)
+        members[member.id] = result
+        return result
+
+    def invalidate(self, guild_id: int, user_id: int):
+        members = self._guilds.get(guild_id)
+        if members:
+            members.pop(user_id, None)
+
+    def invalidate_guild(self, guild_id: int):
+        self._guilds.pop(guild_id, None)
+
+    def clear(self):
+        self._guilds.clear()
+
+    def __len__(self):
+        return sum(len(members) for members in self._guilds.values())
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        ratio = self.hits / total * 100 if total else 0.0
+        return f"записей {len(self)}, попаданий {self.hits}, промахов {self.misses} ({ratio:.1f}% попаданий)"
@@ -0,0 +1,98 @@
+class ChannelOccupancy:
+    __slots__ = ('moderators', 'users')
+
+    def __init__(self):
+        self.moderators = set()
+        self.users = set()
+
+    def __bool__(self):
+        return bool(self.moderators or self.users)
+
+class VoiceOccupancy:
+    """Индекс занятости голосовых каналов: канал -> модераторы и обычные пользователи"""
+
+    def __init__(self):
+        self.channels = {}
+        self.locations = {}
+
+    def join(self, user_id: int, channel_id: int, is_moderator: bool):
+        self.leave(user_id)
+        occupancy = self.channels.get(channel_id)
+        if occupancy is None:
+            occupancy = self.channels[channel_id] = ChannelOccupancy()
+        (occupancy.moderators if is_moderator else occupancy.users).add(user_id)
+        self.locations[user_id] = channel_id
+
+    def leave(self, user_id: int):
+        channel_id = self.locations.pop(user_id, None)
+        if channel_id is None:
+            return None
+        occupancy = self.channels[channel_id]
+        occupancy.moderators.discard(user_id)
+        occupancy.users.discard(user_id)
+        if not occupancy:
+            del self.channels[channel_id]
+        return channel_id
+
+    def update_role(self, user_id: int, is_moderator: bool):
+        """Переносит пользователя между группами; возвращает канал, если что-то изменилось"""
+        channel_id = self.locations.get(user_id)
+        if channel_id is None:
+            return None
+        occupancy = self.channels[channel_id]
+        if (user_id in occupancy.moderators) == is_moderator:
+            return None
+        self.join(user_id, channel_id, is_moderator)
+        return channel_id
+
+    def channel_of(self, user_id: int):
+        return self.locations.get(user_id)
+
+    def user_count(self, channel_id: int) -> int:
+        occupancy = self.channels.get(channel_id)
+        return len(occupancy.users) if occupancy else 0
+
+    def users_in(self, channel_id: int) -> set:
+        occupancy = self.channels.get(channel_id)
+        return occupancy.users if occupancy else set()
+
+    def moderators_in(self, channel_id: int) -> set:
+        occupancy = self.channels.get(channel_id)
+        return occupancy.moderators if occupancy else set()
+
+    def rebuild(self, entries, scope=None) -> set:
+        """Пересобирает индекс из живого состояния (user_id, channel_id, is_moderator).
+
+        scope - каналы одного сервера: остальная часть индекса не трогается.
+        Возвращает каналы, в которых индекс расходился с реальностью.
+        """
+        fresh = VoiceOccupancy()
+        for user_id, channel_id, is_moderator in entries:
+            fresh.join(user_id, channel_id, is_moderator)
+        old_channels = self.channels.keys() if scope is None else self.channels.keys() & set(scope)
+        changed = set()
+        for channel_id in old_channels | fresh.channels.keys():
+            old = self.channels.get(channel_id)
+            new = fresh.channels.get(channel_id)
+            if old is None or new is None or old.moderators != new.moderators or old.users != new.users:
+                changed.add(channel_id)
+        if scope is None:
+            self.channels = fresh.channels
+            self.locations = fresh.locations
+            return changed
+        for channel_id in list(old_channels):
+            occupancy = self.channels.pop(channel_id)
+            for user_id in (*occupancy.moderators, *occupancy.users):
+                self.locations.pop(user_id, None)
+        for user_id in fresh.locations:
+            # Пользователь мог перейти сюда из канала другого сервера
+            previous = self.leave(user_id)
+            if previous is not None:
+                changed.add(previous)
+        self.channels.update(fresh.channels)
+        self.locations.update(fresh.locations)
+        return changed
+
+    def clear(self):
+        self.channels.clear()
+        self.locations.clear()
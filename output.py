@@ -0,0 +1,250 @@
+import io
+import time
+import asyncio
+import discord
+from logger import log
+from metrics import registry
+
+MESSAGE_LIMIT = 1900
+
+queue_wait_seconds = registry.histogram('bot_output_wait_seconds', 'Время ожидания сообщения в очереди отправки')
+messages_sent = registry.counter('bot_output_messages_total', 'Отправлено сообщений через очередь')
+messages_coalesced = registry.counter('bot_output_coalesced_total', 'Сообщений склеено с соседними в одно')
+
+def chunk_lines(lines: list, limit: int = MESSAGE_LIMIT) -> list:
+    """Склеивает строки в сообщения не длиннее limit, разрывая только между строками"""
+    chunks = []
+    current = []
+    size = 0
+    for line in lines:
+        line = line[:limit]
+        if current and size + len(line) + 1 > limit:
+            chunks.append('\n'.join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+def paginate_lines(lines: list, per_page: int, limit: int = MESSAGE_LIMIT) -> list:
+    """Страницы по per_page строк; слишком длинная страница делится по границам строк"""
+    pages = []
+    for i in range(0, len(lines), per_page):
+        pages.extend(chunk_lines(lines[i:i + per_page], limit))
+    return pages
+
+class TokenBucket:
+    """rate отправок за period секунд с накоплением не больше rate"""
+
+    __slots__ = ('rate', 'period', 'tokens', 'updated')
+
+    def __init__(self, rate: int, period: float):
+        self.rate = rate
+        self.period = period
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Забирает отправку и возвращает 0 или сколько секунд ждать до следующей"""
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.period)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) * self.period / self.rate
+
+    async def acquire(self):
+        delay = self.take()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.take()
+
+    def idle(self) -> bool:
+        return time.monotonic() - self.updated >= self.period
+
+class _Message:
+    __slots__ = ('send', 'content', 'kwargs', 'coalesce', 'futures', 'enqueued')
+
+    def __init__(self, send, content, kwargs, coalesce, future):
+        self.send = send
+        self.content = content
+        self.kwargs = kwargs
+        self.coalesce = coalesce
+        self.futures = [future]
+        self.enqueued = time.perf_counter()
+
+class OutputQueue:
+    """Общая очередь ответов бота с учетом лимитов Discord.
+
+    У каждого канала своя очередь и свой лимит (по умолчанию 5 сообщений за 5 секунд),
+    поверх них - общий лимит бота в секунду. Сообщения одного канала уходят строго
+    по порядку. Короткие текстовые сообщения, отправленные с coalesce=True и
+    скопившиеся в очереди канала подряд, склеиваются в одно, пока оно помещается в лимит.
+
+    До start() сообщения отправляются сразу.
+    """
+
+    def __init__(self, channel_rate: int = 5, channel_period: float = 5.0, global_rate: int = 50,
+                 limit: int = MESSAGE_LIMIT):
+        self.channel_rate = channel_rate
+        self.channel_period = channel_period
+        self.limit = limit
+        self.global_bucket = TokenBucket(global_rate, 1.0)
+        self._queues = {}
+        self._buckets = {}
+        self._workers = {}
+        self._started = False
+        self.sent = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        log(f"Очередь отправки запущена ({self.channel_rate} сообщений за {self.channel_period:g}с на канал)")
+
+    async def send(self, key, send, content=None, coalesce: bool = False, **kwargs):
+        """Отправляет send(content, **kwargs) в очереди канала key и возвращает отправленное сообщение"""
+        if not self._started:
+            return await send(content, **kwargs)
+        coalesce = coalesce and not kwargs and isinstance(content, str)
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(key, [])
+        last = queue[-1] if queue else None
+        if (coalesce and last is not None and last.coalesce
+                and len(last.content) + len(content) + 1 <= self.limit):
+            last.content = f"{last.content}\n{content}"
+            last.futures.append(future)
+            self.coalesced += 1
+            messages_coalesced.inc()
+        else:
+            queue.append(_Message(send, content, kwargs, coalesce, future))
+        if key not in self._workers:
+            self._workers[key] = asyncio.get_running_loop().create_task(self._drain(key))
+        return await future
+
+    def _bucket(self, key) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            # Лимиты каналов, в которые давно не писали, уже восстановились - их можно забыть
+            for stale in [other for other, other_bucket in self._buckets.items()
+                          if other not in self._workers and other_bucket.idle()]:
+                del self._buckets[stale]
+            bucket = self._buckets[key] = TokenBucket(self.channel_rate, self.channel_period)
+        return bucket
+
+    async def _drain(self, key):
+        bucket = self._bucket(key)
+        queue = self._queues[key]
+        try:
+            while queue:
+                await bucket.acquire()
+                await self.global_bucket.acquire()
+                # Пока ждали лимит, к первому сообщению могли приклеиться новые
+                message = queue.pop(0)
+                queue_wait_seconds.observe(time.perf_counter() - message.enqueued)
+                try:
+                    result = await message.send(message.content, **message.kwargs)
+                except Exception as e:
+                    for future in message.futures:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                self.sent += 1
+                messages_sent.inc()
+                for future in message.futures:
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            del self._workers[key]
+            if not queue:
+                self._queues.pop(key, None)
+
+    async def stop(self):
+        """Дожидается отправки накопившихся сообщений; дальше сообщения уходят сразу"""
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        if self._started:
+            self._started = False
+            log(f"Очередь отправки остановлена: отправлено {self.sent}, склеено {self.coalesced}")
+
+class Pager(discord.ui.View):
+    """Кнопки листания страниц под сообщением.
+
+    load(номер) -> (текст, содержимое вложения или None) вызывается один раз на страницу:
+    просмотренные страницы берутся из кэша, а не читаются из хранилища заново.
+    """
+
+    def __init__(self, load, pages: int, author_id: int, page: int = 1, filename: str = 'page.txt',
+                 timeout: float = 300):
+        super().__init__(timeout=timeout)
+        self.load = load
+        self.pages = pages
+        self.page = page
+        self.author_id = author_id
+        self.filename = filename
+        self.cache = {}
+        self.message = None
+        self._update_buttons()
+
+    async def render(self, page: int):
+        if page not in self.cache:
+            self.cache[page] = await self.load(page)
+        return self.cache[page]
+
+    def attachment(self, content: str) -> discord.File:
+        # discord.File читается при отправке один раз, поэтому создается заново на каждый показ
+        return discord.File(io.BytesIO(content.encode('utf-8')), filename=self.filename)
+
+    def _update_buttons(self):
+        self.previous_page.disabled = self.page <= 1
+        self.next_page.disabled = self.page >= self.pages
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Листать может только автор команды", ephemeral=True)
+            return False
+        return True
+
+    async def show(self, interaction: discord.Interaction, page: int):
+        self.page = min(max(page, 1), self.pages)
+        content, attached = await self.render(self.page)
+        self._update_buttons()
+        await interaction.response.edit_message(
+            content=content, attachments=[self.attachment(attached)] if attached else [], view=self
+        )
+
+    @discord.ui.button(label='◀', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show(interaction, self.page - 1)
+
+    @discord.ui.button(label='▶', style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show(interaction, self.page + 1)
+
+    async def on_timeout(self):
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+async def send_pages(ctx, load, pages: int, page: int = 1, filename: str = 'page.txt', timeout: float = 300):
+    """Показывает страницу page; если страниц больше одной, добавляет кнопки листания"""
+    page = min(max(page, 1), pages)
+    if pages <= 1:
+        content, attached = await load(page)
+        return await ctx.send(content, file=text_file(attached, filename) if attached else None)
+    pager = Pager(load, pages, ctx.author.id, page, filename, timeout)
+    content, attached = await pager.render(page)
+    kwargs = {'file': pager.attachment(attached)} if attached else {}
+    pager.message = await ctx.send(content, view=pager, **kwargs)
+    return pager.message
+
+def text_file(content: str, filename: str) -> discord.File:
+    return discord.File(io.BytesIO(content.encode('utf-8')), filename=filename)
@@ -0,0 +1,142 @@
+import time
+import asyncio
+from logger import log
+from metrics import registry
+
+event_wait_seconds = registry.histogram('bot_session_event_wait_seconds', 'Время ожидания события сессии в очереди')
+batch_seconds = registry.histogram('bot_session_batch_seconds', 'Время обработки пачки событий одного ключа')
+
+class _Call:
+    __slots__ = ('func', 'args', 'future')
+
+    def __init__(self, func, args, future):
+        self.func = func
+        self.args = args
+        self.future = future
+
+class EventPipeline:
+    """Упорядоченная очередь событий, меняющих сессии.
+
+    События группируются по ключу (модератор, канал): события одного ключа выполняются
+    строго в порядке поступления, а накопившиеся подряд забираются одной пачкой. Очередь
+    разбирает единственный обработчик, поэтому обработка одного события не может
+    вклиниться между await другого. Очередь ограничена: put() ждет, пока освободится место.
+
+    До start() события обрабатываются сразу в вызывающей задаче.
+    """
+
+    def __init__(self, handler, max_pending: int = 10000, batch_size: int = 64):
+        self.handler = handler
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self._queues = {}
+        self._pending = 0
+        self._wakeup = None
+        self._space = None
+        self._idle = None
+        self._task = None
+        self._stopping = False
+        self.processed = 0
+        self.batches = 0
+        self.waits = 0
+
+    def __len__(self) -> int:
+        return self._pending
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        log(f"Очередь событий сессий запущена (лимит {self.max_pending}, пачка до {self.batch_size})")
+
+    async def put(self, key, event):
+        """Ставит событие в очередь ключа; при переполнении ждет, пока обработчик разгрузит очередь"""
+        if self._task is None:
+            await self._handle(key, [(time.perf_counter(), event)])
+            return
+        while self._pending >= self.max_pending:
+            self.waits += 1
+            self._space.clear()
+            await self._space.wait()
+        self._queues.setdefault(key, []).append((time.perf_counter(), event))
+        self._pending += 1
+        self._idle.clear()
+        self._wakeup.set()
+
+    async def call(self, key, func, *args):
+        """Выполняет func(*args) в порядке очереди ключа и возвращает ее результат"""
+        if self._task is None:
+            return await func(*args)
+        future = asyncio.get_running_loop().create_future()
+        await self.put(key, _Call(func, args, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            if not self._queues:
+                self._idle.set()
+                if self._stopping:
+                    return
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            # Ключи берутся по кругу: длинная очередь одного модератора не задерживает остальных
+            key = next(iter(self._queues))
+            items = self._queues.pop(key)
+            if len(items) > self.batch_size:
+                items, self._queues[key] = items[:self.batch_size], items[self.batch_size:]
+            self._pending -= len(items)
+            if self._pending < self.max_pending:
+                self._space.set()
+            await self._handle(key, items)
+            # Отдаем управление, чтобы обработчики событий Discord успевали ставить новые события
+            await asyncio.sleep(0)
+
+    async def _handle(self, key, items: list):
+        started = time.perf_counter()
+        for enqueued, _ in items:
+            event_wait_seconds.observe(started - enqueued)
+        events = []
+        for _, event in items:
+            if isinstance(event, _Call):
+                await self._dispatch(key, events)
+                events = []
+                try:
+                    event.future.set_result(await event.func(*event.args))
+                except Exception as e:
+                    event.future.set_exception(e)
+            else:
+                events.append(event)
+        await self._dispatch(key, events)
+        self.processed += len(items)
+        self.batches += 1
+        batch_seconds.observe(time.perf_counter() - started)
+
+    async def _dispatch(self, key, events: list):
+        if not events:
+            return
+        try:
+            await self.handler(key, events)
+        except Exception as e:
+            log(f"\033[31mОшибка обработки событий {key}: {str(e)}\033[0m", level='error')
+
+    async def join(self):
+        """Дожидается, пока очередь опустеет"""
+        if self._task is not None:
+            await self._idle.wait()
+
+    async def stop(self):
+        """Разбирает оставшиеся события и останавливает обработчик"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        log(f"Очередь событий сессий остановлена: обработано {self.processed} событий в {self.batches} пачках")
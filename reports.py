@@ -0,0 +1,264 @@
+import os
+import time
+import asyncio
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logger import log
+from contacts import top_contacts
+from metrics import registry
+
+report_generation_seconds = registry.histogram(
+    'bot_report_generation_seconds', 'Полное время генерации отчетов',
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+)
+report_sections = registry.counter('bot_report_sections_total', 'Разделы отчетов: пересчитанные и взятые из кэша')
+
+class ReportCancelled(Exception):
+    pass
+
+def format_hours(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02}:{(seconds % 3600) // 60:02}"
+
+def render_contacts(contacts: dict) -> list:
+    if not contacts:
+        return []
+    content = [
+        f"Уникальных пользователей: {len(contacts)}",
+        f"Время с пользователями (сумма по всем): {format_hours(sum(contacts.values()))}",
+        "Больше всего времени с:"
+    ]
+    for contact_id, seconds in top_contacts(contacts):
+        content.append(f"- {contact_id}: {format_hours(seconds)}")
+    return content
+
+def render_individual(user_id: str, data: dict) -> str:
+    start_date = datetime.datetime.fromtimestamp(data['first_start']) if data['first_start'] else None
+    end_date = datetime.datetime.fromtimestamp(data['last_end']) if data['last_end'] else None
+    time_str = format_hours(data['total_seconds'])
+    K = data['coefficient']
+    content = [
+        f"Модератор: {user_id}",
+        f"Период: {start_date.strftime('%d.%m.%Y') if start_date else 'N/A'} - {end_date.strftime('%d.%m.%Y') if end_date else 'N/A'}",
+        "────────────────────",
+        f"Общее время в голосовых каналах: {time_str}",
+        f"Количество докладов: {data['report_count']}"
+    ]
+    if K is not None:
+        content.append(f"Коэффициент: {K:.4f}")
+    content.extend(render_contacts(data.get('contacts')))
+    if data['recent_reports']:
+        content.append("Список докладов:")
+        for date, text in data['recent_reports']:
+            content.append(f"- {date}: {text[:50]}{'...' if len(text) > 50 else ''}")
+    return '\n'.join(content)
+
+def render_general_section(user_id: str, data: dict) -> list:
+    K = data['coefficient']
+    section = [
+        f"🔹 Модератор {user_id}:\n"
+        f"   - Общее время: {data['total_seconds']//3600} часов\n"
+        f"   - Докладов: {data['report_count']}\n"
+    ]
+    if K is not None:
+        section.append(f"   - Коэффициент: {K:.4f}\n")
+    contacts = data.get('contacts')
+    if contacts:
+        section.append(f"   - Пользователей: {len(contacts)}, время с ними: {format_hours(sum(contacts.values()))}\n")
+    if data['recent_reports']:
+        section.append("   📝 Последние доклады:")
+        for date, text in data['recent_reports'][-100:]:
+            truncated_text = text[:50] + "..." if len(text) > 1000 else text
+            section.append(f"     ▪ {date}: {truncated_text}")
+        section.append("")
+    section.append("────────────────────")
+    return section
+
+def render_general_header(moderators: dict) -> list:
+    return [
+        f"ОБЩИЙ ОТЧЕТ",
+        f"Дата генерации: {datetime.datetime.now().strftime('%d.%m.%Y %H:%M:%S')}",
+        "════════════════════════════",
+        f"Всего модераторов: {len(moderators)}",
+        f"Суммарное время: {sum(data['total_seconds'] for data in moderators.values()) // 3600} часов",
+        f"Всего докладов: {sum(data['report_count'] for data in moderators.values())}",
+        "\n════════════════════════════\n"
+    ]
+
+def write_reports(base_dir: str, moderators: dict, job, sections: dict = None, dirty: set = None) -> int:
+    """Пишет индивидуальные отчеты и general_report.txt (выполняется в пуле потоков).
+
+    sections - кэш разделов общего отчета с прошлой генерации. Если передан dirty, заново
+    рендерятся только модераторы из него и те, кого нет в кэше: у остальных индивидуальный
+    файл не переписывается, а их раздел вклеивается в общий отчет из кэша.
+    """
+    general_reports_dir = os.path.join(base_dir, 'general_reports')
+    os.makedirs(general_reports_dir, exist_ok=True)
+    if sections is None:
+        sections = {}
+    general_content = render_general_header(moderators)
+    for user_id, data in moderators.items():
+        if job.cancel_event.is_set():
+            raise ReportCancelled()
+        section = sections.get(user_id) if dirty is not None and user_id not in dirty else None
+        if section is None:
+            report_path = os.path.join(general_reports_dir, f"{user_id}_general_report.txt")
+            with open(report_path, 'w', encoding='utf-8') as f:
+                f.write(render_individual(user_id, data))
+            section = sections[user_id] = render_general_section(user_id, data)
+            job.rendered += 1
+        else:
+            job.reused += 1
+        general_content.extend(section)
+        job.done += 1
+    for user_id in [user_id for user_id in sections if user_id not in moderators]:
+        del sections[user_id]
+    with open(os.path.join(base_dir, 'general_report.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(general_content))
+    report_sections.inc(job.rendered, result='rendered')
+    report_sections.inc(job.reused, result='reused')
+    return len(moderators)
+
+def snapshot_summaries(moderators: dict) -> dict:
+    """Копия итогов, чтобы поток генерации не видел изменений из event loop"""
+    return {
+        user_id: dict(data, recent_reports=list(data['recent_reports']), contacts=dict(data.get('contacts') or {}))
+        for user_id, data in moderators.items()
+    }
+
+class ReportJob:
+    STATES = {
+        'running': "⏳ выполняется",
+        'done': "✅ завершена",
+        'cancelled': "🛑 отменена",
+        'failed': "❌ ошибка"
+    }
+
+    def __init__(self, job_id: int, requested_by: str, full: bool = False):
+        self.id = job_id
+        self.requested_by = requested_by
+        self.full = full
+        self.state = 'running'
+        self.total = 0
+        self.done = 0
+        self.rendered = 0
+        self.reused = 0
+        self.error = None
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.task = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def describe(self) -> str:
+        text = (
+            f"Генерация отчетов #{self.id}: {self.STATES[self.state]} — "
+            f"модераторов {self.done}/{self.total}, {self.elapsed:.1f}с"
+        )
+        if self.done:
+            text += f"\n{'Полная пересборка' if self.full else 'Пересчитано'}: {self.rendered}, из кэша: {self.reused}"
+        if self.error:
+            text += f"\nОшибка: {self.error}"
+        return text
+
+class ReportJobManager:
+    """Гарантирует одну генерацию за раз; повторные запросы присоединяются к текущей.
+
+    Между генерациями запоминает, у кого из модераторов появились сессии, доклады или
+    новый коэффициент (mark_dirty), и пересчитывает отчеты только им.
+    """
+
+    def __init__(self, base_dir: str, workers: int = 1, progress_interval: float = 2.0):
+        self.base_dir = base_dir
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reports')
+        self.progress_interval = progress_interval
+        self.current = None
+        self.last = None
+        self._next_id = 1
+        self.sections = {}
+        self.dirty = set()
+        self.full_pending = True
+
+    def mark_dirty(self, user_id):
+        self.dirty.add(str(user_id))
+
+    def mark_all(self):
+        """Данные поменялись целиком (сброс, импорт, пересчет итогов): следующая генерация полная"""
+        self.full_pending = True
+
+    @property
+    def running(self) -> bool:
+        return self.current is not None and self.current.state == 'running'
+
+    def start(self, summaries_func, requested_by: str = 'планировщик', full: bool = False):
+        """Возвращает (задача, создана_ли_новая)"""
+        if self.running:
+            return self.current, False
+        job = ReportJob(self._next_id, requested_by, full or self.full_pending)
+        self._next_id += 1
+        self.current = job
+        job.task = asyncio.get_running_loop().create_task(self._run(job, summaries_func))
+        return job, True
+
+    async def _run(self, job: ReportJob, summaries_func):
+        # Изменения, пришедшие после этой точки, попадут в следующую генерацию
+        dirty, self.dirty = self.dirty, set()
+        self.full_pending = False
+        try:
+            moderators = snapshot_summaries(await summaries_func())
+            job.total = len(moderators)
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, write_reports, self.base_dir, moderators, job,
+                self.sections, None if job.full else dirty
+            )
+            job.state = 'done'
+            report_generation_seconds.observe(job.elapsed)
+            log(
+                f"Генерация отчетов #{job.id} завершена: {job.total} модераторов за {job.elapsed:.2f}с "
+                f"(пересчитано {job.rendered}, из кэша {job.reused})"
+            )
+        except ReportCancelled:
+            job.state = 'cancelled'
+            log(f"Генерация отчетов #{job.id} отменена на {job.done}/{job.total}")
+        except Exception as e:
+            job.state = 'failed'
+            job.error = str(e)
+            log(f"Ошибка генерации отчетов: {str(e)}", level='error')
+        finally:
+            if job.state != 'done':
+                # Незаконченная генерация: ее изменения остаются на следующий раз
+                self.dirty |= dirty
+                self.full_pending = self.full_pending or job.full
+            job.finished_at = time.monotonic()
+            self.last = job
+
+    async def follow(self, job: ReportJob, message):
+        """Редактирует сообщение с прогрессом, пока задача не завершится"""
+        while True:
+            await asyncio.wait([job.task], timeout=self.progress_interval)
+            await self._edit_message(job, message)
+            if job.task.done():
+                break
+
+    async def _edit_message(self, job: ReportJob, message):
+        try:
+            await message.edit(content=job.describe())
+        except Exception as e:
+            log(f"Не удалось обновить прогресс генерации: {str(e)}", level='warning')
+
+    def cancel(self) -> bool:
+        if not self.running:
+            return False
+        self.current.cancel_event.set()
+        return True
+
+    def status(self):
+        return self.current if self.running else self.last
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False)
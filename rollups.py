@@ -0,0 +1,153 @@
+import os
+import ast
+import json
+import datetime
+from contacts import merge_contacts, parse_contacts
+
+DATE_FORMAT = '%d.%m.%Y %H:%M:%S'
+REPORT_SEPARATOR = '----------------------------'
+# Храним текст доклада не длиннее 1001 символа: этого хватает, чтобы отчеты
+# по-прежнему знали, превышал ли он 1000 символов
+REPORT_TEXT_LIMIT = 1001
+
+def parse_duration(duration_str: str) -> int:
+    h, m, s = map(int, duration_str.split(':'))
+    return h * 3600 + m * 60 + s
+
+def format_duration(seconds: float) -> str:
+    hours, rem = divmod(seconds, 3600)
+    minutes, seconds = divmod(rem, 60)
+    return f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}"
+
+def parse_voice_line(line: str):
+    """Разбирает строку голосового лога: (начало или None, длительность в секундах, канал или None, {user_id: секунды})"""
+    fields = {}
+    for part in line.strip().split(' | '):
+        key, _, value = part.partition(': ')
+        fields[key] = value
+    if 'Duration' not in fields:
+        return None
+    start = datetime.datetime.strptime(fields['Date'], DATE_FORMAT) if 'Date' in fields else None
+    channel_id = int(fields['Channel']) if 'Channel' in fields else None
+    contacts = parse_contacts(fields['Contacts']) if fields.get('Contacts') else {}
+    return start, parse_duration(fields['Duration']), channel_id, contacts
+
+def iter_reports(lines):
+    """Доклады по одному, не собирая весь файл в список"""
+    current_report = {}
+    for line in lines:
+        line = line.strip()
+        if line.startswith('Moderator ID:'):
+            if current_report:
+                yield current_report
+            current_report = {'id': line.split(': ')[1]}
+        elif line.startswith('Date:'):
+            current_report['date'] = line.split(': ')[1]
+        elif line.startswith('Report:'):
+            current_report['text'] = []
+        elif line == REPORT_SEPARATOR:
+            if current_report.get('text') is not None:
+                current_report['text'] = '\n'.join(current_report['text'])
+                yield current_report
+                current_report = {}
+        elif 'text' in current_report:
+            current_report['text'].append(line.replace('\\n', '\n'))
+    if current_report:
+        if isinstance(current_report.get('text'), list):
+            current_report['text'] = '\n'.join(current_report['text'])
+        yield current_report
+
+def parse_reports(lines) -> list:
+    return list(iter_reports(lines))
+
+def read_moderator_info(path: str):
+    """(параметры, коэффициент) из файла moderator_info/<id>_info.txt"""
+    params, K = {}, None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('Parameters:'):
+                params = ast.literal_eval(line.split(': ', 1)[1].strip())
+            elif line.startswith('Coefficient:'):
+                K = float(line.split(': ')[1])
+    return params, K
+
+def read_coefficient(path: str):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('Coefficient:'):
+                return float(line.split(': ')[1])
+    return None
+
+def empty_rollup() -> dict:
+    return {
+        'total_seconds': 0,
+        'sessions': 0,
+        'first_start': None,
+        'last_end': None,
+        'report_count': 0,
+        'recent_reports': [],
+        'coefficient': None,
+        'contacts': {}
+    }
+
+class RollupStore:
+    """Накопительные итоги по каждому модератору, обновляемые при каждой записи"""
+
+    def __init__(self, path: str, recent_limit: int = 100):
+        self.path = path
+        self.recent_limit = recent_limit
+        self.moderators = {}
+        self.loaded = False
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.moderators = data.get('moderators', {})
+        self.loaded = True
+        return True
+
+    def dump(self) -> str:
+        return json.dumps({'version': 1, 'moderators': self.moderators}, ensure_ascii=False)
+
+    def get(self, user_id) -> dict:
+        key = str(user_id)
+        if key not in self.moderators:
+            self.moderators[key] = empty_rollup()
+        return self.moderators[key]
+
+    def record_session(self, user_id, start: datetime.datetime, seconds: int, contacts: dict = None):
+        start_ts = start.timestamp() if start is not None else None
+        self.record_totals(user_id, 1, seconds, start_ts, start_ts + int(seconds) if start_ts is not None else None, contacts)
+
+    def record_totals(self, user_id, sessions: int, seconds: int, first_start: float, last_end: float,
+                      contacts: dict = None):
+        """Добавляет итоги сразу нескольких сессий (например, из заголовка сжатого сегмента)"""
+        rollup = self.get(user_id)
+        if contacts:
+            # Итоги, сохраненные до учета контактов, получают поле при первой записи
+            merge_contacts(rollup.setdefault('contacts', {}), contacts)
+        rollup['total_seconds'] += int(seconds)
+        rollup['sessions'] += sessions
+        if first_start is not None and (rollup['first_start'] is None or first_start < rollup['first_start']):
+            rollup['first_start'] = first_start
+        if last_end is not None and (rollup['last_end'] is None or last_end > rollup['last_end']):
+            rollup['last_end'] = last_end
+
+    def record_report(self, user_id, date_str: str, text: str):
+        rollup = self.get(user_id)
+        rollup['report_count'] += 1
+        rollup['recent_reports'].append([date_str, text.strip()[:REPORT_TEXT_LIMIT]])
+        if len(rollup['recent_reports']) > self.recent_limit:
+            del rollup['recent_reports'][:-self.recent_limit]
+
+    def set_coefficient(self, user_id, K: float):
+        self.get(user_id)['coefficient'] = K
+
+    def replace_all(self, moderators: dict):
+        self.moderators = moderators
+        self.loaded = True
+
+    def clear(self):
+        self.moderators = {}
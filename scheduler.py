@@ -0,0 +1,190 @@
+import time
+import random
+import asyncio
+import datetime
+from logger import log
+from metrics import registry
+
+job_seconds = registry.histogram('bot_job_seconds', 'Время выполнения периодических задач')
+job_failures = registry.counter('bot_job_failures_total', 'Ошибки периодических задач')
+
+def parse_daily(value: str):
+    """'03:30' -> (3, 30); пустая строка отключает задачу"""
+    if not value:
+        return None
+    hour, _, minute = value.partition(':')
+    hour, minute = int(hour), int(minute or 0)
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Некорректное время: {value}")
+    return hour, minute
+
+class Job:
+    """Периодическая задача: интервал или время суток, разброс запуска и отсрочка после ошибок"""
+
+    def __init__(self, name: str, func, interval: float = None, daily_at: tuple = None, jitter: float = 0.0,
+                 backoff: float = 30.0, backoff_max: float = 3600.0, description: str = ''):
+        if interval is None and daily_at is None:
+            raise ValueError(f"Задаче {name} нужен интервал или время запуска")
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.daily_at = daily_at
+        self.jitter = jitter
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.description = description
+        self.paused = False
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_started = None
+        self.last_seconds = None
+        self.last_error = None
+        self.next_run = None
+        self.task = None
+        self.wakeup = None
+
+    def until_daily(self, now: datetime.datetime) -> float:
+        """Секунды до ближайшего запуска по времени суток"""
+        hour, minute = self.daily_at
+        target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if target <= now:
+            target += datetime.timedelta(days=1)
+        return (target - now).total_seconds()
+
+    def next_delay(self, now: datetime.datetime) -> float:
+        if self.consecutive_failures:
+            # Повтор после ошибки: 30с, 60с, 120с... но не реже, чем по расписанию
+            delay = min(self.backoff * 2 ** (self.consecutive_failures - 1), self.backoff_max)
+            if self.interval is not None:
+                delay = min(delay, self.interval)
+            else:
+                delay = min(delay, self.until_daily(now))
+        elif self.daily_at is not None:
+            delay = self.until_daily(now)
+        else:
+            delay = self.interval
+        return delay + random.uniform(0, self.jitter)
+
+    def schedule(self) -> str:
+        if self.daily_at is not None:
+            return f"ежедневно в {self.daily_at[0]:02}:{self.daily_at[1]:02}"
+        return f"каждые {self.interval:g}с"
+
+    def describe(self) -> str:
+        if self.running:
+            state = "▶️ выполняется"
+        elif self.paused:
+            state = "⏸️ на паузе"
+        else:
+            state = "⏳ ожидает"
+        title = f"{self.description}, {self.schedule()}" if self.description else self.schedule()
+        parts = [f"**{self.name}** ({title}) - {state}, запусков {self.runs}, ошибок {self.failures}"]
+        if self.last_seconds is not None:
+            parts.append(f"последний {datetime.datetime.fromtimestamp(self.last_started).strftime('%d.%m %H:%M:%S')} за {self.last_seconds:.2f}с")
+        if self.next_run is not None and not self.running and not self.paused:
+            parts.append(f"следующий через {max(self.next_run - time.time(), 0):.0f}с")
+        if self.last_error:
+            parts.append(f"ошибка: {self.last_error}")
+        return ', '.join(parts)
+
+class Scheduler:
+    """Именованные периодические задачи.
+
+    У каждой задачи ровно один цикл: повторный start() (например, из on_ready после
+    переподключения) не создает новых, а запуск, пока предыдущий не закончился, пропускается.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+
+    def add(self, name: str, func, **options) -> Job:
+        job = self.jobs[name] = Job(name, func, **options)
+        return job
+
+    def start(self) -> int:
+        started = 0
+        for job in self.jobs.values():
+            if job.task is not None and not job.task.done():
+                continue
+            job.wakeup = asyncio.Event()
+            job.task = asyncio.get_running_loop().create_task(self._loop(job))
+            started += 1
+        if started:
+            log(f"Планировщик: запущено задач {started} из {len(self.jobs)}")
+        return started
+
+    async def _loop(self, job: Job):
+        while True:
+            delay = job.next_delay(datetime.datetime.now())
+            job.next_run = time.time() + delay
+            try:
+                await asyncio.wait_for(job.wakeup.wait(), timeout=delay)
+                triggered = True
+            except asyncio.TimeoutError:
+                triggered = False
+            job.wakeup.clear()
+            if job.paused and not triggered:
+                continue
+            await self.run(job)
+
+    async def run(self, job: Job) -> bool:
+        """Выполняет задачу один раз; False, если она уже выполняется"""
+        if job.running:
+            return False
+        job.running = True
+        job.last_started = time.time()
+        started = time.perf_counter()
+        try:
+            await job.func()
+            job.consecutive_failures = 0
+            job.last_error = None
+        except Exception as e:
+            job.failures += 1
+            job.consecutive_failures += 1
+            job.last_error = str(e)
+            job_failures.inc(job=job.name)
+            log(
+                f"\033[31mОшибка задачи {job.name} (подряд: {job.consecutive_failures}): {str(e)}\033[0m",
+                level='error', job=job.name
+            )
+        finally:
+            job.running = False
+            job.runs += 1
+            job.last_seconds = time.perf_counter() - started
+            job_seconds.observe(job.last_seconds, job=job.name)
+        return True
+
+    def get(self, name: str) -> Job:
+        job = self.jobs.get(name)
+        if job is None:
+            raise KeyError(f"Нет задачи {name}. Доступны: {', '.join(self.jobs)}")
+        return job
+
+    def trigger(self, name: str) -> bool:
+        """Запускает задачу вне расписания (даже на паузе); False, если она уже выполняется"""
+        job = self.get(name)
+        if job.running:
+            return False
+        if job.wakeup is None:
+            raise RuntimeError("Планировщик еще не запущен")
+        job.wakeup.set()
+        return True
+
+    def pause(self, name: str):
+        self.get(name).paused = True
+
+    def resume(self, name: str):
+        self.get(name).paused = False
+
+    def describe(self) -> list:
+        return [job.describe() for job in self.jobs.values()]
+
+    async def stop(self):
+        tasks = [job.task for job in self.jobs.values() if job.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for job in self.jobs.values():
+            job.task = None
@@ -0,0 +1,205 @@
+import re
+import math
+import heapq
+import threading
+from array import array
+from bisect import bisect_left
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def normalize(text: str) -> str:
+    """Регистр и 'ё' не различаются: 'Ёлка' и 'елка' - одно слово"""
+    return text.lower().replace('ё', 'е')
+
+def tokenize(text: str) -> list:
+    """Слова из букв (кириллица, латиница) и цифр; однобуквенные предлоги и союзы пропускаются"""
+    return [token for token in TOKEN_RE.findall(normalize(text)) if len(token) > 1 or token.isdigit()]
+
+def parse_terms(query: str) -> list:
+    """Слова запроса; 'наруш*' ищет все слова с этим началом"""
+    terms = []
+    for word in query.split():
+        tokens = tokenize(word)
+        terms.extend((token, False) for token in tokens)
+        if tokens and word.endswith('*'):
+            terms[-1] = (tokens[-1], True)
+    return terms
+
+def snippet(text: str, terms: list, width: int = 160) -> str:
+    """Фрагмент доклада вокруг первого совпадения, найденное слово выделено жирным"""
+    flat = ' '.join(text.split())
+    lowered = normalize(flat)
+    match = None
+    for token, _ in terms:
+        for found in re.finditer(r'(?<![^\W_])' + re.escape(token), lowered):
+            if match is None or found.start() < match[0]:
+                match = (found.start(), TOKEN_RE.match(lowered, found.start()).end())
+            break
+    if match is None:
+        return flat[:width] + ('…' if len(flat) > width else '')
+    start = max(0, match[0] - width // 3)
+    end = min(len(flat), start + width)
+    return (
+        ('…' if start > 0 else '') + flat[start:match[0]] +
+        f"**{flat[match[0]:match[1]]}**" + flat[match[1]:end] + ('…' if end < len(flat) else '')
+    )
+
+class ReportIndex:
+    """Инвертированный индекс докладов: слово -> номера докладов и число вхождений.
+
+    Строится один раз из хранилища (load() вне event loop) и дальше дополняется
+    каждым send_report через add(). Доклады, пришедшие во время построения,
+    откладываются и досыпаются в finish(), дубли с уже прочитанными отбрасываются.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self._backlog = None
+        self._reset()
+
+    def _reset(self):
+        self.docs = []
+        self.lengths = array('I')
+        self.postings = {}
+        self.by_user = {}
+        self.total_length = 0
+        self._vocabulary = None
+
+    def clear(self):
+        """Сбрасывает индекс; он будет построен заново при следующем поиске"""
+        with self.lock:
+            self._reset()
+            self.loaded = False
+            self._backlog = None
+
+    def begin(self):
+        self._backlog = []
+
+    def load(self, documents) -> int:
+        """documents - (user_id, метка времени, текст) по порядку; выполняется вне event loop"""
+        with self.lock:
+            self._reset()
+            for user_id, ts, text in documents:
+                self._add(int(user_id), ts, text)
+            return len(self.docs)
+
+    def finish(self):
+        backlog, self._backlog = self._backlog, None
+        with self.lock:
+            if backlog is None:
+                # clear() во время построения: прочитанное уже устарело
+                self._reset()
+                return
+            for user_id, ts, text in backlog:
+                if (user_id, ts, text) not in (self.docs[doc_id] for doc_id in self.by_user.get(user_id, ())):
+                    self._add(user_id, ts, text)
+            self.loaded = True
+
+    def add(self, user_id: int, ts: float, text: str):
+        if self._backlog is not None:
+            self._backlog.append((int(user_id), ts, text))
+        elif self.loaded:
+            with self.lock:
+                self._add(int(user_id), ts, text)
+
+    def _add(self, user_id: int, ts: float, text: str):
+        doc_id = len(self.docs)
+        self.docs.append((user_id, ts, text))
+        tokens = tokenize(text)
+        self.lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = (array('I'), array('I'))
+                self._vocabulary = None
+            posting[0].append(doc_id)
+            posting[1].append(count)
+        self.by_user.setdefault(user_id, array('I')).append(doc_id)
+
+    def _expand(self, token: str, prefix: bool) -> list:
+        if not prefix:
+            return [token] if token in self.postings else []
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        words = []
+        for i in range(bisect_left(self._vocabulary, token), len(self._vocabulary)):
+            if not self._vocabulary[i].startswith(token):
+                break
+            words.append(self._vocabulary[i])
+        return words
+
+    def search(self, query: str, user_id: int = None, start: float = None, end: float = None,
+               offset: int = 0, limit: int = None):
+        """Доклады, содержащие все слова запроса, по убыванию BM25, при равенстве - новые выше.
+
+        Возвращает ([(оценка, user_id, метка времени, текст)], всего найдено).
+        """
+        terms = parse_terms(query)
+        if not terms:
+            return [], 0
+        with self.lock:
+            user_docs = self.by_user.get(int(user_id), ()) if user_id is not None else None
+            matches = []
+            for token, prefix in terms:
+                # Для слова с '*' вхождения всех подходящих слов складываются
+                frequencies = {}
+                df = 0
+                for word in self._expand(token, prefix):
+                    ids, counts = self.postings[word]
+                    df += len(ids)
+                    if user_docs is not None and len(user_docs) < len(ids):
+                        # Доклады одного модератора ищутся в списке слова двоичным поиском
+                        for doc_id in user_docs:
+                            i = bisect_left(ids, doc_id)
+                            if i < len(ids) and ids[i] == doc_id:
+                                frequencies[doc_id] = frequencies.get(doc_id, 0) + counts[i]
+                    else:
+                        for doc_id, count in zip(ids, counts):
+                            frequencies[doc_id] = frequencies.get(doc_id, 0) + count
+                if not frequencies:
+                    return [], 0
+                matches.append((frequencies, df))
+            matches.sort(key=lambda match: len(match[0]))
+            candidates = set(matches[0][0])
+            if user_docs is not None:
+                candidates.intersection_update(user_docs)
+            for frequencies, _ in matches[1:]:
+                candidates.intersection_update(frequencies)
+            if start is not None or end is not None:
+                candidates = {
+                    doc_id for doc_id in candidates
+                    if self.docs[doc_id][1] is not None
+                    and (start is None or self.docs[doc_id][1] >= start)
+                    and (end is None or self.docs[doc_id][1] <= end)
+                }
+            count = len(self.docs)
+            # df считается по всем докладам, а не по выборке модератора; для слова с '*' - с запасом
+            weights = [
+                (frequencies, math.log(1 + (count - min(df, count) + 0.5) / (min(df, count) + 0.5)))
+                for frequencies, df in matches
+            ]
+            average = self.total_length / count if count else 0
+            scored = []
+            for doc_id in candidates:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc_id] / average) if average else BM25_K1
+                score = 0.0
+                for frequencies, idf in weights:
+                    tf = frequencies[doc_id]
+                    score += idf * tf * (BM25_K1 + 1) / (tf + norm)
+                scored.append((score, self.docs[doc_id][1] or 0.0, doc_id))
+            if limit is None:
+                page = sorted(scored, reverse=True)[offset:]
+            else:
+                # Сортировать все совпадения не нужно: достаточно лучших до конца страницы
+                page = heapq.nlargest(offset + limit, scored)[offset:]
+            return [(score, *self.docs[doc_id]) for score, _, doc_id in page], len(scored)
+
+    def stats(self) -> dict:
+        return {'documents': len(self.docs), 'words': len(self.postings)}
@@ -0,0 +1,339 @@
+import io
+import os
+import gzip
+import json
+import datetime
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from logindex import SCANNERS, OffsetIndex
+from contacts import merge_contacts
+from rollups import RollupStore, parse_reports, parse_voice_line, read_coefficient
+
+SEGMENTS_FOLDER = 'segments'
+SEGMENT_SUFFIX = '.txt.gz'
+HEADER_PREFIX = b'#segment '
+DECODED_CACHE_SIZE = 8
+
+_decoded = OrderedDict()
+_decoded_lock = threading.Lock()
+
+def month_key(ts: float) -> str:
+    return datetime.datetime.fromtimestamp(ts).strftime('%Y-%m')
+
+def month_start(now: datetime.datetime = None) -> float:
+    now = now or datetime.datetime.now()
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+def segment_dir(path: str) -> str:
+    """voice_logs/123_voice_logs.txt -> voice_logs/segments/123_voice_logs/"""
+    name = os.path.basename(path)
+    return os.path.join(os.path.dirname(path), SEGMENTS_FOLDER, name[:-len('.txt')])
+
+def list_segments(directory: str) -> list:
+    """[(месяц, путь)] закрытых сегментов по возрастанию месяца"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        (name[:-len(SEGMENT_SUFFIX)], os.path.join(directory, name))
+        for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)
+    )
+
+def _normalize(raw: list, floor: float = 0.0) -> list:
+    # Как в OffsetIndex: ключи не убывают, записи без даты наследуют предыдущую
+    keys = []
+    last_ts = floor
+    for ts in raw:
+        last_ts = max(last_ts, ts or last_ts)
+        keys.append(last_ts)
+    return keys
+
+def split_entries(data: bytes, kind: str, floor: float = 0.0):
+    """Байты лога -> (ключи времени, записи в байтах, неразобранный хвост)"""
+    entries, end = SCANNERS[kind](io.BytesIO(data), 0)
+    offsets = [offset for _, offset in entries] + [end]
+    items = [data[offsets[i]:offsets[i + 1]] for i in range(len(entries))]
+    return _normalize([ts for ts, _ in entries], floor), items, data[end:]
+
+def summarize(kind: str, keys: list, items: list) -> dict:
+    """Заголовок сегмента: число записей, границы по времени и итоги для пересчета без распаковки"""
+    header = {
+        'kind': kind,
+        'entries': len(items),
+        'first_ts': keys[0] if keys else None,
+        'last_ts': keys[-1] if keys else None
+    }
+    if kind == 'voice':
+        sessions = total = 0
+        first_start = last_end = None
+        contacts = {}
+        for item in items:
+            try:
+                parsed = parse_voice_line(item.decode('utf-8', errors='replace'))
+            except ValueError:
+                continue
+            if not parsed:
+                continue
+            start, seconds, _, session_contacts = parsed
+            merge_contacts(contacts, session_contacts)
+            sessions += 1
+            total += seconds
+            if start is not None:
+                start_ts = start.timestamp()
+                first_start = start_ts if first_start is None else min(first_start, start_ts)
+                last_end = start_ts + seconds if last_end is None else max(last_end, start_ts + seconds)
+        header.update(sessions=sessions, total_seconds=total, first_start=first_start, last_end=last_end, contacts=contacts)
+    return header
+
+def write_segment(path: str, kind: str, keys: list, items: list) -> dict:
+    header = summarize(kind, keys, items)
+    header['month'] = os.path.basename(path)[:-len(SEGMENT_SUFFIX)]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, 'wb') as f:
+        f.write(HEADER_PREFIX + json.dumps(header).encode() + b'\n')
+        f.writelines(items)
+    os.replace(tmp_path, path)
+    return header
+
+def read_header(path: str) -> dict:
+    """Заголовок сегмента; читается только первая строка, остальное не распаковывается"""
+    with gzip.open(path, 'rb') as f:
+        line = f.readline()
+    if line.startswith(HEADER_PREFIX):
+        return json.loads(line[len(HEADER_PREFIX):])
+    return None
+
+def _read_segment(path: str):
+    with gzip.open(path, 'rb') as f:
+        line = f.readline()
+        if line.startswith(HEADER_PREFIX):
+            return json.loads(line[len(HEADER_PREFIX):]), f.read()
+        return None, line + f.read()
+
+def load_segment(path: str, kind: str):
+    """(ключи времени, записи) сегмента; последние распакованные сегменты держатся в памяти"""
+    stat = os.stat(path)
+    cache_key = (path, stat.st_mtime_ns, stat.st_size)
+    with _decoded_lock:
+        cached = _decoded.get(cache_key)
+        if cached is not None:
+            _decoded.move_to_end(cache_key)
+            return cached
+    header, body = _read_segment(path)
+    keys, items, rest = split_entries(body, kind, (header or {}).get('first_ts') or 0.0)
+    if rest:
+        items.append(rest)
+        keys.append(keys[-1] if keys else 0.0)
+    with _decoded_lock:
+        _decoded[cache_key] = (keys, items)
+        while len(_decoded) > DECODED_CACHE_SIZE:
+            _decoded.popitem(last=False)
+    return keys, items
+
+def _decode(items) -> list:
+    return [item.decode('utf-8', errors='replace') for item in items]
+
+def iter_log_lines(path: str, start: float = None):
+    """Строки лога по порядку: закрытые сегменты, затем текущий файл.
+
+    С start сегменты, целиком закончившиеся раньше, пропускаются по заголовку без распаковки
+    (ключи в заголовке не меньше настоящих дат записей); остальное фильтрует вызывающий.
+    """
+    for _, segment_path in list_segments(segment_dir(path)):
+        if start is not None:
+            last_ts = (read_header(segment_path) or {}).get('last_ts')
+            if last_ts is not None and last_ts < start:
+                continue
+        with gzip.open(segment_path, 'rt', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                if not line.startswith(HEADER_PREFIX.decode()):
+                    yield line
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from f
+
+def has_log(path: str) -> bool:
+    return os.path.exists(path) or bool(list_segments(segment_dir(path)))
+
+class SegmentedLog:
+    """Лог модератора по месяцам: текущий файл с индексом смещений и сжатые закрытые месяцы.
+
+    Запросы идут по сегментам по порядку; сегменты вне диапазона дат отсекаются по заголовку,
+    а целиком попавшие в диапазон учитываются в итоге без распаковки.
+    """
+
+    def __init__(self, path: str, kind: str):
+        self.path = path
+        self.kind = kind
+        self.directory = segment_dir(path)
+        self.active = OffsetIndex(path, kind)
+        self.lock = threading.Lock()
+        self._segments = None
+
+    def segments(self) -> list:
+        if self._segments is None:
+            self._segments = [
+                (month, path, read_header(path) or summarize(self.kind, *load_segment(path, self.kind)))
+                for month, path in list_segments(self.directory)
+            ]
+        return self._segments
+
+    def query(self, start: float = None, end: float = None, offset: int = 0, limit: int = None):
+        """Записи в диапазоне [start, end] по всем сегментам; возвращает (записи, всего)"""
+        with self.lock:
+            entries = []
+            total = 0
+            for _, path, header in self.segments():
+                first, last = header['first_ts'], header['last_ts']
+                if not header['entries'] or (start is not None and last < start) or (end is not None and first > end):
+                    continue
+                if (start is None or first >= start) and (end is None or last <= end):
+                    lo, hi = 0, header['entries']
+                    items = None
+                else:
+                    keys, items = load_segment(path, self.kind)
+                    lo = bisect_left(keys, start) if start is not None else 0
+                    hi = bisect_right(keys, end) if end is not None else len(keys)
+                skip = max(offset - total, 0)
+                wanted = None if limit is None else limit - len(entries)
+                if skip < hi - lo and (wanted is None or wanted > 0):
+                    if items is None:
+                        _, items = load_segment(path, self.kind)
+                    first_item = lo + skip
+                    entries.extend(_decode(items[first_item:hi if wanted is None else min(hi, first_item + wanted)]))
+                total += max(hi - lo, 0)
+            active_entries, active_total = self.active.query(
+                start, end, max(offset - total, 0), None if limit is None else limit - len(entries)
+            )
+            return entries + active_entries, total + active_total
+
+    def tail(self, count: int) -> list:
+        with self.lock:
+            entries = self.active.tail(count)
+            for _, path, _ in reversed(self.segments()):
+                missing = count - len(entries)
+                if missing <= 0:
+                    break
+                _, items = load_segment(path, self.kind)
+                entries = _decode(items[-missing:]) + entries
+            return entries
+
+    def text(self) -> str:
+        with self.lock:
+            return ''.join(iter_log_lines(self.path))
+
+    def compact(self, before: float) -> int:
+        """Переносит записи старше before из текущего файла в сжатые сегменты своих месяцев.
+
+        Вызывать, пока фоновая запись в этот файл приостановлена (FileWriter.exclusive).
+        """
+        with self.lock, self.active.lock:
+            # Индекс отвечает без чтения файла, нужен ли перенос
+            self.active.refresh()
+            if bisect_left(self.active.timestamps, before) == 0:
+                return 0
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            keys, items, rest = split_entries(data, self.kind)
+            cut = bisect_left(keys, before)
+            months = OrderedDict()
+            for key, item in zip(keys[:cut], items[:cut]):
+                month = months.setdefault(month_key(key), ([], []))
+                month[0].append(key)
+                month[1].append(item)
+            for month, (month_keys, month_items) in months.items():
+                path = os.path.join(self.directory, f"{month}{SEGMENT_SUFFIX}")
+                if os.path.exists(path):
+                    # Запоздавшие записи дописываются к уже закрытому месяцу
+                    old_keys, old_items = load_segment(path, self.kind)
+                    merged = sorted(zip(old_keys + month_keys, old_items + month_items), key=lambda pair: pair[0])
+                    month_keys, month_items = [key for key, _ in merged], [item for _, item in merged]
+                write_segment(path, self.kind, month_keys, month_items)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(b''.join(items[cut:]) + rest)
+            os.replace(tmp_path, self.path)
+            self.active._reset()
+            self._segments = None
+            return cut
+
+class SegmentCache:
+    def __init__(self):
+        self._logs = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str, kind: str) -> SegmentedLog:
+        with self._lock:
+            segmented = self._logs.get(path)
+            if segmented is None:
+                segmented = self._logs[path] = SegmentedLog(path, kind)
+            return segmented
+
+    def clear(self):
+        with self._lock:
+            self._logs.clear()
+
+def log_files(directory: str, suffix: str) -> list:
+    """[(user_id, путь текущего файла)] для всех модераторов, у которых есть файл или сегменты"""
+    names = set()
+    if os.path.isdir(directory):
+        names.update(name for name in os.listdir(directory) if name.endswith(suffix))
+    segments_root = os.path.join(directory, SEGMENTS_FOLDER)
+    if os.path.isdir(segments_root):
+        names.update(f"{name}.txt" for name in os.listdir(segments_root) if f"{name}.txt".endswith(suffix))
+    return [(name.split('_')[0], os.path.join(directory, name)) for name in sorted(names)]
+
+def build_rollups(base_dir: str, recent_limit: int = 100) -> dict:
+    """Полностью пересчитывает итоги (выполнять вне event loop); закрытые месяцы берутся из заголовков"""
+    store = RollupStore(None, recent_limit)
+
+    for user_id, path in log_files(os.path.join(base_dir, 'voice_logs'), '_voice_logs.txt'):
+        for _, segment_path in list_segments(segment_dir(path)):
+            header = read_header(segment_path)
+            if header is None:
+                header = summarize('voice', *load_segment(segment_path, 'voice'))
+            store.record_totals(
+                user_id, header['sessions'], header['total_seconds'], header['first_start'], header['last_end'],
+                header.get('contacts')
+            )
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    parsed = parse_voice_line(line)
+                except ValueError:
+                    continue
+                if parsed:
+                    start, seconds, _, contacts = parsed
+                    store.record_session(user_id, start, seconds, contacts)
+
+    for user_id, path in log_files(os.path.join(base_dir, 'reports'), '_report.txt'):
+        recent = []
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                recent = parse_reports(f)
+        older = 0
+        # Распаковываются только последние месяцы, пока не наберется recent_limit докладов
+        for _, segment_path in reversed(list_segments(segment_dir(path))):
+            header = read_header(segment_path)
+            if len(recent) >= recent_limit and header is not None:
+                older += header['entries']
+                continue
+            _, items = load_segment(segment_path, 'report')
+            recent = parse_reports(b''.join(items).decode('utf-8', errors='replace').splitlines()) + recent
+        for report in recent:
+            store.record_report(user_id, report.get('date', 'N/A'), report.get('text') or '')
+        if older:
+            store.get(user_id)['report_count'] += older
+
+    moderator_info_dir = os.path.join(base_dir, 'moderator_info')
+    for filename in os.listdir(moderator_info_dir):
+        if not filename.endswith('_info.txt'):
+            continue
+        K = read_coefficient(os.path.join(moderator_info_dir, filename))
+        if K is not None:
+            store.set_coefficient(filename.split('_')[0], K)
+
+    return store.moderators
@@ -0,0 +1,160 @@
+import time
+import asyncio
+
+_MISSING = object()
+
+class Session:
+    """Открытая сессия модератора.
+
+    start - время начала по системным часам, оно пишется в лог и журнал. Длительность
+    считается по time.monotonic(): перевод системных часов не меняет учтенное время.
+    Моменты закрытия передаются как значения time.monotonic().
+    """
+
+    __slots__ = ('guild_id', 'channel', 'start', 'mono', 'idle', 'contacts')
+
+    def __init__(self, guild_id: int, channel: int, contacts, start: float = None, idle: float = 0.0):
+        now = time.time()
+        self.guild_id = guild_id
+        self.channel = channel
+        self.start = now if start is None else start
+        # Для сессии из журнала начало по монотонным часам отсчитывается от текущего момента
+        self.mono = time.monotonic() - (now - self.start)
+        self.idle = idle
+        self.contacts = contacts
+
+    def at(self, ts: float) -> float:
+        """Время по системным часам -> значение time.monotonic()"""
+        return self.mono + (ts - self.start)
+
+    def wall(self, mono: float) -> float:
+        """Значение time.monotonic() -> время по системным часам"""
+        return self.start + (mono - self.mono)
+
+    def duration(self, end: float) -> float:
+        """Секунды в канале до end без перерывов между склеенными частями"""
+        return max(end - self.mono - self.idle, 0.0)
+
+class SessionRegistry:
+    """Открытые сессии модераторов, разбитые по серверам.
+
+    Снаружи ведет себя как словарь user_id -> сессия, а in_guild() отдает
+    сессии одного сервера, чтобы проход по серверу не перебирал все остальные.
+    """
+
+    def __init__(self):
+        self.guilds = {}
+        self._owners = {}
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._owners
+
+    def __getitem__(self, user_id) -> Session:
+        return self.guilds[self._owners[user_id]][user_id]
+
+    def __setitem__(self, user_id, session: Session):
+        self.pop(user_id, None)
+        guild_id = session.guild_id
+        sessions = self.guilds.get(guild_id)
+        if sessions is None:
+            sessions = self.guilds[guild_id] = {}
+        sessions[user_id] = session
+        self._owners[user_id] = guild_id
+
+    def get(self, user_id, default=None):
+        guild_id = self._owners.get(user_id)
+        return default if guild_id is None else self.guilds[guild_id][user_id]
+
+    def pop(self, user_id, default=_MISSING):
+        guild_id = self._owners.pop(user_id, None)
+        if guild_id is None:
+            if default is _MISSING:
+                raise KeyError(user_id)
+            return default
+        sessions = self.guilds[guild_id]
+        session = sessions.pop(user_id)
+        if not sessions:
+            del self.guilds[guild_id]
+        return session
+
+    def in_guild(self, guild_id) -> dict:
+        return self.guilds.get(guild_id, {})
+
+    def __len__(self) -> int:
+        return len(self._owners)
+
+    def __iter__(self):
+        return iter(list(self._owners))
+
+    def keys(self):
+        return list(self._owners)
+
+    def items(self):
+        return [(user_id, session) for sessions in self.guilds.values() for user_id, session in sessions.items()]
+
+    def values(self):
+        return [session for sessions in self.guilds.values() for session in sessions.values()]
+
+    def clear(self):
+        self.guilds.clear()
+        self._owners.clear()
+
+class ClosingSessions:
+    """Закрывающиеся сессии, которые ждут окончания окна ожидания перед записью.
+
+    Если модератор вернулся в окно, сессия продолжается вместо новой строки в логе;
+    по истечении окна вызывается settle(user_id, session, end_time), end_time - по time.monotonic().
+    """
+
+    def __init__(self, grace: float, settle):
+        self.grace = grace
+        self.settle = settle
+        self.entries = {}
+        self.coalesced = 0
+
+    def hold(self, user_id, session: Session, end_time: float):
+        if self.grace <= 0:
+            self.settle(user_id, session, end_time)
+            return
+        self._cancel(user_id)
+        handle = asyncio.get_running_loop().call_later(self.grace, self._expire, user_id)
+        self.entries[user_id] = (session, end_time, handle)
+
+    def resume(self, user_id, guild_id):
+        """Забирает сессию того же сервера; возвращает (сессия, время закрытия) или None"""
+        entry = self.entries.get(user_id)
+        if entry is None or entry[0].guild_id != guild_id:
+            return None
+        del self.entries[user_id]
+        entry[2].cancel()
+        self.coalesced += 1
+        return entry[0], entry[1]
+
+    def _expire(self, user_id):
+        entry = self.entries.pop(user_id, None)
+        if entry is not None:
+            self.settle(user_id, entry[0], entry[1])
+
+    def _cancel(self, user_id):
+        entry = self.entries.pop(user_id, None)
+        if entry is not None:
+            entry[2].cancel()
+            self.settle(user_id, entry[0], entry[1])
+
+    def settle_all(self):
+        for user_id in list(self.entries):
+            self._cancel(user_id)
+
+    def clear(self):
+        for _, _, handle in self.entries.values():
+            handle.cancel()
+        self.entries.clear()
+
+    def items(self):
+        return [(user_id, session, end_time) for user_id, (session, end_time, _) in self.entries.items()]
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,851 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import asyncio
+import datetime
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from logger import log
+from contacts import format_contacts, parse_contacts
+from leaderboard import CoefficientIndex
+from search import ReportIndex
+from metrics import registry
+from rollups import (
+    DATE_FORMAT, REPORT_SEPARATOR, REPORT_TEXT_LIMIT, RollupStore,
+    empty_rollup, format_duration, iter_reports, parse_reports, parse_voice_line, read_moderator_info
+)
+from segments import SegmentCache, build_rollups, has_log, iter_log_lines, log_files, month_key, month_start
+
+sqlite_batch_seconds = registry.histogram('bot_sqlite_batch_seconds', 'Время пакетной вставки в SQLite')
+sqlite_rows_inserted = registry.counter('bot_sqlite_rows_inserted_total', 'Строк вставлено в SQLite')
+segment_entries_compacted = registry.counter('bot_log_entries_compacted_total', 'Записей перенесено в сжатые месячные сегменты')
+
+DATA_FOLDERS = ['voice_logs', 'reports', 'moderator_info']
+FOLDER_MAP = {
+    'voice': ('voice_logs', '_voice_logs.txt'),
+    'report': ('reports', '_report.txt'),
+    'info': ('moderator_info', '_info.txt')
+}
+
+def format_voice_line(user_id, channel_id, start: datetime.datetime, seconds: int, contacts: dict = None) -> str:
+    return (
+        f"Moderator: {user_id} | "
+        f"Channel: {channel_id} | "
+        f"Date: {start.strftime(DATE_FORMAT)} | "
+        f"Duration: {format_duration(seconds)}"
+        f"{f' | Contacts: {format_contacts(contacts)}' if contacts else ''}\n"
+    )
+
+def format_report(user_id, date_str: str, text: str) -> str:
+    return (
+        f"Moderator ID: {user_id}\n"
+        f"Date: {date_str}\n"
+        f"Report:\n{text}\n"
+        f"{REPORT_SEPARATOR}\n"
+    )
+
+def format_info(params: dict, K: float) -> str:
+    return f"Parameters: {params}\nCoefficient: {K:.4f}\n"
+
+class Storage:
+    """Общий интерфейс хранилища голосовых сессий, докладов и коэффициентов"""
+
+    name = 'base'
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def flush(self):
+        pass
+
+    def add_voice_session(self, user_id: int, channel_id: int, start: datetime.datetime, seconds: int,
+                          contacts: dict = None):
+        """contacts - {user_id: секунды}, сколько модератор провел с каждым пользователем"""
+        raise NotImplementedError
+
+    def add_report(self, user_id: int, date_str: str, text: str):
+        raise NotImplementedError
+
+    async def set_moderator_info(self, user_id: int, params: dict, K: float):
+        raise NotImplementedError
+
+    async def voice_log_text(self, user_id: int) -> str:
+        raise NotImplementedError
+
+    async def reports_text(self, user_id: int) -> str:
+        raise NotImplementedError
+
+    async def voice_log_entries(self, user_id: int, start: float = None, end: float = None,
+                                offset: int = 0, limit: int = None):
+        """Записи голосового лога за период [start, end] постранично: (записи, всего в периоде)"""
+        raise NotImplementedError
+
+    async def voice_log_tail(self, user_id: int, count: int) -> list:
+        raise NotImplementedError
+
+    async def report_entries(self, user_id: int, start: float = None, end: float = None,
+                             offset: int = 0, limit: int = None):
+        raise NotImplementedError
+
+    async def report_tail(self, user_id: int, count: int) -> list:
+        raise NotImplementedError
+
+    async def leaderboard(self) -> CoefficientIndex:
+        """Актуальный индекс коэффициентов, упорядоченный по K"""
+        raise NotImplementedError
+
+    async def moderator_params(self) -> dict:
+        """Параметры формулы всех модераторов: user_id (строкой) -> {'B': ..., ..., 'Q': ...}"""
+        raise NotImplementedError
+
+    async def summaries(self) -> dict:
+        """Итоги по модераторам в формате rollups.empty_rollup()"""
+        raise NotImplementedError
+
+    _report_index_task = None
+
+    async def search_reports(self, query: str, user_id: int = None, start: float = None, end: float = None,
+                             offset: int = 0, limit: int = None):
+        """Поиск по тексту докладов: ([(оценка, user_id, метка времени, текст)], всего найдено).
+
+        Индекс строится при первом поиске и дальше пополняется каждым add_report.
+        """
+        if not self.report_index.loaded:
+            if self._report_index_task is None or self._report_index_task.done():
+                self._report_index_task = asyncio.get_running_loop().create_task(self.rebuild_report_index())
+            await self._report_index_task
+        return self.report_index.search(query, user_id, start, end, offset, limit)
+
+    async def rebuild_report_index(self) -> int:
+        """Перестраивает поисковый индекс по всем докладам хранилища"""
+        started = time.perf_counter()
+        self.report_index.begin()
+        try:
+            await self.flush()
+            count = await self._load_report_index()
+        finally:
+            self.report_index.finish()
+        log(f"Поисковый индекс докладов построен: {count} докладов, {self.report_index.stats()['words']} слов за {time.perf_counter() - started:.2f}с")
+        return count
+
+    async def _load_report_index(self) -> int:
+        raise NotImplementedError
+
+    def iter_records(self, kind: str, user_id: int = None, start: float = None, end: float = None):
+        """Записи для выгрузки по одной, без чтения всей истории в память; выполняется вне event loop.
+
+        kind 'voice' -> (user_id, channel_id, начало, секунды, контакты),
+        'report' -> (user_id, метка времени, текст), 'info' -> (user_id, коэффициент, параметры).
+        """
+        raise NotImplementedError
+
+    async def rebuild(self) -> int:
+        return 0
+
+    async def compact(self, force: bool = False) -> int:
+        """Переносит записи прошлых месяцев в сжатые сегменты; возвращает число перенесенных записей"""
+        return 0
+
+    async def reset(self, archive_dir: str = None):
+        """Удаляет все данные; с archive_dir - переносит их туда вместо удаления"""
+        raise NotImplementedError
+
+class FileStorage(Storage):
+    """Текстовые файлы в voice_logs/, reports/, moderator_info/ и итоги в rollups.json.
+
+    Логи текущего месяца дописываются в обычный файл, прошлые месяцы сжимаются
+    в voice_logs/segments/ и reports/segments/ (см. segments.py).
+    """
+
+    name = 'files'
+
+    def __init__(self, base_dir: str, writer, recent_limit: int = 100):
+        self.base_dir = base_dir
+        self.writer = writer
+        self.recent_limit = recent_limit
+        self.rollups = RollupStore(os.path.join(base_dir, 'rollups.json'), recent_limit=recent_limit)
+        self.logs = SegmentCache()
+        self.coefficient_index = CoefficientIndex()
+        self.report_index = ReportIndex()
+        self._compacted_month = None
+
+    def path(self, user_id, kind: str) -> str:
+        folder, suffix = FOLDER_MAP[kind]
+        return os.path.join(self.base_dir, folder, f"{user_id}{suffix}")
+
+    def persist_rollups(self):
+        self.writer.replace(self.rollups.path, self.rollups.dump)
+
+    async def start(self):
+        if self.rollups.loaded:
+            return
+        try:
+            if not self.rollups.load():
+                await self.rebuild()
+        except Exception as e:
+            log(f"\033[31mОшибка загрузки итогов: {str(e)}\033[0m", level='error')
+
+    async def flush(self):
+        await self.writer.flush()
+
+    def _active_logs(self) -> list:
+        paths = []
+        for kind in ('voice', 'report'):
+            folder, suffix = FOLDER_MAP[kind]
+            directory = os.path.join(self.base_dir, folder)
+            if os.path.isdir(directory):
+                paths.extend((os.path.join(directory, name), kind) for name in os.listdir(directory) if name.endswith(suffix))
+        return paths
+
+    async def compact(self, force=False):
+        # Работа есть только при смене месяца, остальные вызовы ничего не читают
+        if not force and month_key(time.time()) == self._compacted_month:
+            return 0
+        before = month_start()
+        started = time.perf_counter()
+        moved = files = 0
+        for path, kind in await asyncio.get_running_loop().run_in_executor(None, self._active_logs):
+            # Фоновая запись приостанавливается на время одного файла, а не всего прохода
+            count = await self.writer.exclusive(self.logs.get(path, kind).compact, before)
+            if count:
+                moved += count
+                files += 1
+        self._compacted_month = month_key(before)
+        if moved:
+            segment_entries_compacted.inc(moved)
+            log(f"Логи прошлых месяцев сжаты: {moved} записей из {files} файлов за {time.perf_counter() - started:.1f}с")
+        return moved
+
+    def add_voice_session(self, user_id, channel_id, start, seconds, contacts=None):
+        self.writer.append(self.path(user_id, 'voice'), format_voice_line(user_id, channel_id, start, seconds, contacts))
+        self.rollups.record_session(user_id, start, seconds, contacts)
+        self.persist_rollups()
+
+    def add_report(self, user_id, date_str, text):
+        self.writer.append(self.path(user_id, 'report'), format_report(user_id, date_str, text))
+        self.report_index.add(user_id, parse_date(date_str) or time.time(), text)
+        self.rollups.record_report(user_id, date_str, text)
+        self.persist_rollups()
+
+    async def set_moderator_info(self, user_id, params, K):
+        content = format_info(params, K)
+        self.writer.replace(self.path(user_id, 'info'), lambda: content)
+        self.rollups.set_coefficient(user_id, round(K, 4))
+        self.coefficient_index.set(user_id, round(K, 4))
+        self.persist_rollups()
+
+    async def voice_log_text(self, user_id):
+        return await self._indexed(user_id, 'voice', 'text')
+
+    async def reports_text(self, user_id):
+        return await self._indexed(user_id, 'report', 'text')
+
+    async def _indexed(self, user_id, kind: str, method: str, *args):
+        path = self.path(user_id, kind)
+        await self.writer.flush(path)
+        if not has_log(path):
+            return {'query': ([], 0), 'tail': [], 'text': ''}[method]
+        segmented = self.logs.get(path, kind)
+        return await asyncio.get_running_loop().run_in_executor(None, getattr(segmented, method), *args)
+
+    async def voice_log_entries(self, user_id, start=None, end=None, offset=0, limit=None):
+        return await self._indexed(user_id, 'voice', 'query', start, end, offset, limit)
+
+    async def voice_log_tail(self, user_id, count):
+        return await self._indexed(user_id, 'voice', 'tail', count)
+
+    async def report_entries(self, user_id, start=None, end=None, offset=0, limit=None):
+        return await self._indexed(user_id, 'report', 'query', start, end, offset, limit)
+
+    async def report_tail(self, user_id, count):
+        return await self._indexed(user_id, 'report', 'tail', count)
+
+    async def leaderboard(self):
+        # Отложенная запись не меняет mtime, поэтому значение из set_moderator_info не перетирается старым файлом
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.coefficient_index.refresh_files, os.path.join(self.base_dir, 'moderator_info')
+        )
+        return self.coefficient_index
+
+    async def moderator_params(self):
+        await self.writer.flush()
+        return await asyncio.get_running_loop().run_in_executor(None, self._scan_params)
+
+    def _scan_params(self) -> dict:
+        params = {}
+        info_dir = os.path.join(self.base_dir, 'moderator_info')
+        if not os.path.isdir(info_dir):
+            return params
+        for filename in os.listdir(info_dir):
+            if filename.endswith('_info.txt'):
+                values, _ = read_moderator_info(os.path.join(info_dir, filename))
+                if values:
+                    params[filename.split('_')[0]] = values
+        return params
+
+    async def summaries(self):
+        return self.rollups.moderators
+
+    def _report_documents(self):
+        folder, suffix = FOLDER_MAP['report']
+        for user_id, path in log_files(os.path.join(self.base_dir, folder), suffix):
+            for report in parse_reports(iter_log_lines(path)):
+                yield int(user_id), parse_date(report.get('date')), report.get('text') or ''
+
+    async def _load_report_index(self):
+        return await asyncio.get_running_loop().run_in_executor(None, self.report_index.load, self._report_documents())
+
+    def _record_files(self, kind: str, user_id) -> list:
+        if user_id is not None:
+            path = self.path(user_id, kind)
+            return [(str(user_id), path)] if has_log(path) or os.path.exists(path) else []
+        folder, suffix = FOLDER_MAP[kind]
+        return log_files(os.path.join(self.base_dir, folder), suffix)
+
+    def iter_records(self, kind, user_id=None, start=None, end=None):
+        for moderator_id, path in self._record_files(kind, user_id):
+            if kind == 'info':
+                params, K = read_moderator_info(path)
+                yield int(moderator_id), K, params
+            elif kind == 'voice':
+                for line in iter_log_lines(path, start):
+                    try:
+                        parsed = parse_voice_line(line)
+                    except ValueError:
+                        continue
+                    if not parsed:
+                        continue
+                    session_start, seconds, channel_id, contacts = parsed
+                    ts = session_start.timestamp() if session_start else None
+                    if in_period(ts, start, end):
+                        yield int(moderator_id), channel_id, ts, seconds, contacts
+            else:
+                for report in iter_reports(iter_log_lines(path, start)):
+                    ts = parse_date(report.get('date'))
+                    if in_period(ts, start, end):
+                        yield int(moderator_id), ts, report.get('text') or ''
+
+    async def rebuild(self):
+        await self.writer.flush()
+        moderators = await asyncio.get_running_loop().run_in_executor(
+            None, build_rollups, self.base_dir, self.recent_limit
+        )
+        self.rollups.replace_all(moderators)
+        self.persist_rollups()
+        # Файлы могли поправить вручную: поисковый индекс перечитается при следующем поиске
+        self.report_index.clear()
+        log(f"Итоги пересчитаны по исходным файлам: {len(moderators)} модераторов")
+        return len(moderators)
+
+    async def reset(self, archive_dir=None):
+        await self.writer.flush()
+        for folder in DATA_FOLDERS:
+            path = os.path.join(self.base_dir, folder)
+            if archive_dir:
+                os.makedirs(archive_dir, exist_ok=True)
+                os.replace(path, os.path.join(archive_dir, folder))
+                os.makedirs(path)
+                log(f"Папка {folder} перенесена в архив")
+                continue
+            for file in os.listdir(path):
+                file_path = os.path.join(path, file)
+                if os.path.isdir(file_path):
+                    shutil.rmtree(file_path)
+                else:
+                    os.remove(file_path)
+            log(f"Очищена папка: {folder}")
+        self.logs.clear()
+        self.coefficient_index.clear()
+        self.report_index.clear()
+        self.rollups.clear()
+        self.persist_rollups()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS voice_sessions (
+    id INTEGER PRIMARY KEY,
+    moderator_id INTEGER NOT NULL,
+    channel_id INTEGER,
+    start_ts REAL,
+    duration INTEGER NOT NULL,
+    contacts TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_voice_moderator_start ON voice_sessions (moderator_id, start_ts);
+CREATE INDEX IF NOT EXISTS idx_voice_start ON voice_sessions (start_ts);
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    moderator_id INTEGER NOT NULL,
+    created_ts REAL NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reports_moderator_created ON reports (moderator_id, created_ts);
+CREATE INDEX IF NOT EXISTS idx_reports_created ON reports (created_ts);
+CREATE TABLE IF NOT EXISTS moderator_info (
+    moderator_id INTEGER PRIMARY KEY,
+    params TEXT NOT NULL,
+    coefficient REAL
+);
+CREATE TABLE IF NOT EXISTS contact_totals (
+    moderator_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    seconds INTEGER NOT NULL,
+    PRIMARY KEY (moderator_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def connect_sqlite(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    # Базы, созданные до учета контактов
+    if 'contacts' not in {row[1] for row in conn.execute('PRAGMA table_info(voice_sessions)')}:
+        conn.execute('ALTER TABLE voice_sessions ADD COLUMN contacts TEXT')
+    return conn
+
+def contact_rows(user_id, contacts: dict) -> list:
+    return [(user_id, int(contact_id), int(seconds)) for contact_id, seconds in contacts.items()]
+
+def insert_contacts(conn: sqlite3.Connection, rows: list):
+    conn.executemany(
+        'INSERT INTO contact_totals (moderator_id, user_id, seconds) VALUES (?, ?, ?) '
+        'ON CONFLICT(moderator_id, user_id) DO UPDATE SET seconds = seconds + excluded.seconds',
+        rows
+    )
+
+def parse_date(date_str: str):
+    try:
+        return datetime.datetime.strptime(date_str, DATE_FORMAT).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def in_period(ts: float, start: float = None, end: float = None) -> bool:
+    """Записи без даты попадают только в выгрузку без периода"""
+    if start is None and end is None:
+        return True
+    return ts is not None and (start is None or ts >= start) and (end is None or ts <= end)
+
+class SQLiteStorage(Storage):
+    """SQLite в режиме WAL; вставки копятся в памяти и пишутся пачками в отдельном потоке"""
+
+    name = 'sqlite'
+
+    def __init__(self, db_path: str, recent_limit: int = 100, flush_interval: float = 1.0, flush_size: int = 500):
+        self.db_path = db_path
+        self.recent_limit = recent_limit
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self.coefficient_index = CoefficientIndex()
+        self.report_index = ReportIndex()
+        self._conn = None
+        self._voice_rows = []
+        self._report_rows = []
+        self._contact_rows = []
+        self._lock = None
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    async def _run_db(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._conn = await self._run_db(connect_sqlite, self.db_path)
+        await self._load_coefficients()
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+        log(f"SQLite хранилище открыто: {self.db_path}")
+
+    async def _flush_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                log(f"\033[31mОшибка пакетной записи в SQLite: {str(e)}\033[0m", level='error')
+
+    def _queued(self):
+        if self._wakeup is not None and len(self._voice_rows) + len(self._report_rows) >= self.flush_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        if self._conn is None:
+            return
+        async with self._lock:
+            voice_rows, self._voice_rows = self._voice_rows, []
+            report_rows, self._report_rows = self._report_rows, []
+            contact_rows, self._contact_rows = self._contact_rows, []
+            if voice_rows or report_rows:
+                started = time.perf_counter()
+                await self._run_db(self._insert_batch, voice_rows, report_rows, contact_rows)
+                sqlite_batch_seconds.observe(time.perf_counter() - started)
+                sqlite_rows_inserted.inc(len(voice_rows), table='voice_sessions')
+                sqlite_rows_inserted.inc(len(report_rows), table='reports')
+
+    def _insert_batch(self, voice_rows: list, report_rows: list, contact_rows: list):
+        with self._conn:
+            if voice_rows:
+                self._conn.executemany(
+                    'INSERT INTO voice_sessions (moderator_id, channel_id, start_ts, duration, contacts) VALUES (?, ?, ?, ?, ?)',
+                    voice_rows
+                )
+            if contact_rows:
+                insert_contacts(self._conn, contact_rows)
+            if report_rows:
+                self._conn.executemany(
+                    'INSERT INTO reports (moderator_id, created_ts, text) VALUES (?, ?, ?)',
+                    report_rows
+                )
+
+    async def close(self):
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        if self._conn is not None:
+            await self._run_db(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+        log("SQLite хранилище закрыто")
+
+    def add_voice_session(self, user_id, channel_id, start, seconds, contacts=None):
+        self._voice_rows.append((
+            user_id, channel_id, start.timestamp() if start else None, int(seconds),
+            format_contacts(contacts) if contacts else None
+        ))
+        if contacts:
+            self._contact_rows.extend(contact_rows(user_id, contacts))
+        self._queued()
+
+    def add_report(self, user_id, date_str, text):
+        row = (user_id, parse_date(date_str) or time.time(), text)
+        self._report_rows.append(row)
+        self.report_index.add(*row)
+        self._queued()
+
+    async def _query(self, sql: str, args=()) -> list:
+        await self.flush()
+        return await self._run_db(lambda: self._conn.execute(sql, args).fetchall())
+
+    async def set_moderator_info(self, user_id, params, K):
+        def upsert():
+            with self._conn:
+                self._conn.execute(
+                    'INSERT INTO moderator_info (moderator_id, params, coefficient) VALUES (?, ?, ?) '
+                    'ON CONFLICT(moderator_id) DO UPDATE SET params = excluded.params, coefficient = excluded.coefficient',
+                    (user_id, json.dumps(params), round(K, 4))
+                )
+        await self._run_db(upsert)
+        self.coefficient_index.set(user_id, round(K, 4))
+
+    @staticmethod
+    def _voice_lines(user_id, rows) -> list:
+        return [
+            format_voice_line(
+                user_id, channel_id, datetime.datetime.fromtimestamp(start_ts), duration,
+                parse_contacts(contacts) if contacts else None
+            )
+            if start_ts is not None else f"Moderator: {user_id} | Duration: {format_duration(duration)}\n"
+            for channel_id, start_ts, duration, contacts in rows
+        ]
+
+    @staticmethod
+    def _report_blocks(user_id, rows) -> list:
+        return [
+            format_report(user_id, datetime.datetime.fromtimestamp(created_ts).strftime(DATE_FORMAT), text)
+            for created_ts, text in rows
+        ]
+
+    async def voice_log_text(self, user_id):
+        rows = await self._query(
+            'SELECT channel_id, start_ts, duration, contacts FROM voice_sessions WHERE moderator_id = ? ORDER BY start_ts',
+            (user_id,)
+        )
+        return ''.join(self._voice_lines(user_id, rows))
+
+    async def reports_text(self, user_id):
+        rows = await self._query(
+            'SELECT created_ts, text FROM reports WHERE moderator_id = ? ORDER BY created_ts',
+            (user_id,)
+        )
+        return ''.join(self._report_blocks(user_id, rows))
+
+    async def _range_query(self, columns: str, table: str, ts_column: str, user_id, start, end, offset, limit):
+        where = 'moderator_id = ?'
+        args = (user_id,)
+        if start is not None:
+            where += f' AND {ts_column} >= ?'
+            args += (start,)
+        if end is not None:
+            where += f' AND {ts_column} <= ?'
+            args += (end,)
+        total = (await self._query(f'SELECT COUNT(*) FROM {table} WHERE {where}', args))[0][0]
+        rows = await self._query(
+            f'SELECT {columns} FROM {table} WHERE {where} ORDER BY {ts_column} LIMIT ? OFFSET ?',
+            args + (limit if limit is not None else -1, offset)
+        )
+        return rows, total
+
+    async def voice_log_entries(self, user_id, start=None, end=None, offset=0, limit=None):
+        rows, total = await self._range_query(
+            'channel_id, start_ts, duration, contacts', 'voice_sessions', 'start_ts', user_id, start, end, offset, limit
+        )
+        return self._voice_lines(user_id, rows), total
+
+    async def voice_log_tail(self, user_id, count):
+        rows = await self._query(
+            'SELECT channel_id, start_ts, duration, contacts FROM voice_sessions WHERE moderator_id = ? '
+            'ORDER BY start_ts DESC LIMIT ?',
+            (user_id, count)
+        )
+        return self._voice_lines(user_id, reversed(rows))
+
+    async def report_entries(self, user_id, start=None, end=None, offset=0, limit=None):
+        rows, total = await self._range_query(
+            'created_ts, text', 'reports', 'created_ts', user_id, start, end, offset, limit
+        )
+        return self._report_blocks(user_id, rows), total
+
+    async def report_tail(self, user_id, count):
+        rows = await self._query(
+            'SELECT created_ts, text FROM reports WHERE moderator_id = ? ORDER BY created_ts DESC LIMIT ?',
+            (user_id, count)
+        )
+        return self._report_blocks(user_id, reversed(rows))
+
+    async def _load_coefficients(self):
+        rows = await self._run_db(
+            lambda: self._conn.execute('SELECT moderator_id, coefficient FROM moderator_info').fetchall()
+        )
+        self.coefficient_index.replace_all(dict(rows))
+
+    async def leaderboard(self):
+        return self.coefficient_index
+
+    async def moderator_params(self):
+        rows = await self._query('SELECT moderator_id, params FROM moderator_info')
+        return {str(user_id): json.loads(params) for user_id, params in rows if params}
+
+    async def summaries(self):
+        await self.flush()
+        return await self._run_db(self._summaries)
+
+    def _summaries(self) -> dict:
+        moderators = {}
+
+        def get(user_id):
+            key = str(user_id)
+            if key not in moderators:
+                moderators[key] = empty_rollup()
+            return moderators[key]
+
+        for user_id, total, sessions, first_start, last_end in self._conn.execute(
+            'SELECT moderator_id, SUM(duration), COUNT(*), MIN(start_ts), MAX(start_ts + duration) '
+            'FROM voice_sessions GROUP BY moderator_id'
+        ):
+            rollup = get(user_id)
+            rollup.update(total_seconds=total, sessions=sessions, first_start=first_start, last_end=last_end)
+        for user_id, count in self._conn.execute('SELECT moderator_id, COUNT(*) FROM reports GROUP BY moderator_id'):
+            get(user_id)['report_count'] = count
+        for user_id, created_ts, text in self._conn.execute(
+            'SELECT moderator_id, created_ts, text FROM ('
+            '  SELECT moderator_id, created_ts, text,'
+            '         ROW_NUMBER() OVER (PARTITION BY moderator_id ORDER BY created_ts DESC) AS rn'
+            '  FROM reports'
+            ') WHERE rn <= ? ORDER BY moderator_id, created_ts',
+            (self.recent_limit,)
+        ):
+            date_str = datetime.datetime.fromtimestamp(created_ts).strftime(DATE_FORMAT)
+            get(user_id)['recent_reports'].append([date_str, text.strip()[:REPORT_TEXT_LIMIT]])
+        for user_id, K in self._conn.execute('SELECT moderator_id, coefficient FROM moderator_info'):
+            get(user_id)['coefficient'] = K
+        for user_id, contact_id, seconds in self._conn.execute('SELECT moderator_id, user_id, seconds FROM contact_totals'):
+            get(user_id)['contacts'][str(contact_id)] = seconds
+        return moderators
+
+    async def _load_report_index(self):
+        return await self._run_db(lambda: self.report_index.load(
+            self._conn.execute('SELECT moderator_id, created_ts, text FROM reports ORDER BY id')
+        ))
+
+    def iter_records(self, kind, user_id=None, start=None, end=None):
+        # Отдельное соединение только для чтения: в режиме WAL оно не мешает пакетным вставкам
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        try:
+            if kind == 'info':
+                where, args = ('WHERE moderator_id = ?', (user_id,)) if user_id is not None else ('', ())
+                for moderator_id, params, K in conn.execute(
+                    f'SELECT moderator_id, params, coefficient FROM moderator_info {where} ORDER BY moderator_id', args
+                ):
+                    yield moderator_id, K, json.loads(params)
+                return
+            table, ts_column, columns = {
+                'voice': ('voice_sessions', 'start_ts', 'moderator_id, channel_id, start_ts, duration, contacts'),
+                'report': ('reports', 'created_ts', 'moderator_id, created_ts, text')
+            }[kind]
+            conditions, args = [], ()
+            if user_id is not None:
+                conditions.append('moderator_id = ?')
+                args += (user_id,)
+            if start is not None:
+                conditions.append(f'{ts_column} >= ?')
+                args += (start,)
+            if end is not None:
+                conditions.append(f'{ts_column} <= ?')
+                args += (end,)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+            for row in conn.execute(f'SELECT {columns} FROM {table} {where} ORDER BY moderator_id, {ts_column}', args):
+                if kind == 'voice':
+                    yield row[:4] + (parse_contacts(row[4]) if row[4] else {},)
+                else:
+                    yield row
+        finally:
+            conn.close()
+
+    async def reset(self, archive_dir=None):
+        await self.flush()
+
+        def clear():
+            if archive_dir:
+                os.makedirs(archive_dir, exist_ok=True)
+                target = sqlite3.connect(os.path.join(archive_dir, os.path.basename(self.db_path)))
+                try:
+                    self._conn.backup(target)
+                finally:
+                    target.close()
+            with self._conn:
+                for table in ('voice_sessions', 'contact_totals', 'reports', 'moderator_info', 'meta'):
+                    self._conn.execute(f'DELETE FROM {table}')
+        await self._run_db(clear)
+        self.coefficient_index.clear()
+        self.report_index.clear()
+        log(f"SQLite хранилище очищено{f', копия сохранена в {archive_dir}' if archive_dir else ''}")
+
+    async def import_files(self, base_dir: str, force: bool = False) -> dict:
+        await self.flush()
+        result = await self._run_db(import_text_files, self._conn, base_dir, force)
+        await self._load_coefficients()
+        self.report_index.clear()
+        return result
+
+def take_existing(existing: Counter, key) -> bool:
+    """Вычеркивает key из снимка базы; True, если такая запись там еще оставалась"""
+    if existing[key] > 0:
+        existing[key] -= 1
+        return True
+    return False
+
+def import_text_files(conn: sqlite3.Connection, base_dir: str, force: bool = False) -> dict:
+    """Одноразовый перенос старых текстовых файлов в SQLite.
+
+    Повторный импорт (force) пропускает сессии и доклады, которые уже были в базе до его
+    начала, и не трогает сохраненные коэффициенты, поэтому данные не удваиваются.
+    """
+    if not force and conn.execute("SELECT value FROM meta WHERE key = 'files_imported_at'").fetchone():
+        return {'skipped': True}
+    counts = {'voice_sessions': 0, 'reports': 0, 'moderators': 0}
+    # Сверка идет со снимком базы до импорта, а не с только что вставленным: одинаковые
+    # строки в самих файлах (например, сессии и доклады без даты) - это разные записи
+    existing_sessions = Counter()
+    existing_reports = Counter()
+    if force:
+        existing_sessions.update(conn.execute('SELECT moderator_id, channel_id, start_ts, duration FROM voice_sessions'))
+        existing_reports.update(conn.execute('SELECT moderator_id, created_ts, text FROM reports'))
+    with conn:
+        for user_id, path in log_files(os.path.join(base_dir, 'voice_logs'), '_voice_logs.txt'):
+            rows = []
+            for line in iter_log_lines(path):
+                try:
+                    parsed = parse_voice_line(line)
+                except ValueError:
+                    continue
+                if parsed:
+                    start, seconds, channel_id, contacts = parsed
+                    key = (int(user_id), channel_id, start.timestamp() if start else None, seconds)
+                    if take_existing(existing_sessions, key):
+                        continue
+                    rows.append(key + (format_contacts(contacts) if contacts else None,))
+                    insert_contacts(conn, contact_rows(int(user_id), contacts))
+            conn.executemany(
+                'INSERT INTO voice_sessions (moderator_id, channel_id, start_ts, duration, contacts) VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+            counts['voice_sessions'] += len(rows)
+
+        for user_id, path in log_files(os.path.join(base_dir, 'reports'), '_report.txt'):
+            rows = [
+                row for row in (
+                    (int(user_id), parse_date(report.get('date')) or 0.0, report.get('text') or '')
+                    for report in parse_reports(iter_log_lines(path))
+                )
+                if not take_existing(existing_reports, row)
+            ]
+            conn.executemany('INSERT INTO reports (moderator_id, created_ts, text) VALUES (?, ?, ?)', rows)
+            counts['reports'] += len(rows)
+
+        moderator_info_dir = os.path.join(base_dir, 'moderator_info')
+        if os.path.isdir(moderator_info_dir):
+            for filename in os.listdir(moderator_info_dir):
+                if not filename.endswith('_info.txt'):
+                    continue
+                user_id = int(filename.split('_')[0])
+                params, K = read_moderator_info(os.path.join(moderator_info_dir, filename))
+                # Коэффициенты в базе могли поменяться после первого импорта - повторный их не затирает
+                cursor = conn.execute(
+                    f"INSERT OR {'IGNORE' if force else 'REPLACE'} INTO moderator_info (moderator_id, params, coefficient) "
+                    'VALUES (?, ?, ?)',
+                    (user_id, json.dumps(params), K)
+                )
+                counts['moderators'] += cursor.rowcount
+
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('files_imported_at', ?)",
+            (datetime.datetime.now().strftime(DATE_FORMAT),)
+        )
+    return counts
+
+def create_storage(backend: str, base_dir: str, writer, recent_limit: int = 100, sqlite_path: str = None,
+                   flush_interval: float = 1.0) -> Storage:
+    if backend == 'files':
+        return FileStorage(base_dir, writer, recent_limit)
+    if backend == 'sqlite':
+        return SQLiteStorage(sqlite_path or os.path.join(base_dir, 'bot.db'), recent_limit, flush_interval)
+    raise ValueError(f"Неизвестный тип хранилища: {backend}")
+
+if __name__ == '__main__':
+    # python storage.py import [путь к базе] [--force]
+    if len(sys.argv) < 2 or sys.argv[1] != 'import':
+        print("Использование: python storage.py import [путь к базе] [--force]")
+        sys.exit(1)
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    args = [arg for arg in sys.argv[2:] if arg != '--force']
+    db_path = args[0] if args else os.path.join(base_dir, 'bot.db')
+    conn = connect_sqlite(db_path)
+    try:
+        result = import_text_files(conn, base_dir, force='--force' in sys.argv)
+    finally:
+        conn.close()
+    if result.get('skipped'):
+        log("Импорт уже выполнялся, используйте --force для повторного")
+    else:
+        log(f"Импорт завершен: сессий {result['voice_sessions']}, докладов {result['reports']}, модераторов {result['moderators']}")
@@ -0,0 +1,99 @@
+import asyncio
+from pipeline import EventPipeline
+
+class Recorder:
+    """Обработчик, запоминающий (ключ, событие) в порядке обработки"""
+
+    def __init__(self, fail_on=None):
+        self.handled = []
+        self.fail_on = fail_on
+
+    async def __call__(self, key, events):
+        for event in events:
+            # Обработчик сам ждет: следующая пачка не должна начаться раньше, чем он закончит
+            await asyncio.sleep(0)
+            if event == self.fail_on:
+                raise RuntimeError(f"сбой на {event}")
+            self.handled.append((key, event))
+
+    def of(self, key) -> list:
+        return [event for handled_key, event in self.handled if handled_key == key]
+
+def run_pipeline(handler, feed, **kwargs) -> EventPipeline:
+    async def go():
+        pipeline = EventPipeline(handler, **kwargs)
+        pipeline.start()
+        await feed(pipeline)
+        await pipeline.stop()
+        return pipeline
+    return asyncio.run(go())
+
+def test_events_of_one_key_keep_order():
+    handler = Recorder()
+
+    async def feed(pipeline):
+        async def producer(key):
+            for i in range(50):
+                await pipeline.put(key, i)
+                if i % 7 == 0:
+                    await asyncio.sleep(0)
+        await asyncio.gather(producer('a'), producer('b'), producer(('channel', 1)))
+
+    pipeline = run_pipeline(handler, feed, batch_size=4)
+    for key in ('a', 'b', ('channel', 1)):
+        assert handler.of(key) == list(range(50))
+    assert pipeline.processed == 150
+
+def test_keys_are_interleaved():
+    handler = Recorder()
+
+    async def feed(pipeline):
+        for i in range(10):
+            await pipeline.put('a', i)
+        await pipeline.put('b', 0)
+        await pipeline.put('b', 1)
+        await pipeline.put('c', 0)
+
+    run_pipeline(handler, feed, batch_size=2)
+    # Длинная очередь 'a' отдает обработчик другим ключам после каждой пачки
+    assert [key for key, _ in handler.handled[:6]] == ['a', 'a', 'b', 'b', 'c', 'a']
+    assert handler.of('a') == list(range(10))
+
+def test_call_waits_only_for_its_key():
+    handler = Recorder()
+    order = []
+
+    async def feed(pipeline):
+        for i in range(20):
+            await pipeline.put('a', i)
+
+        async def mark():
+            order.append(len(handler.of('a')))
+            return 'ok'
+        assert await pipeline.call('b', mark) == 'ok'
+
+    run_pipeline(handler, feed, batch_size=5)
+    # Вызов для 'b' выполнился после первой пачки 'a', не дожидаясь остальных
+    assert order == [5]
+
+def test_failed_batch_does_not_stop_key():
+    handler = Recorder(fail_on='boom')
+    results = []
+
+    async def feed(pipeline):
+        for event in (1, 'boom', 2, 3):
+            await pipeline.put('a', event)
+        await pipeline.join()
+
+        async def fail():
+            raise ValueError('нет')
+        try:
+            await pipeline.call('a', fail)
+        except ValueError as e:
+            results.append(str(e))
+        await pipeline.put('a', 4)
+
+    pipeline = run_pipeline(handler, feed, batch_size=1)
+    assert handler.of('a') == [1, 2, 3, 4]
+    assert results == ['нет']
+    assert pipeline.processed == 6
@@ -0,0 +1,76 @@
+import math
+from search import BM25_B, BM25_K1, ReportIndex
+
+DAY = 86400
+
+def build_index(documents) -> ReportIndex:
+    index = ReportIndex()
+    index.begin()
+    index.load(documents)
+    index.finish()
+    return index
+
+def texts(results) -> list:
+    return [text for _, _, _, text in results]
+
+def test_bm25_score_and_ranking():
+    index = build_index([
+        (1, 1 * DAY, "спам спам спам в общем чате"),
+        (1, 2 * DAY, "спам в общем чате"),
+        (2, 3 * DAY, "спам в общем чате и еще много других слов про правила сервера"),
+        (2, 4 * DAY, "оскорбления в общем чате"),
+        (3, 5 * DAY, "флуд в голосовом канале")
+    ])
+    results, total = index.search('спам')
+    assert total == 3
+    # Чаще встречается - выше; при равной частоте короткий доклад выше длинного
+    assert texts(results) == [
+        "спам спам спам в общем чате",
+        "спам в общем чате",
+        "спам в общем чате и еще много других слов про правила сервера"
+    ]
+    # Однобуквенные "в" и "и" в длину доклада не входят
+    lengths = [5, 3, 10, 3, 3]
+    average = sum(lengths) / len(lengths)
+    idf = math.log(1 + (5 - 3 + 0.5) / (3 + 0.5))
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[0] / average)
+    assert math.isclose(results[0][0], idf * 3 * (BM25_K1 + 1) / (3 + norm))
+
+    # Редкое слово весит больше частого: 'чате' есть почти везде
+    rare, _ = index.search('оскорбления чате')
+    common, _ = index.search('спам чате')
+    assert rare[0][0] > common[1][0]
+    # Нужны все слова запроса
+    assert index.search('спам флуд') == ([], 0)
+    assert texts(index.search('флуд* голос*')[0]) == ["флуд в голосовом канале"]
+
+def test_equal_scores_newest_first():
+    index = build_index([(1, ts * DAY, "нарушение правил") for ts in (3, 1, 2)])
+    results, total = index.search('нарушение')
+    assert total == 3
+    assert [ts for _, _, ts, _ in results] == [3 * DAY, 2 * DAY, 1 * DAY]
+
+def test_paging_and_filters():
+    index = build_index([
+        (user_id, day * DAY, "жалоба " * (1 + day % 4) + "на участника " + "сервера " * (day % 3))
+        for day in range(25)
+        for user_id in (1, 2)
+    ])
+    full, total = index.search('жалоба')
+    assert total == 50 and len(full) == 50
+    pages = [index.search('жалоба', offset=offset, limit=20) for offset in (0, 20, 40)]
+    assert [len(page) for page, _ in pages] == [20, 20, 10]
+    assert all(page_total == 50 for _, page_total in pages)
+    assert [result for page, _ in pages for result in page] == full
+    assert index.search('жалоба', offset=60, limit=20) == ([], 50)
+
+    mine, mine_total = index.search('жалоба', user_id=2, start=10 * DAY, end=19 * DAY, offset=5, limit=3)
+    assert mine_total == 10
+    assert len(mine) == 3
+    assert all(user_id == 2 and 10 * DAY <= ts <= 19 * DAY for _, user_id, ts, _ in mine)
+    assert mine == index.search('жалоба', user_id=2, start=10 * DAY, end=19 * DAY)[0][5:8]
+
+    # Доклад, пришедший после построения, сразу участвует в поиске и подсчете страниц
+    index.add(1, 30 * DAY, "жалоба жалоба жалоба жалоба жалоба")
+    results, total = index.search('жалоба', limit=1)
+    assert total == 51 and results[0][2] == 30 * DAY
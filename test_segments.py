@@ -0,0 +1,161 @@
+import os
+import copy
+import asyncio
+import datetime
+import fakes
+from segments import list_segments, month_start, read_header, segment_dir
+from storage import DATA_FOLDERS, DATE_FORMAT, FOLDER_MAP, FileStorage, format_report, format_voice_line
+from writer import FileWriter
+
+MOD_ROLE = 1001
+CATEGORY = 2001
+
+def build_guild(moderators: int = 3) -> fakes.FakeGuild:
+    guild = fakes.FakeGuild(1)
+    role = fakes.FakeRole(MOD_ROLE, guild)
+    for c in range(3):
+        guild.add_channel(100 + c, CATEGORY)
+    for m in range(moderators):
+        guild.add_member(1000 + m, [role])
+    return guild
+
+def write_history(base_dir: str, guild, months: int = 3, current: bool = True):
+    """Сессии и доклады модераторов за months прошлых месяцев и, если current, за первый день текущего"""
+    for folder in DATA_FOLDERS:
+        os.makedirs(os.path.join(base_dir, folder), exist_ok=True)
+    this_month = datetime.datetime.fromtimestamp(month_start())
+    first = this_month
+    for _ in range(months):
+        first = (first - datetime.timedelta(days=1)).replace(day=1)
+    days = (this_month - first).days + (1 if current else 0)
+    voice_folder, voice_suffix = FOLDER_MAP['voice']
+    report_folder, report_suffix = FOLDER_MAP['report']
+    for member in guild.members.values():
+        voice = []
+        reports = []
+        for day in range(days):
+            date = first + datetime.timedelta(days=day, hours=member.id % 12)
+            for i in range(2):
+                channel = guild.voice_channels[(day + i) % len(guild.voice_channels)]
+                voice.append(format_voice_line(
+                    member.id, channel.id, date + datetime.timedelta(hours=i), 600 + day * 10 + i, {member.id + 1: 60 + i}
+                ))
+            if day % 5 == 0:
+                reports.append(format_report(member.id, date.strftime(DATE_FORMAT), f"Доклад за день {day}: проверено {day % 7} жалоб"))
+        with open(os.path.join(base_dir, voice_folder, f"{member.id}{voice_suffix}"), 'w', encoding='utf-8') as f:
+            f.write(''.join(voice))
+        with open(os.path.join(base_dir, report_folder, f"{member.id}{report_suffix}"), 'w', encoding='utf-8') as f:
+            f.write(''.join(reports))
+
+async def snapshot(storage, guild) -> dict:
+    """Все ответы хранилища, которые сжатие не должно менять"""
+    boundary = month_start()
+    result = {'rollups': copy.deepcopy(await storage.summaries())}
+    for user_id in guild.members:
+        result[user_id] = [
+            await storage.voice_log_entries(user_id),
+            await storage.voice_log_entries(user_id, boundary - 40 * 86400, boundary - 20 * 86400, 3, 7),
+            await storage.voice_log_entries(user_id, boundary - 3 * 86400, None, 0, 50),
+            await storage.report_entries(user_id),
+            await storage.report_entries(user_id, None, None, 2, 3),
+            await storage.voice_log_tail(user_id, 5),
+            await storage.report_tail(user_id, 4),
+            await storage.voice_log_text(user_id),
+            await storage.reports_text(user_id)
+        ]
+    return result
+
+def test_compaction_keeps_rollups_and_queries(tmp_path):
+    base_dir = str(tmp_path)
+    guild = build_guild()
+    write_history(base_dir, guild)
+
+    async def run():
+        storage = FileStorage(base_dir, FileWriter())
+        await storage.start()
+        before = await snapshot(storage, guild)
+        assert await storage.compact(force=True) > 0
+        compacted = await snapshot(storage, guild)
+        # Итоги закрытых месяцев теперь берутся из заголовков сегментов
+        await storage.rebuild()
+        rebuilt = await snapshot(storage, guild)
+        # Новый экземпляр читает индексы и итоги с диска
+        reopened = FileStorage(base_dir, FileWriter())
+        await reopened.start()
+        return before, compacted, rebuilt, await snapshot(reopened, guild), storage
+
+    before, compacted, rebuilt, reopened, storage = asyncio.run(run())
+    for user_id in guild.members:
+        assert len(list_segments(segment_dir(storage.path(user_id, 'voice')))) == 3
+        assert len(list_segments(segment_dir(storage.path(user_id, 'report')))) == 3
+        with open(storage.path(user_id, 'voice'), encoding='utf-8') as f:
+            assert len(f.readlines()) == 2
+    assert compacted == before
+    assert rebuilt == before
+    assert reopened == before
+
+def test_index_follows_rewritten_segment(tmp_path):
+    base_dir = str(tmp_path)
+    guild = build_guild(1)
+    user_id = next(iter(guild.members))
+    write_history(base_dir, guild, months=2, current=False)
+    last_month = datetime.datetime.fromtimestamp(month_start() - 1)
+    window = (last_month.replace(day=1, hour=0, minute=0, second=0, microsecond=0).timestamp(), month_start() - 1)
+
+    async def run():
+        storage = FileStorage(base_dir, FileWriter())
+        await storage.start()
+        await storage.compact(force=True)
+        entries, total = await storage.voice_log_entries(user_id, *window)
+        segment_path = list_segments(segment_dir(storage.path(user_id, 'voice')))[-1][1]
+        assert read_header(segment_path)['entries'] == total
+
+        # Сессия прошлого месяца, записанная уже после сжатия, сначала лежит в текущем файле
+        late = last_month.replace(day=15, hour=23, minute=59, second=0, microsecond=0)
+        storage.add_voice_session(user_id, 101, late, 4321)
+        late_line = format_voice_line(user_id, 101, late, 4321)
+        active = await storage.voice_log_entries(user_id, *window)
+        assert active[1] == total + 1 and active[0][-1] == late_line
+
+        # Повторное сжатие переписывает сегмент месяца, индекс текущего файла строится заново
+        assert await storage.compact(force=True) == 1
+        assert read_header(segment_path)['entries'] == total + 1
+        assert os.path.getsize(storage.path(user_id, 'voice')) == 0
+        assert await storage.voice_log_entries(user_id, month_start(), None) == ([], 0)
+        merged, merged_total = await storage.voice_log_entries(user_id, *window)
+        assert merged_total == total + 1
+        assert merged.count(late_line) == 1
+        starts = [line.split('Date: ')[1].split(' |')[0] for line in merged]
+        assert starts == sorted(starts, key=lambda value: datetime.datetime.strptime(value, DATE_FORMAT))
+        assert [line for line in merged if line != late_line] == entries
+
+        # Дозапись после перезаписи попадает в новый индекс
+        now = datetime.datetime.now().replace(microsecond=0)
+        storage.add_voice_session(user_id, 102, now, 60)
+        assert await storage.voice_log_entries(user_id, now.timestamp(), None) == (
+            [format_voice_line(user_id, 102, now, 60)], 1
+        )
+
+    asyncio.run(run())
+
+def test_offset_index_resets_when_file_shrinks(tmp_path):
+    base_dir = str(tmp_path)
+    guild = build_guild(1)
+    user_id = next(iter(guild.members))
+    write_history(base_dir, guild, months=1)
+
+    async def run():
+        storage = FileStorage(base_dir, FileWriter())
+        _, total = await storage.voice_log_entries(user_id)
+        path = storage.path(user_id, 'voice')
+        assert os.path.exists(f"{path}.idx")
+        # Файл поправили вручную: оставили только первые записи
+        with open(path, encoding='utf-8') as f:
+            kept = f.readlines()[:5]
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(''.join(kept))
+        assert total > 5
+        assert await storage.voice_log_entries(user_id) == (kept, 5)
+        assert await storage.voice_log_tail(user_id, 2) == kept[-2:]
+
+    asyncio.run(run())
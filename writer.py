@@ -0,0 +1,158 @@
+import os
+import time
+import asyncio
+from logger import log
+from metrics import registry
+
+write_batch_seconds = registry.histogram('bot_file_write_batch_seconds', 'Время записи одной пачки файлов')
+
+FSYNC_POLICIES = ('none', 'batch', 'interval')
+
+class FileWriter:
+    """Отложенная запись в файлы: очередь дозаписи на каждый файл и фоновый сброс вне event loop"""
+
+    def __init__(self, flush_interval: float = 1.0, flush_size: int = 64 * 1024,
+                 fsync: str = 'none', fsync_interval: float = 30.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Неизвестная политика fsync: {fsync}")
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self._buffers = {}
+        self._replacements = {}
+        self._pending_bytes = 0
+        self._wakeup = None
+        self._lock = None
+        self._task = None
+        self._stopping = False
+        self._last_fsync = 0.0
+        self.writes = 0
+        self.bytes_written = 0
+
+    def append(self, path: str, content: str):
+        """Ставит строку в очередь на дозапись, не блокируя event loop"""
+        self._buffers.setdefault(path, []).append(content)
+        self._pending_bytes += len(content)
+        if self._wakeup is not None and self._pending_bytes >= self.flush_size:
+            self._wakeup.set()
+
+    def replace(self, path: str, producer):
+        """Ставит полную перезапись файла; producer вызывается при сбросе, повторные вызовы схлопываются"""
+        self._buffers.pop(path, None)
+        self._replacements[path] = producer
+
+    def pending(self, path: str = None) -> int:
+        if path is None:
+            return sum(len(chunks) for chunks in self._buffers.values()) + len(self._replacements)
+        return len(self._buffers.get(path, ())) + (path in self._replacements)
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        log(f"Фоновая запись запущена (интервал {self.flush_interval}с, порог {self.flush_size} символов, fsync: {self.fsync})")
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                log(f"\033[31mОшибка фоновой записи: {str(e)}\033[0m", level='error')
+
+    async def flush(self, path: str = None):
+        """Сбрасывает очередь (целиком или для одного файла) на диск и дожидается окончания записи"""
+        if self._lock is None:
+            self._write_batch(self._take(path))
+            return
+        async with self._lock:
+            batch = self._take(path)
+            if batch:
+                await asyncio.get_running_loop().run_in_executor(None, self._write_batch, batch)
+
+    async def exclusive(self, func, *args):
+        """Сбрасывает очередь и выполняет func в пуле потоков, пока фоновая запись не трогает файлы"""
+        if self._lock is None:
+            self._write_batch(self._take())
+            return func(*args)
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            batch = self._take()
+            if batch:
+                await loop.run_in_executor(None, self._write_batch, batch)
+            return await loop.run_in_executor(None, func, *args)
+
+    def _take(self, path: str = None) -> dict:
+        if path is None:
+            appends, self._buffers = self._buffers, {}
+            replacements, self._replacements = self._replacements, {}
+        else:
+            appends = {path: self._buffers.pop(path)} if path in self._buffers else {}
+            replacements = {path: self._replacements.pop(path)} if path in self._replacements else {}
+        self._pending_bytes -= sum(len(c) for chunks in appends.values() for c in chunks)
+        batch = {}
+        for target, producer in replacements.items():
+            try:
+                batch[target] = (producer(), [])
+            except Exception as e:
+                log(f"\033[31mОшибка подготовки данных для {os.path.basename(target)}: {str(e)}\033[0m", level='error')
+        for target, chunks in appends.items():
+            batch[target] = (batch[target][0] if target in batch else None, chunks)
+        return batch
+
+    def _write_batch(self, batch: dict):
+        started = time.perf_counter()
+        now = time.monotonic()
+        sync = self.fsync == 'batch' or (
+            self.fsync == 'interval' and now - self._last_fsync >= self.fsync_interval
+        )
+        for path, (replacement, chunks) in batch.items():
+            try:
+                if replacement is not None:
+                    tmp_path = f"{path}.tmp"
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        f.write(replacement)
+                        if sync:
+                            f.flush()
+                            os.fsync(f.fileno())
+                    os.replace(tmp_path, path)
+                    self.writes += 1
+                    self.bytes_written += len(replacement)
+                if chunks:
+                    data = ''.join(chunks)
+                    with open(path, 'a', encoding='utf-8') as f:
+                        f.write(data)
+                        if sync:
+                            f.flush()
+                            os.fsync(f.fileno())
+                    self.writes += 1
+                    self.bytes_written += len(data)
+            except Exception as e:
+                log(f"\033[31mОшибка записи в {os.path.basename(path)}: {str(e)}\033[0m", level='error')
+        if sync:
+            self._last_fsync = now
+        write_batch_seconds.observe(time.perf_counter() - started)
+
+    def discard(self):
+        """Отбрасывает всё, что ещё не записано"""
+        self._buffers.clear()
+        self._replacements.clear()
+        self._pending_bytes = 0
+
+    async def stop(self):
+        """Останавливает фоновую задачу и гарантированно дописывает очередь"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        log("Фоновая запись остановлена, очередь сброшена на диск")